@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Лесенка битрейтов для веб-плееров (HLS и/или DASH) из одного декодирования.
+Ступени - уровни качества compress_video (low, medium, high): исходник декодируется
+один раз, граф фильтров делит кадры и масштабирует их под каждую ступень, а все
+кодеры x264 работают одновременно с общей сеткой ключевых кадров, поэтому сегменты
+разных ступеней начинаются с одних и тех же кадров и плеер переключается между ними
+без разрывов
+"""
+
+import os
+import shutil
+from collections import namedtuple
+from pathlib import Path
+
+from ffmpeg_progress import run_ffmpeg
+
+
+# Длительность сегмента в секундах; ключевые кадры ставятся ровно на границах
+SEGMENT_SECONDS = 4
+
+# 'both' - сегменты fMP4 одни на DASH и HLS
+LADDER_FORMATS = ('hls', 'dash', 'both')
+
+# Потолок битрейта ступени относительно ориентировочного битрейта уровня
+# и размер буфера VBV относительно потолка: плееру нужна заявленная полоса
+MAXRATE_FACTOR = 1.5
+BUFSIZE_FACTOR = 2.0
+
+
+# Ступень лесенки: quality - уровень из QUALITY_SETTINGS, maxrate - бит/с
+Rendition = namedtuple('Rendition', [
+    'quality', 'width', 'height', 'crf', 'preset', 'maxrate', 'audio_bitrate'
+])
+
+
+class AbrLadderError(Exception):
+    """Лесенку битрейтов не удалось собрать"""
+
+
+def _even(value):
+    return max(2, int(value) // 2 * 2)
+
+
+def build_ladder(info, quality_settings):
+    """
+    Ступени лесенки по уровням качества (от меньшего битрейта к большему)
+
+    Args:
+        info: MediaInfo исходника (нужен видеопоток с размерами)
+        quality_settings: QUALITY_SETTINGS из compress_video
+
+    Returns:
+        Список Rendition
+    """
+    video = info.video if info else None
+    if not video or not video.width or not video.height:
+        raise AbrLadderError("не удалось определить размер кадра исходника")
+    fps = min(video.fps or 30, 60)
+
+    ladder = []
+    for quality, settings in sorted(quality_settings.items(),
+                                    key=lambda item: item[1]['video_bitrate']):
+        # Как в plan_compression: длинная сторона только уменьшается. Размеры из
+        # media_probe - при показе, то есть с учётом поворота исходника
+        scale = min(1.0, settings['max_size'] / max(video.width, video.height))
+        width, height = _even(video.width * scale), _even(video.height * scale)
+        bitrate = settings['video_bitrate'] * (width * height) / (1920 * 1080) * fps / 30
+        rendition = Rendition(quality, width, height, settings['crf'], settings['preset'],
+                              int(bitrate * MAXRATE_FACTOR), settings['audio_bitrate'])
+        if rendition[1:] not in [r[1:] for r in ladder]:
+            ladder.append(rendition)
+    return ladder
+
+
+def gop_size(info):
+    """Кадров между ключевыми кадрами: ровно один сегмент"""
+    fps = (info.video.fps if info and info.video else None) or 30
+    return max(1, round(fps * SEGMENT_SECONDS))
+
+
+def scale_filter(rendition):
+    """
+    Задаётся только короткая сторона, длинную ffmpeg выводит из кадра: пропорции
+    при показе сохраняются, даже если поворот исходника не удалось определить
+    """
+    if rendition.width >= rendition.height:
+        return f"scale=-2:{rendition.height},format=yuv420p"
+    return f"scale={rendition.width}:-2,format=yuv420p"
+
+
+def video_args(rendition, index, gop):
+    """Параметры x264 ступени; index - номер видеопотока в результате"""
+    spec = f"v:{index}"
+    return [
+        f"-c:{spec}", 'libx264',
+        f"-crf:{spec}", str(rendition.crf),
+        f"-preset:{spec}", rendition.preset,
+        f"-maxrate:{spec}", str(rendition.maxrate),
+        f"-bufsize:{spec}", str(int(rendition.maxrate * BUFSIZE_FACTOR)),
+        # Одинаковая сетка ключевых кадров у всех ступеней, без внеплановых на сменах сцен
+        f"-g:{spec}", str(gop),
+        f"-keyint_min:{spec}", str(gop),
+        f"-sc_threshold:{spec}", '0',
+        f"-force_key_frames:{spec}", f"expr:gte(t,n_forced*{SEGMENT_SECONDS})",
+    ]
+
+
+def audio_args(rendition, index):
+    spec = f"a:{index}"
+    return [f"-c:{spec}", 'aac', f"-b:{spec}", rendition.audio_bitrate, f"-ac:{spec}", '2']
+
+
+def build_command(ffmpeg_path, input_path, output_dir, info, ladder, fmt='hls'):
+    """
+    Команда ffmpeg: одно декодирование, split и scale на каждую ступень, все кодеры
+    и упаковщик HLS или DASH в одном процессе
+    """
+    if fmt not in LADDER_FORMATS:
+        raise AbrLadderError(f"неизвестный формат лесенки: {fmt}")
+    has_audio = bool(info.audio)
+    gop = gop_size(info)
+
+    labels = [f"[v{i}]" for i in range(len(ladder))]
+    graph = [f"[0:{info.video.index}]split={len(ladder)}" + ''.join(labels)]
+    for i, rendition in enumerate(ladder):
+        graph.append(f"[v{i}]{scale_filter(rendition)}[out{i}]")
+
+    cmd = [ffmpeg_path, '-i', input_path, '-filter_complex', ';'.join(graph)]
+    for i, rendition in enumerate(ladder):
+        cmd.extend(['-map', f"[out{i}]"])
+        if has_audio:
+            cmd.extend(['-map', f"0:{info.audio.index}"])
+    for i, rendition in enumerate(ladder):
+        cmd.extend(video_args(rendition, i, gop))
+        if has_audio:
+            cmd.extend(audio_args(rendition, i))
+
+    output_dir = str(output_dir)
+    if fmt == 'hls':
+        streams = ' '.join(
+            f"v:{i},a:{i},name:{r.quality}_{r.height}p" if has_audio
+            else f"v:{i},name:{r.quality}_{r.height}p"
+            for i, r in enumerate(ladder)
+        )
+        cmd.extend([
+            '-f', 'hls', '-hls_time', str(SEGMENT_SECONDS), '-hls_playlist_type', 'vod',
+            '-hls_segment_filename', os.path.join(output_dir, '%v', 'segment_%05d.ts'),
+            '-master_pl_name', 'master.m3u8', '-var_stream_map', streams,
+            '-y', os.path.join(output_dir, '%v', 'playlist.m3u8'),
+        ])
+    else:
+        sets = 'id=0,streams=v id=1,streams=a' if has_audio else 'id=0,streams=v'
+        cmd.extend([
+            '-f', 'dash', '-seg_duration', str(SEGMENT_SECONDS),
+            '-use_template', '1', '-use_timeline', '1', '-adaptation_sets', sets,
+            '-init_seg_name', 'init-$RepresentationID$.m4s',
+            '-media_seg_name', 'chunk-$RepresentationID$-$Number%05d$.m4s',
+        ])
+        if fmt == 'both':
+            # Плейлисты HLS ссылаются на те же сегменты fMP4
+            cmd.extend(['-hls_playlist', '1'])
+        cmd.extend(['-y', os.path.join(output_dir, 'manifest.mpd')])
+    return cmd
+
+
+def output_dir_for(input_path):
+    """Папка лесенки рядом с исходником: <имя>_abr, <имя>_abr_1..."""
+    path = Path(input_path)
+    output_dir = path.parent / f"{path.stem}_abr"
+    counter = 1
+    while output_dir.exists():
+        output_dir = path.parent / f"{path.stem}_abr_{counter}"
+        counter += 1
+    return str(output_dir)
+
+
+def _list_files(directory):
+    return {
+        os.path.join(root, name)
+        for root, _, names in os.walk(directory) for name in names
+    }
+
+
+def package_ladder(ffmpeg_path, input_path, output_dir, info, ladder, fmt='hls', live=True):
+    """
+    Кодирует лесенку и записывает сегменты и плейлисты в output_dir.
+    При ошибке удаляется только то, что записано этим вызовом
+
+    Returns:
+        Путь к главному плейлисту (master.m3u8 или manifest.mpd)
+    """
+    created = not os.path.isdir(output_dir)
+    existing = set() if created else _list_files(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    cmd = build_command(ffmpeg_path, input_path, output_dir, info, ladder, fmt)
+    returncode, log = run_ffmpeg(cmd, duration=info.duration,
+                                 label=os.path.basename(input_path), live=live)
+    if returncode != 0:
+        if created:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        else:
+            for path in _list_files(output_dir) - existing:
+                os.remove(path)
+        raise AbrLadderError(log)
+    name = 'master.m3u8' if fmt == 'hls' else 'manifest.mpd'
+    return os.path.join(output_dir, name)
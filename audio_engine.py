@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+План сжатия аудио: кодек выбирается по контейнеру результата (MP3, AAC, Vorbis, Opus),
+поток, который уже укладывается в бюджет битрейта, копируется без перекодирования.
+Несжатые и редкие форматы (WAV, FLAC, WMA, AC3) сохраняются в компактный контейнер.
+Короткие файлы пакета объединяются в группы и кодируются одним запуском ffmpeg
+"""
+
+import os
+from collections import namedtuple
+
+from toolchain import encoder_args, pick_encoder
+
+
+# Кодеки: кодеры ffmpeg по предпочтению, имена кодека у ffprobe и битрейт
+# для стерео по качеству (моно - вдвое меньше)
+AUDIO_CODECS = {
+    'mp3': {
+        'encoders': ['libmp3lame'],
+        'codec_names': ['mp3'],
+        'bitrates': {'low': 96000, 'medium': 128000, 'high': 192000},
+    },
+    'aac': {
+        'encoders': ['aac', 'aac_at', 'libfdk_aac'],
+        'codec_names': ['aac'],
+        'bitrates': {'low': 80000, 'medium': 112000, 'high': 160000},
+    },
+    'vorbis': {
+        'encoders': ['libvorbis', 'vorbis'],
+        'codec_names': ['vorbis'],
+        'bitrates': {'low': 80000, 'medium': 112000, 'high': 160000},
+    },
+    'opus': {
+        'encoders': ['libopus', 'opus'],
+        'codec_names': ['opus'],
+        'bitrates': {'low': 48000, 'medium': 64000, 'high': 96000},
+    },
+}
+
+# Контейнеры результата: допустимые кодеки (первый - по умолчанию) и параметры формата
+AUDIO_CONTAINERS = {
+    '.mp3': {'codecs': ['mp3'], 'extra': []},
+    '.m4a': {'codecs': ['aac'], 'extra': ['-movflags', '+faststart']},
+    '.aac': {'codecs': ['aac'], 'extra': []},
+    '.ogg': {'codecs': ['vorbis', 'opus'], 'extra': []},
+    '.opus': {'codecs': ['opus'], 'extra': []},
+}
+
+# Контейнер для форматов, которые сами по себе не сжимаются (WAV, FLAC, WMA, AC3),
+# по предпочтению: берётся первый, для которого есть кодер
+TARGET_SUFFIXES = ['.opus', '.m4a', '.mp3']
+
+# Кодеки без потерь: их битрейт не ограничивает битрейт результата
+LOSSLESS_CODECS = {'flac', 'alac', 'wavpack', 'ape', 'tta', 'truehd', 'mlp'}
+
+# Минимальный битрейт моно
+MIN_MONO_BITRATE = 24000
+
+# Файлы не длиннее этого (секунды) кодируются группами по AUDIO_GROUP_SIZE
+SHORT_AUDIO_SECONDS = 120
+AUDIO_GROUP_SIZE = 16
+
+
+# action: 'encode', 'copy' или 'skip'; codec - ключ AUDIO_CODECS (None - по умолчанию ffmpeg)
+AudioPlan = namedtuple('AudioPlan', ['action', 'codec', 'encoder', 'bitrate', 'extra', 'reason'])
+
+
+def _is_lossless(codec_name):
+    return bool(codec_name) and (codec_name in LOSSLESS_CODECS or codec_name.startswith('pcm_'))
+
+
+def output_suffix(input_path):
+    """Расширение результата: контейнер исходника или компактный, если он не сжимается"""
+    suffix = os.path.splitext(input_path)[1].lower()
+    if suffix in AUDIO_CONTAINERS:
+        return suffix
+    for target in TARGET_SUFFIXES:
+        if pick_encoder(AUDIO_CODECS[AUDIO_CONTAINERS[target]['codecs'][0]]['encoders']):
+            return target
+    return '.mp3'
+
+
+def _stream_bitrate(info, stream):
+    """Битрейт потока; у Ogg и Opus его знает только контейнер"""
+    if stream.bit_rate:
+        return stream.bit_rate
+    if info.bit_rate and len(info.streams) == 1:
+        return info.bit_rate
+    return None
+
+
+def target_bitrate(codec, quality, channels=None):
+    bitrates = AUDIO_CODECS[codec]['bitrates']
+    bitrate = bitrates.get(quality, bitrates['medium'])
+    if channels == 1:
+        bitrate = max(MIN_MONO_BITRATE, bitrate // 2)
+    return bitrate
+
+
+def plan_audio(info, output_path, quality='medium', force=False):
+    """
+    Составляет план сжатия аудио в контейнер output_path
+
+    Args:
+        info: MediaInfo исходника (None - перекодирование с параметрами по умолчанию)
+        output_path: Результат; его расширение определяет кодек
+        quality: Качество сжатия ('low', 'medium', 'high')
+        force: Перекодировать даже поток, который уже укладывается в бюджет
+
+    Returns:
+        AudioPlan
+    """
+    container = AUDIO_CONTAINERS.get(os.path.splitext(output_path)[1].lower())
+    if container is None:
+        # Неизвестный контейнер: кодек выберет ffmpeg
+        return AudioPlan('encode', None, None, None, [], None)
+
+    stream = info.audio if info else None
+    source_codec = stream.codec_name if stream else None
+    codec = container['codecs'][0]
+    for name in container['codecs']:
+        if source_codec in AUDIO_CODECS[name]['codec_names']:
+            codec = name
+    settings = AUDIO_CODECS[codec]
+    encoder = pick_encoder(settings['encoders'])
+    bitrate = target_bitrate(codec, quality, stream.channels if stream else None)
+    source_bitrate = _stream_bitrate(info, stream) if stream else None
+
+    if stream and source_codec in settings['codec_names'] and source_bitrate \
+            and source_bitrate <= bitrate * 1.05 and not force:
+        reason = (f"битрейт аудио {source_bitrate // 1000}k уже не выше "
+                  f"целевого {bitrate // 1000}k")
+        if len(info.streams) == 1:
+            return AudioPlan('skip', codec, None, None, container['extra'],
+                             f"{reason} - сжатый файл не станет меньше")
+        # Обложки и прочие потоки убираются, звук копируется как есть
+        return AudioPlan('copy', codec, None, None, container['extra'],
+                         f"{reason}, поток копируется без перекодирования")
+
+    # Сжатый источник не перекодируется в битрейт выше собственного
+    if stream and source_bitrate and not _is_lossless(source_codec):
+        bitrate = min(bitrate, max(MIN_MONO_BITRATE, source_bitrate))
+    return AudioPlan('encode', codec, encoder, bitrate, container['extra'], None)
+
+
+def audio_args(plan, threads=None):
+    """Параметры ffmpeg для одного результата по плану (без входа и имени файла)"""
+    args = ['-map', '0:a:0']
+    if plan.action == 'copy':
+        args.extend(['-c:a', 'copy'])
+    elif plan.encoder:
+        args.extend(['-c:a', plan.encoder] + encoder_args(plan.encoder))
+        if plan.encoder == 'opus':
+            # Встроенный кодер Opus принимает только 48 кГц
+            args.extend(['-ar', '48000'])
+    if plan.action != 'copy' and plan.bitrate:
+        args.extend(['-b:a', str(plan.bitrate)])
+    if threads:
+        args.extend(['-threads', str(threads)])
+    return args + ['-vn', '-sn', '-dn'] + list(plan.extra)
+
+
+def build_group_command(ffmpeg_path, items, threads=None):
+    """
+    Одна команда ffmpeg для нескольких файлов
+
+    Args:
+        items: Список (исходник, результат, AudioPlan)
+
+    Returns:
+        Команда: все входы, затем для каждого - свои потоки, теги и результат
+    """
+    cmd = [ffmpeg_path, '-y']
+    for input_path, _, _ in items:
+        cmd.extend(['-i', input_path])
+    for index, (_, output_path, plan) in enumerate(items):
+        args = audio_args(plan, threads)
+        args[1] = f"{index}:a:0"
+        # Без этого все результаты получили бы теги первого входа
+        cmd.extend(args + ['-map_metadata', str(index), '-map_chapters', str(index), output_path])
+    return cmd
+
+
+def short_audio_groups(files, file_types, durations):
+    """
+    Делит файлы пакета на группы коротких аудиофайлов и остальные
+
+    Args:
+        files: Пути в порядке пакета
+        file_types: {путь: тип файла}
+        durations: {путь: длительность или None}
+
+    Returns:
+        (список групп, остальные файлы)
+    """
+    groups = []
+    singles = []
+    current = []
+    for path in files:
+        duration = durations.get(path)
+        if file_types.get(path) == 'audio' and duration and duration <= SHORT_AUDIO_SECONDS:
+            current.append(path)
+            if len(current) == AUDIO_GROUP_SIZE:
+                groups.append(current)
+                current = []
+        else:
+            singles.append(path)
+    if len(current) > 1:
+        groups.append(current)
+    else:
+        singles.extend(current)
+    return groups, singles
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Время сборки лесенки битрейтов: одно декодирование на все ступени (abr_ladder)
+против кодирования ступеней по очереди - отдельный запуск ffmpeg на каждую с теми же
+параметрами x264 (упаковка в сегменты в этот вариант не входит - это только ремукс).
+
+    python benchmarks/abr.py                  # замер и сравнение с базой
+    python benchmarks/abr.py --save-baseline  # сохранить замер как базу
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+import subprocess
+
+from common import add_baseline_arguments, report_regressions, summarize
+
+import abr_ladder
+from compress_video import QUALITY_SETTINGS
+from ffmpeg_progress import run_ffmpeg
+from media_probe import probe
+from toolchain import find_ffmpeg, find_ffprobe
+
+
+# Абсолютный запас на шум, в секундах
+SLACK = 0.5
+
+
+def make_source(work_dir, size, duration):
+    """Тестовый сигнал с мелкими деталями и звуком"""
+    path = os.path.join(work_dir, 'source.mp4')
+    cmd = [
+        find_ffmpeg(), '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate=30',
+        '-f', 'lavfi', '-i', 'sine=frequency=440',
+        '-t', str(duration), '-c:v', 'libx264', '-crf', '16', '-preset', 'veryfast',
+        '-c:a', 'aac', path
+    ]
+    subprocess.run(cmd, check=True, stdin=subprocess.DEVNULL)
+    return path
+
+
+def run_ladder(source, info, ladder, work_dir, fmt):
+    output_dir = os.path.join(work_dir, 'ladder')
+    shutil.rmtree(output_dir, ignore_errors=True)
+    start = time.time()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        abr_ladder.package_ladder(find_ffmpeg(), source, output_dir, info, ladder, fmt,
+                                  live=False)
+    return time.time() - start
+
+
+def run_sequential(source, info, ladder, work_dir):
+    gop = abr_ladder.gop_size(info)
+    start = time.time()
+    for i, rendition in enumerate(ladder):
+        cmd = [find_ffmpeg(), '-i', source, '-map', f"0:{info.video.index}",
+               '-vf', abr_ladder.scale_filter(rendition)]
+        cmd.extend(abr_ladder.video_args(rendition, 0, gop))
+        if info.audio:
+            cmd.extend(['-map', f"0:{info.audio.index}"] + abr_ladder.audio_args(rendition, 0))
+        cmd.extend(['-y', os.path.join(work_dir, f'rendition_{i}.mp4')])
+        returncode, log = run_ffmpeg(cmd, report=False)
+        if returncode != 0:
+            raise RuntimeError(log)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время сборки лесенки битрейтов")
+    parser.add_argument('--size', default='1920x1080', help="Размер кадра исходника")
+    parser.add_argument('--duration', type=float, default=10, help="Длительность, с")
+    parser.add_argument('--runs', type=int, default=2, help="Прогонов на способ")
+    parser.add_argument('--format', choices=abr_ladder.LADDER_FORMATS, default='hls',
+                        help="Формат лесенки")
+    add_baseline_arguments(parser)
+    args = parser.parse_args()
+
+    if not find_ffmpeg():
+        print("ОШИБКА: ffmpeg не найден!")
+        sys.exit(1)
+
+    work_dir = tempfile.mkdtemp(prefix='szimat_abr_')
+    results = {}
+    try:
+        source = make_source(work_dir, args.size, args.duration)
+        info = probe(source, find_ffprobe(), use_cache=False)
+        ladder = abr_ladder.build_ladder(info, QUALITY_SETTINGS)
+        print("Ступени: " + ", ".join(f"{r.quality} {r.width}x{r.height}" for r in ladder))
+        scenarios = {
+            'ladder': lambda: run_ladder(source, info, ladder, work_dir, args.format),
+            'sequential': lambda: run_sequential(source, info, ladder, work_dir),
+        }
+        for name, measure in scenarios.items():
+            summary = summarize([measure() for _ in range(args.runs)])
+            results[name] = summary
+            print(f"{name:<11} p50 {summary['p50']:7.2f} с   "
+                  f"min {summary['min']:7.2f}   max {summary['max']:7.2f}")
+        print(f"\nУскорение одного декодирования: "
+              f"{results['sequential']['p50'] / results['ladder']['p50']:.2f}x")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    sys.exit(report_regressions(results, args, 'abr', 'p50', slack=SLACK))
+
+
+if __name__ == '__main__':
+    main()
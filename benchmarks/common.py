@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Общие функции бенчмарков: перцентили, сохранённая база и сравнение с ней
+"""
+
+import os
+import sys
+import json
+from pathlib import Path
+
+# Бенчмарки запускаются из папки benchmarks, модули проекта лежат уровнем выше
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from media_probe import cache_dir
+
+
+# Допустимое ухудшение относительно базы (доля) и абсолютный запас на шум
+DEFAULT_TOLERANCE = 0.20
+
+
+def percentile(values, p):
+    """Перцентиль с линейной интерполяцией (p от 0 до 100)"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values):
+    """Сводка замеров: min, p50, p90, p99, max, mean"""
+    return {
+        'runs': len(values),
+        'min': min(values),
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': max(values),
+        'mean': sum(values) / len(values),
+    }
+
+
+def default_baseline_path(name):
+    """База хранится в кэше программы: она своя для каждой машины"""
+    path = os.path.join(cache_dir(), 'benchmarks')
+    os.makedirs(path, exist_ok=True)
+    return os.path.join(path, f"{name}.json")
+
+
+def load_baseline(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_baseline(path, results):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+def compare(results, baseline, metric='p50', tolerance=DEFAULT_TOLERANCE, slack=0.0,
+            higher_is_better=False):
+    """
+    Сравнивает результаты с базой
+
+    Args:
+        results, baseline: {сценарий: сводка}
+        metric: Сравниваемое поле сводки
+        tolerance: Допустимое ухудшение (доля)
+        slack: Абсолютный запас на шум измерений
+        higher_is_better: Больше - лучше (пропускная способность)
+
+    Returns:
+        Список описаний регрессий (пустой - регрессий нет)
+    """
+    regressions = []
+    for name, summary in results.items():
+        base = (baseline or {}).get(name)
+        if not base or base.get(metric) is None or summary.get(metric) is None:
+            continue
+        current, reference = summary[metric], base[metric]
+        if higher_is_better:
+            limit = reference * (1 - tolerance) - slack
+            worse = current < limit
+        else:
+            limit = reference * (1 + tolerance) + slack
+            worse = current > limit
+        if worse:
+            regressions.append(
+                f"{name}: {metric} {current:.4g} при базе {reference:.4g} (предел {limit:.4g})"
+            )
+    return regressions
+
+
+def report_regressions(results, args, name, unit_metric='p50', slack=0.0, higher_is_better=False,
+                       checks=()):
+    """
+    Сохраняет базу (--save-baseline) или сравнивает с ней
+
+    Args:
+        checks: Дополнительные поля сводки: (поле, допуск, запас, больше - лучше)
+
+    Returns:
+        Код выхода: 1 при регрессии, иначе 0
+    """
+    baseline_path = args.baseline or default_baseline_path(name)
+    if args.save_baseline:
+        save_baseline(baseline_path, results)
+        print(f"\nБаза сохранена: {baseline_path}")
+        return 0
+    baseline = load_baseline(baseline_path)
+    if baseline is None:
+        print(f"\nБазы нет ({baseline_path}), сохраните её параметром --save-baseline")
+        return 0
+    regressions = compare(results, baseline, unit_metric, args.tolerance, slack, higher_is_better)
+    for metric, tolerance, check_slack, better in checks:
+        regressions.extend(compare(results, baseline, metric, tolerance, check_slack, better))
+    if regressions:
+        print("\nРЕГРЕССИЯ относительно базы:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"\nРегрессий нет (допуск {args.tolerance:.0%})")
+    return 0
+
+
+def add_baseline_arguments(parser):
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="Сохранить результаты как базу для сравнения")
+    parser.add_argument('--baseline', default=None, help="Файл базы (по умолчанию - в кэше)")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="Допустимое ухудшение относительно базы (доля)")
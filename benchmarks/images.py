@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Пропускная способность пакетного сжатия изображений (изображений в секунду)
+для обоих способов: ffmpeg на каждый файл и Pillow в пуле процессов.
+
+    python benchmarks/images.py                  # замер и сравнение с базой
+    python benchmarks/images.py --save-baseline  # сохранить замер как базу
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+import subprocess
+
+from common import add_baseline_arguments, report_regressions, summarize
+
+# Кэш результатов отключён: иначе повторный прогон не кодирует ничего
+os.environ['SZIMAT_OUTPUT_CACHE_MB'] = '0'
+
+import compress_video
+import image_engine
+from toolchain import find_ffmpeg
+
+
+def make_images(work_dir, count, size):
+    """Кадры тестового сигнала: половина в JPEG, половина в PNG"""
+    source_dir = os.path.join(work_dir, 'source')
+    os.makedirs(source_dir)
+    for ext, frames in (('jpg', (count + 1) // 2), ('png', count // 2)):
+        if not frames:
+            continue
+        cmd = [
+            find_ffmpeg(), '-v', 'error',
+            '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate=25',
+            '-frames:v', str(frames), '-q:v', '2',
+            os.path.join(source_dir, f'img_%04d.{ext}')
+        ]
+        subprocess.run(cmd, check=True, stdin=subprocess.DEVNULL)
+    return source_dir
+
+
+def measure(backend, source_dir, work_dir, jobs):
+    """Один прогон пакета, возвращает число изображений в секунду"""
+    run_dir = os.path.join(work_dir, 'run')
+    shutil.rmtree(run_dir, ignore_errors=True)
+    shutil.copytree(source_dir, run_dir)
+    files = sorted(os.path.join(run_dir, name) for name in os.listdir(run_dir))
+
+    image_engine.BACKEND = backend
+    start = time.time()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results = compress_video.compress_batch(files, 'medium', jobs)
+    elapsed = time.time() - start
+    failed = [r for r in results if r['error']]
+    if failed:
+        raise RuntimeError(f"{backend}: {failed[0]['input']}: {failed[0]['error']}")
+    return len(files) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пропускная способность сжатия изображений")
+    parser.add_argument('--count', type=int, default=200, help="Изображений в пакете")
+    parser.add_argument('--size', default='1280x720', help="Размер изображений")
+    parser.add_argument('--runs', type=int, default=3, help="Прогонов на способ")
+    parser.add_argument('--jobs', type=int, default=None, help="Ёмкость пула задач")
+    add_baseline_arguments(parser)
+    args = parser.parse_args()
+
+    if not find_ffmpeg():
+        print("ОШИБКА: ffmpeg не найден!")
+        sys.exit(1)
+    backends = ['ffmpeg']
+    if image_engine._pillow() is not None:
+        backends.append('auto')
+    else:
+        print("Pillow не установлен - замеряется только ffmpeg")
+
+    compress_video.INTERACTIVE = False
+    work_dir = tempfile.mkdtemp(prefix='szimat_images_')
+    results = {}
+    try:
+        source_dir = make_images(work_dir, args.count, args.size)
+        for backend in backends:
+            name = 'pillow' if backend == 'auto' else backend
+            summary = summarize([measure(backend, source_dir, work_dir, args.jobs)
+                                 for _ in range(args.runs)])
+            results[name] = summary
+            print(f"{name:<8} p50 {summary['p50']:7.1f} изобр/с   "
+                  f"min {summary['min']:7.1f}   max {summary['max']:7.1f}")
+        if len(results) == 2:
+            print(f"\nУскорение Pillow: {results['pillow']['p50'] / results['ffmpeg']['p50']:.1f}x")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    sys.exit(report_regressions(results, args, 'images', 'p50', higher_is_better=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Скорость, размер и качество всех путей сжатия и конвертации на синтетических файлах.
+Исходники генерируются источниками lavfi (testsrc2, mandelbrot, шум, синус) в нескольких
+разрешениях - детерминированно, без сети и файлов-образцов. По каждому сценарию
+(compress_video, convert_file, compress_audio, compress_image) выводятся время,
+пропускная способность, размер результата и качество (SSIM для видео и изображений,
+отношение сигнал/шум в дБ для аудио). Сравнение с базой ловит и замедление,
+и рост размера, и падение качества после правки QUALITY_SETTINGS, таблиц форматов
+или команд кодирования.
+
+    python benchmarks/media.py                          # замер и сравнение с базой
+    python benchmarks/media.py --save-baseline          # сохранить замер как базу
+    python benchmarks/media.py --sizes 1920x1080 --only compress_video
+"""
+
+import os
+import re
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+import subprocess
+
+from common import add_baseline_arguments, report_regressions, summarize
+
+# Кэш результатов и метрики задач отключены: иначе повторный прогон не кодирует
+# ничего, а журнал метрик засоряется замерами
+os.environ['SZIMAT_OUTPUT_CACHE_MB'] = '0'
+os.environ['SZIMAT_TELEMETRY'] = '0'
+
+import compress_video
+import convert_video
+from toolchain import find_ffmpeg
+
+
+# Источники lavfi; {size} - размер кадра
+VIDEO_SOURCES = {
+    'testsrc2': 'testsrc2=size={size}:rate=30',
+    'mandelbrot': 'mandelbrot=size={size}:rate=30',
+    # Зерно шума фиксировано в фильтре - кадры одинаковы от запуска к запуску
+    'noise': 'color=c=gray:size={size}:rate=30,noise=alls=30:allf=t+u',
+}
+AUDIO_SOURCES = {
+    'sine': 'sine=frequency=440:sample_rate=48000',
+    'noise': 'anoisesrc=color=pink:seed=42:sample_rate=48000:amplitude=0.3',
+}
+
+SCENARIOS = ('compress_video', 'convert_file', 'compress_audio', 'compress_image')
+
+# Форматы конвертации: ремукс и полное перекодирование видео, кодирование аудио,
+# изображение в WebP (Pillow или ffmpeg)
+CONVERT_FORMATS = {'video': ['mkv', 'wmv'], 'audio': ['mp3'], 'image': ['webp']}
+
+# Абсолютный запас на шум времени (с); допуски размера и качества - доли.
+# Размер и качество детерминированы, поэтому допуски у них малы
+SLACK = 0.3
+SIZE_TOLERANCE = 0.05
+QUALITY_TOLERANCE = 0.01
+
+
+_SSIM_RE = re.compile(r'SSIM .*All:([\d.]+)')
+_RMS_RE = re.compile(r'RMS level dB:\s*(-?[\d.]+|-inf)')
+
+
+def _ffmpeg(args):
+    """Запуск ffmpeg, возвращает журнал (stderr)"""
+    completed = subprocess.run(
+        [find_ffmpeg(), '-hide_banner', '-nostdin'] + args,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True, encoding='utf-8', errors='replace'
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr[-2000:])
+    return completed.stderr
+
+
+def make_media(work_dir, sizes, duration, audio_duration):
+    """
+    Исходники всех сценариев
+
+    Returns:
+        Список (имя, путь, тип файла, длительность или None, пикселей в кадре)
+    """
+    source_dir = os.path.join(work_dir, 'source')
+    os.makedirs(source_dir)
+    media = []
+    for size in sizes:
+        width, height = (int(part) for part in size.split('x'))
+        for name, source in VIDEO_SOURCES.items():
+            graph = source.format(size=size)
+            # Почти без потерь: качество результата меряется относительно этого файла
+            video = os.path.join(source_dir, f"{name}_{size}.mp4")
+            _ffmpeg(['-f', 'lavfi', '-i', graph, '-f', 'lavfi', '-i', AUDIO_SOURCES['sine'],
+                     '-t', str(duration), '-c:v', 'libx264', '-crf', '16', '-preset', 'veryfast',
+                     '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-b:a', '192k', '-y', video])
+            media.append((f"{name}_{size}", video, 'video', duration, width * height))
+            for ext in ('png', 'jpg'):
+                image = os.path.join(source_dir, f"{name}_{size}.{ext}")
+                _ffmpeg(['-f', 'lavfi', '-i', graph, '-frames:v', '1', '-q:v', '2', '-y', image])
+                media.append((f"{name}_{size}.{ext}", image, 'image', None, width * height))
+    for name, source in AUDIO_SOURCES.items():
+        audio = os.path.join(source_dir, f"{name}.wav")
+        _ffmpeg(['-f', 'lavfi', '-i', source, '-t', str(audio_duration), '-ac', '2',
+                 '-c:a', 'pcm_s16le', '-y', audio])
+        media.append((name, audio, 'audio', audio_duration, None))
+    return media
+
+
+def video_quality(encoded_path, reference_path):
+    """SSIM результата относительно исходника (исходник приводится к размеру результата)"""
+    log = _ffmpeg([
+        '-i', encoded_path, '-i', reference_path, '-lavfi',
+        '[0:v]format=yuv444p[e0];[1:v]format=yuv444p[r0];'
+        '[r0][e0]scale2ref=flags=bicubic[r][e];[e][r]ssim',
+        '-f', 'null', '-'
+    ])
+    match = _SSIM_RE.search(log)
+    return float(match.group(1)) if match else None
+
+
+def _rms_db(inputs, graph):
+    match = _RMS_RE.search(_ffmpeg(inputs + ['-filter_complex', graph, '-f', 'null', '-']))
+    if not match or match.group(1) == '-inf':
+        return None
+    return float(match.group(1))
+
+
+def audio_quality(encoded_path, reference_path):
+    """Отношение сигнал/шум результата в дБ: уровень исходника против уровня разности"""
+    fmt = 'aformat=sample_fmts=fltp:sample_rates=48000:channel_layouts=stereo'
+    stats = 'astats=measure_perchannel=none'
+    signal = _rms_db(['-i', reference_path], f"[0:a]{fmt},{stats}")
+    noise = _rms_db(
+        ['-i', reference_path, '-i', encoded_path],
+        f"[0:a]{fmt}[r];[1:a]{fmt},volume=-1[e];"
+        f"[r][e]amix=inputs=2:normalize=0:duration=shortest,{stats}"
+    )
+    if signal is None:
+        return None
+    # Разность тише любого измеримого уровня - результат без потерь
+    return round(signal - noise, 2) if noise is not None else float('inf')
+
+
+def quality_of(file_type, encoded_path, reference_path):
+    if file_type == 'audio':
+        return audio_quality(encoded_path, reference_path)
+    return video_quality(encoded_path, reference_path)
+
+
+def scenario_runs(media, only):
+    """Сценарии: (имя, тип файла, исходник, функция (исходник, папка) -> результат)"""
+    runs = []
+    for name, path, file_type, duration, pixels in media:
+        if file_type == 'video' and 'compress_video' in only:
+            runs.append((f"compress_video/{name}", file_type, path, duration, pixels,
+                         lambda src, out: compress_video.compress_video(
+                             src, os.path.join(out, 'result.mp4'), 'medium', force=True)))
+        if file_type == 'audio' and 'compress_audio' in only:
+            from audio_engine import output_suffix
+            suffix = output_suffix(path)
+            runs.append((f"compress_audio/{name}", file_type, path, duration, pixels,
+                         lambda src, out, suffix=suffix: compress_video.compress_audio(
+                             src, os.path.join(out, 'result' + suffix), 'medium', force=True)))
+        if file_type == 'image' and 'compress_image' in only:
+            ext = os.path.splitext(path)[1]
+            runs.append((f"compress_image/{name}", file_type, path, duration, pixels,
+                         lambda src, out, ext=ext: compress_video.compress_image(
+                             src, os.path.join(out, 'result' + ext), 'medium')))
+        if 'convert_file' in only:
+            for fmt in CONVERT_FORMATS[file_type]:
+                if fmt not in convert_video.get_available_formats(file_type):
+                    continue
+                runs.append((f"convert_file/{name}->{fmt}", file_type, path, duration, pixels,
+                             lambda src, out, file_type=file_type, fmt=fmt:
+                             convert_video.convert_file(
+                                 src, os.path.join(out, 'result.' + fmt), file_type, fmt)))
+    return runs
+
+
+def measure(run, work_dir, runs):
+    """Прогоны сценария: время каждого, размер и качество последнего результата"""
+    name, file_type, source, duration, pixels, fn = run
+    times = []
+    output = None
+    for _ in range(runs):
+        out_dir = os.path.join(work_dir, 'out')
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.makedirs(out_dir)
+        start = time.time()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            output = fn(source, out_dir)
+        times.append(time.time() - start)
+    if not output or not os.path.exists(output):
+        raise RuntimeError(f"{name}: нет результата")
+
+    summary = summarize(times)
+    summary['size'] = os.path.getsize(output)
+    summary['quality'] = quality_of(file_type, output, source)
+    if duration:
+        # Секунд исходника за секунду работы
+        summary['throughput'] = duration / summary['p50']
+    else:
+        # Мегапикселей за секунду
+        summary['throughput'] = pixels / 1e6 / summary['p50']
+    return summary
+
+
+def print_row(name, file_type, summary):
+    unit = 'x' if file_type != 'image' else ' Мп/с'
+    quality = summary['quality']
+    if quality is None:
+        quality_text = '-'
+    elif file_type == 'audio':
+        quality_text = f"SNR {quality:.1f} дБ"
+    else:
+        quality_text = f"SSIM {quality:.4f}"
+    print(f"{name:<44} p50 {summary['p50']:7.2f} с  {summary['throughput']:8.2f}{unit:<5} "
+          f"{summary['size'] / 1024:9.1f} KB  {quality_text}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сжатие и конвертация на синтетических файлах")
+    parser.add_argument('--sizes', default='640x360,1280x720',
+                        help="Размеры кадра через запятую")
+    parser.add_argument('--duration', type=float, default=3, help="Длительность видео, с")
+    parser.add_argument('--audio-duration', type=float, default=30,
+                        help="Длительность аудио, с")
+    parser.add_argument('--runs', type=int, default=2, help="Прогонов на сценарий")
+    parser.add_argument('--only', default=','.join(SCENARIOS),
+                        help="Сценарии через запятую: " + ', '.join(SCENARIOS))
+    add_baseline_arguments(parser)
+    args = parser.parse_args()
+
+    if not find_ffmpeg():
+        print("ОШИБКА: ffmpeg не найден!")
+        sys.exit(1)
+    only = [item.strip() for item in args.only.split(',') if item.strip()]
+    unknown = [item for item in only if item not in SCENARIOS]
+    if unknown:
+        print(f"ОШИБКА: неизвестные сценарии: {', '.join(unknown)}")
+        sys.exit(1)
+    compress_video.INTERACTIVE = False
+    convert_video.INTERACTIVE = False
+
+    work_dir = tempfile.mkdtemp(prefix='szimat_media_')
+    results = {}
+    try:
+        media = make_media(work_dir, [size.strip() for size in args.sizes.split(',')],
+                           args.duration, args.audio_duration)
+        for run in scenario_runs(media, only):
+            summary = measure(run, work_dir, args.runs)
+            results[run[0]] = summary
+            print_row(run[0], run[1], summary)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    sys.exit(report_regressions(results, args, 'media', 'p50', slack=SLACK, checks=[
+        ('size', SIZE_TOLERANCE, 0, False),
+        ('quality', QUALITY_TOLERANCE, 0, True),
+    ]))
+
+
+if __name__ == '__main__':
+    main()
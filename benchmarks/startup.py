@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Задержка запуска: время от старта интерпретатора до запуска ffmpeg
+(импорты, поиск ffmpeg, ffprobe, планирование) для точек входа контекстного меню.
+
+    python benchmarks/startup.py                  # замер и сравнение с базой
+    python benchmarks/startup.py --save-baseline  # сохранить замер как базу
+
+Точка входа запускается через обёртку, которая подменяет run_ffmpeg: при первом
+запуске ffmpeg процесс записывает время и завершается, не кодируя. Для сценариев "submit"
+запускается поддельный сервер очереди, и измеряется время до выхода процесса
+"""
+
+import os
+import sys
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+
+from common import ROOT, add_baseline_arguments, report_regressions, summarize
+
+import job_server
+from toolchain import find_ffmpeg
+
+
+# Абсолютный запас на шум, в секундах
+SLACK = 0.010
+
+# Сценарий: (скрипт и аргументы, ввод с клавиатуры, отмечается ли запуск ffmpeg)
+SCENARIOS = {
+    'compress': (['compress_video.py', '{sample}', '--no-pause', '--force'], None, True),
+    'launcher-compress': (['launcher.py', 'compress', '{sample}'], None, True),
+    'submit': (['compress_video.py', '{sample}'], None, False),
+    'launcher-submit': (['launcher.py', 'compress', '{sample}'], None, False),
+    'convert': (['convert_video.py', '{sample}'], '4\n', True),
+    'launcher-convert': (['launcher.py', 'convert', '{sample}'], '4\n', True),
+}
+
+
+# Обёртка точки входа: python -c PROBE файл-отметки скрипт аргументы...
+# run_ffmpeg подменяется до импорта скрипта, поэтому подмену видят и
+# "from ffmpeg_progress import run_ffmpeg"
+PROBE = '''
+import os, sys, time, runpy
+mark, script = sys.argv[1], sys.argv[2]
+sys.argv = sys.argv[2:]
+sys.path.insert(0, os.path.dirname(script))
+import ffmpeg_progress
+
+def run_ffmpeg(*args, **kwargs):
+    with open(mark, 'w') as f:
+        f.write(repr(time.time()))
+    os._exit(0)
+
+ffmpeg_progress.run_ffmpeg = run_ffmpeg
+runpy.run_path(script, run_name='__main__')
+'''
+
+
+def make_sample(work_dir):
+    """Короткое тестовое видео со звуком"""
+    sample = os.path.join(work_dir, 'sample.mp4')
+    cmd = [
+        find_ffmpeg(), '-v', 'error',
+        '-f', 'lavfi', '-i', 'testsrc2=size=1280x720:rate=30',
+        '-f', 'lavfi', '-i', 'sine=frequency=440',
+        '-t', '5', '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-y', sample
+    ]
+    subprocess.run(cmd, check=True, stdin=subprocess.DEVNULL)
+    return sample
+
+
+class FakeServer:
+    """Сервер очереди, который принимает задачи и ничего не делает"""
+
+    def __init__(self):
+        bound = job_server._bind_server()
+        if bound is None:
+            raise RuntimeError("адрес сервера очереди занят - закройте работающие окна")
+        self.sock, _ = bound
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            with conn:
+                conn.makefile('rb').readline()
+                conn.sendall(b'ok\n')
+
+    def close(self):
+        # shutdown прерывает accept в потоке, иначе адрес остаётся занятым
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def measure(name, sample, work_dir, env):
+    """Один запуск сценария, возвращает задержку в секундах"""
+    argv, stdin_text, marked = SCENARIOS[name]
+    mark = os.path.join(work_dir, 'mark.txt')
+    if os.path.exists(mark):
+        os.remove(mark)
+    cmd = [sys.executable] + (['-c', PROBE, mark] if marked else [])
+    cmd += [str(ROOT / argv[0])] + [a.format(sample=sample) for a in argv[1:]]
+
+    start = time.time()
+    completed = subprocess.run(
+        cmd, input=(stdin_text or '').encode('utf-8'), env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+    )
+    finish = time.time()
+    if not marked:
+        return finish - start
+    try:
+        with open(mark) as f:
+            return float(f.read()) - start
+    except (OSError, ValueError):
+        output = completed.stdout.decode('utf-8', errors='replace')
+        raise RuntimeError(f"{name}: ffmpeg не был запущен\n{output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Задержка запуска точек входа")
+    parser.add_argument('--runs', type=int, default=20, help="Замеров на сценарий")
+    parser.add_argument('--warmup', type=int, default=2, help="Прогревочных запусков")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help="Сценарий (по умолчанию - все)")
+    add_baseline_arguments(parser)
+    args = parser.parse_args()
+
+    if not find_ffmpeg():
+        print("ОШИБКА: ffmpeg не найден!")
+        sys.exit(1)
+
+    # Кэш результатов отключён: иначе повторный запуск не дойдёт до ffmpeg
+    env = dict(os.environ, SZIMAT_OUTPUT_CACHE_MB='0')
+    work_dir = tempfile.mkdtemp(prefix='szimat_startup_')
+    results = {}
+    try:
+        sample = make_sample(work_dir)
+        for name in args.scenario or list(SCENARIOS):
+            server = FakeServer() if 'submit' in name else None
+            try:
+                for _ in range(args.warmup):
+                    measure(name, sample, work_dir, env)
+                samples = [measure(name, sample, work_dir, env) for _ in range(args.runs)]
+            finally:
+                if server:
+                    server.close()
+            results[name] = summarize(samples)
+            summary = results[name]
+            print(f"{name:<20} p50 {summary['p50'] * 1000:7.1f} мс   "
+                  f"p90 {summary['p90'] * 1000:7.1f} мс   "
+                  f"p99 {summary['p99'] * 1000:7.1f} мс   "
+                  f"min {summary['min'] * 1000:7.1f} мс")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    sys.exit(report_regressions(results, args, 'startup', 'p50', SLACK))
+
+
+if __name__ == '__main__':
+    main()
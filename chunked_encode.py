@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+"""
+Параллельное кодирование видео по сегментам.
+Исходник без перекодирования режется по ключевым кадрам, сегменты кодируются
+одновременно несколькими процессами ffmpeg с одинаковыми настройками и
+склеиваются без потерь через concat-демультиплексор.
+В возобновляемом режиме сегменты и журнал хранятся рядом с результатом,
+и после прерывания перекодируются только недостающие сегменты
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from ffmpeg_progress import run_ffmpeg
+from fingerprint import fingerprint
+from media_probe import probe
+from worker_pool import cpu_count
+import telemetry
+
+
+# Минимальная длина сегмента в секундах: короче - накладные расходы больше выигрыша
+MIN_SEGMENT_SECONDS = 20
+
+# Допустимое расхождение длительности результата и исходника, в секундах
+DURATION_TOLERANCE = 0.5
+
+# Журнал возобновляемого кодирования
+JOURNAL_NAME = 'journal.json'
+JOURNAL_VERSION = 1
+
+# Длина сегмента возобновляемого кодирования: столько работы теряется при прерывании
+RESUME_SEGMENT_SECONDS = 120
+
+# Свободное место для сегментов, в размерах исходника: копия видеопотока,
+# закодированные сегменты и склеенный результат
+SPACE_FACTOR = 2
+
+
+class ChunkedEncodeError(Exception):
+    """Ошибка сегментного кодирования"""
+
+
+def keyframe_times(ffprobe_path, input_path):
+    """
+    Времена ключевых кадров первого видеопотока.
+    Читаются флаги пакетов, декодирования при этом нет
+    """
+    cmd = [
+        ffprobe_path, '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'csv=p=0',
+        input_path
+    ]
+    completed = subprocess.run(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL
+    )
+    if completed.returncode != 0:
+        raise ChunkedEncodeError("не удалось прочитать ключевые кадры")
+    times = []
+    for line in completed.stdout.decode('ascii', errors='replace').splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags:
+            try:
+                times.append(float(pts_time))
+            except ValueError:
+                continue
+    return sorted(times)
+
+
+def plan_cut_points(keyframes, duration, segments, min_length=MIN_SEGMENT_SECONDS):
+    """
+    Выбирает точки разреза среди ключевых кадров
+
+    Args:
+        keyframes: Времена ключевых кадров
+        duration: Длительность видео
+        segments: Желаемое число сегментов
+        min_length: Минимальная длина сегмента
+
+    Returns:
+        Отсортированный список времён разреза (без нуля)
+    """
+    if not keyframes or not duration or segments < 2:
+        return []
+    start = keyframes[0]
+    segments = min(segments, int(duration // min_length))
+    cuts = []
+    for i in range(1, segments):
+        target = start + duration * i / segments
+        # Ближайший ключевой кадр к равномерной точке
+        nearest = min(keyframes, key=lambda t: abs(t - target))
+        previous = cuts[-1] if cuts else start
+        if nearest - previous >= min_length and start + duration - nearest >= min_length:
+            cuts.append(nearest)
+    return cuts
+
+
+def default_workers(segment_count=None):
+    """Число одновременных процессов ffmpeg: по два ядра на процесс"""
+    workers = max(1, cpu_count() // 2)
+    if segment_count:
+        workers = min(workers, segment_count)
+    return workers
+
+
+def has_space_for_segments(input_path, output_path):
+    """Хватит ли места рядом с результатом на сегменты и склейку"""
+    try:
+        free = shutil.disk_usage(os.path.dirname(os.path.abspath(output_path))).free
+        return free >= os.path.getsize(input_path) * SPACE_FACTOR
+    except OSError:
+        return False
+
+
+def split_source(ffmpeg_path, input_path, cut_points, work_dir):
+    """Режет видеопоток на сегменты без перекодирования, возвращает пути"""
+    pattern = os.path.join(work_dir, 'src_%04d.mkv')
+    cmd = [
+        ffmpeg_path, '-i', input_path,
+        '-map', '0:v:0', '-c', 'copy',
+        '-f', 'segment',
+        '-reset_timestamps', '1',
+    ]
+    if cut_points:
+        cmd.extend(['-segment_times', ','.join(f"{t:.6f}" for t in cut_points)])
+    else:
+        cmd.extend(['-segment_time', '999999'])
+    cmd.extend(['-y', pattern])
+    returncode, log = run_ffmpeg(cmd, report=False)
+    if returncode != 0:
+        raise ChunkedEncodeError(f"не удалось разрезать исходник:\n{log}")
+    return sorted(
+        os.path.join(work_dir, name) for name in os.listdir(work_dir)
+        if name.startswith('src_') and name.endswith('.mkv')
+    )
+
+
+def encode_segment(ffmpeg_path, segment_path, output_path, video_args, threads=None):
+    """
+    Кодирует один сегмент (только видео).
+    Пишется во временный файл и переименовывается после успеха, поэтому
+    сегмент с итоговым именем всегда дописан до конца
+    """
+    root, ext = os.path.splitext(output_path)
+    partial_path = f"{root}.part{ext}"
+    cmd = [ffmpeg_path, '-i', segment_path, '-an'] + list(video_args)
+    if threads:
+        cmd.extend(['-threads', str(threads)])
+    cmd.extend(['-y', partial_path])
+    returncode, log = run_ffmpeg(cmd, report=False)
+    if returncode != 0:
+        raise ChunkedEncodeError(f"ошибка кодирования сегмента {os.path.basename(segment_path)}:\n{log}")
+    os.replace(partial_path, output_path)
+    return output_path
+
+
+def resume_dir(output_path):
+    """Папка сегментов возобновляемого кодирования рядом с результатом"""
+    output_path = os.path.abspath(output_path)
+    return os.path.join(os.path.dirname(output_path), f".{os.path.basename(output_path)}.parts")
+
+
+def load_journal(work_dir):
+    """Журнал из папки сегментов или None"""
+    try:
+        with open(os.path.join(work_dir, JOURNAL_NAME), encoding='utf-8') as f:
+            journal = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return journal if journal.get('version') == JOURNAL_VERSION else None
+
+
+def save_journal(work_dir, journal):
+    """Атомарная запись журнала: прерывание не оставляет его недописанным"""
+    path = os.path.join(work_dir, JOURNAL_NAME)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(journal, f, ensure_ascii=False, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def _media_duration(path, ffprobe_path):
+    info = probe(path, ffprobe_path, use_cache=False)
+    if info is None:
+        return None
+    return info.video.duration if info.video and info.video.duration else info.duration
+
+
+def _segment_valid(path, record, expected_duration, ffprobe_path, tolerance):
+    """Сегмент на месте, не изменился и по длительности совпадает с исходным"""
+    if not record or not os.path.isfile(path) or os.path.getsize(path) != record.get('size'):
+        return False
+    if expected_duration is None:
+        return True
+    duration = _media_duration(path, ffprobe_path)
+    return duration is not None and abs(duration - expected_duration) <= tolerance
+
+
+def _concat_list_line(path):
+    # Одинарные кавычки в пути экранируются по правилам concat-демультиплексора
+    escaped = os.path.abspath(path).replace('\\', '/').replace("'", "'\\''")
+    return f"file '{escaped}'\n"
+
+
+def join_segments(ffmpeg_path, segment_paths, input_path, output_path, audio_args,
+                  extra_args=(), work_dir=None):
+    """
+    Склеивает закодированные сегменты без перекодирования
+    и добавляет звук из исходника
+    """
+    list_path = os.path.join(work_dir or os.path.dirname(output_path), 'concat.txt')
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path in segment_paths:
+            f.write(_concat_list_line(path))
+    cmd = [
+        ffmpeg_path,
+        '-f', 'concat', '-safe', '0', '-i', list_path,
+        '-i', input_path,
+        '-map', '0:v:0', '-map', '1:a:0?',
+        '-c:v', 'copy',
+    ] + list(audio_args) + list(extra_args) + ['-y', output_path]
+    returncode, log = run_ffmpeg(cmd, report=False)
+    if returncode != 0:
+        raise ChunkedEncodeError(f"ошибка склейки сегментов:\n{log}")
+
+
+def verify_output(source_info, output_path, ffprobe_path):
+    """Сверяет длительность и число потоков результата с исходником"""
+    result = probe(output_path, ffprobe_path, use_cache=False)
+    if result is None:
+        raise ChunkedEncodeError("результат не читается ffprobe")
+    expected_streams = 1 + (1 if source_info.audio else 0)
+    actual_streams = len(result.streams_of('video')) + len(result.streams_of('audio'))
+    if actual_streams != expected_streams:
+        raise ChunkedEncodeError(
+            f"число потоков {actual_streams} вместо {expected_streams}"
+        )
+    source_duration = source_info.video.duration or source_info.duration
+    output_duration = result.video.duration if result.video and result.video.duration else result.duration
+    if source_duration and output_duration is not None:
+        fps = source_info.video.fps or 25
+        tolerance = max(DURATION_TOLERANCE, 2 / fps)
+        if abs(output_duration - source_duration) > tolerance:
+            raise ChunkedEncodeError(
+                f"длительность {output_duration:.2f} с вместо {source_duration:.2f} с"
+            )
+    return result
+
+
+def encode_chunked(ffmpeg_path, ffprobe_path, input_path, output_path, video_args,
+                   audio_args, extra_args=(), source_info=None, workers=None,
+                   segments=None, work_dir=None, live=True, resumable=False, threads=None):
+    """
+    Кодирует видео параллельно по сегментам
+
+    Args:
+        ffmpeg_path, ffprobe_path: Пути к программам
+        input_path: Исходное видео
+        output_path: Итоговый файл
+        video_args: Параметры видеокодера (например ['-c:v', 'libx264', '-crf', '23', ...])
+        audio_args: Параметры звука (например ['-c:a', 'aac', '-b:a', '128k'])
+        extra_args: Параметры контейнера (например ['-movflags', '+faststart'])
+        source_info: MediaInfo исходника (по умолчанию - probe)
+        workers: Число одновременных процессов ffmpeg
+        segments: Число сегментов (по умолчанию - по четыре на процесс, а в
+                  возобновляемом режиме - не длиннее RESUME_SEGMENT_SECONDS)
+        work_dir: Папка для сегментов (по умолчанию - временная рядом с результатом)
+        live: Перерисовывать строку прогресса
+        resumable: Хранить сегменты и журнал рядом с результатом (resume_dir) и
+                   продолжать прерванное кодирование; при ошибке папка сохраняется
+        threads: Потоков на процесс ffmpeg (по умолчанию - ядра поровну)
+
+    Returns:
+        MediaInfo результата
+    """
+    source_info = source_info or probe(input_path, ffprobe_path)
+    if source_info is None or source_info.video is None:
+        raise ChunkedEncodeError("не удалось получить сведения о видео")
+
+    workers = workers or default_workers()
+    duration = source_info.video.duration or source_info.duration
+    if not segments:
+        segments = workers * 4
+        if resumable and duration:
+            # Чем короче сегмент, тем меньше работы теряется при прерывании
+            segments = max(segments, int(duration // RESUME_SEGMENT_SECONDS))
+
+    own_dir = work_dir is None
+    try:
+        if resumable and own_dir:
+            work_dir = resume_dir(output_path)
+            os.makedirs(work_dir, exist_ok=True)
+        elif own_dir:
+            work_dir = tempfile.mkdtemp(prefix='.chunks_',
+                                        dir=os.path.dirname(os.path.abspath(output_path)))
+    except OSError as e:
+        # Текст ошибки ОС ("Permission denied") сохраняется: по нему вызывающий
+        # переходит к сохранению в папку Temp
+        raise ChunkedEncodeError(f"не удалось создать папку сегментов: {e}")
+    fps = source_info.video.fps or 25
+    tolerance = max(DURATION_TOLERANCE, 2 / fps)
+    succeeded = False
+    try:
+        # Журнал действителен только для того же исходника и тех же настроек
+        journal_key = [fingerprint(input_path), list(video_args)]
+        journal = load_journal(work_dir) if resumable else None
+        if journal and journal.get('key') == journal_key and all(
+                _segment_valid(os.path.join(work_dir, name), record, None, ffprobe_path, 0)
+                for name, record in journal['sources'].items()):
+            sources = [os.path.join(work_dir, name) for name in sorted(journal['sources'])]
+            print("  Продолжение прерванного кодирования")
+        else:
+            if resumable:
+                # Остатки кодирования другого исходника или с другими настройками
+                for name in os.listdir(work_dir):
+                    os.remove(os.path.join(work_dir, name))
+            cut_points = plan_cut_points(keyframe_times(ffprobe_path, input_path), duration, segments)
+            sources = split_source(ffmpeg_path, input_path, cut_points, work_dir)
+            journal = {
+                'version': JOURNAL_VERSION,
+                'key': journal_key,
+                'sources': {
+                    os.path.basename(path): {
+                        'size': os.path.getsize(path),
+                        'duration': _media_duration(path, ffprobe_path) if resumable else None,
+                    }
+                    for path in sources
+                },
+                'encoded': {},
+            }
+            if resumable:
+                save_journal(work_dir, journal)
+
+        # Заменяется только префикс имени сегмента: в пути папки "src_" может встречаться
+        encoded = [
+            os.path.join(work_dir, os.path.basename(path).replace('src_', 'enc_', 1))
+            for path in sources
+        ]
+        pending = [
+            (src, dst) for src, dst in zip(sources, encoded)
+            if not _segment_valid(
+                dst, journal['encoded'].get(os.path.basename(dst)),
+                journal['sources'][os.path.basename(src)]['duration'], ffprobe_path, tolerance
+            )
+        ]
+        workers = max(1, min(workers, len(pending)))
+        threads = threads or max(1, cpu_count() // workers)
+        print(f"  Сегментов: {len(sources)}, готово ранее: {len(sources) - len(pending)}, "
+              f"параллельных процессов: {workers}")
+
+        journal_lock = threading.Lock()
+        done = len(sources) - len(pending)
+        # Сегменты кодируются в рабочих потоках, а учитываются в задаче (см. telemetry)
+        bound_encode = telemetry.bind(encode_segment)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(bound_encode, ffmpeg_path, src, dst, video_args, threads): dst
+                for src, dst in pending
+            }
+            for future in as_completed(futures):
+                dst = future.result()
+                if resumable:
+                    # Готовый сегмент фиксируется в журнале сразу
+                    with journal_lock:
+                        journal['encoded'][os.path.basename(dst)] = {'size': os.path.getsize(dst)}
+                        save_journal(work_dir, journal)
+                done += 1
+                line = f"  Сегменты: {done}/{len(sources)}"
+                if live:
+                    print('\r' + line, end='', flush=True)
+                else:
+                    print(line)
+        if live:
+            print()
+
+        try:
+            join_segments(ffmpeg_path, encoded, input_path, output_path, audio_args,
+                          extra_args, work_dir)
+            result = verify_output(source_info, output_path, ffprobe_path)
+        except ChunkedEncodeError:
+            # Недописанная или не совпавшая с исходником склейка не остаётся под именем результата
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise
+        succeeded = True
+        return result
+    finally:
+        # Папку возобновляемого кодирования удаляем только после успеха
+        if own_dir and (succeeded or not resumable):
+            shutil.rmtree(work_dir, ignore_errors=True)
@@ -7,64 +7,290 @@
 
 import os
 import sys
-import subprocess
-import shutil
-import tempfile
+import glob
+import time
+import argparse
+import sqlite3
+from collections import namedtuple
 from pathlib import Path
 
+from ffmpeg_progress import run_ffmpeg
+from media_probe import detect_file_type, probe
+from toolchain import find_ffmpeg, find_ffprobe, has_encoder, has_filter
+from output_cache import get_output_cache, job_key, content_fingerprint
+import telemetry
 
-def find_ffmpeg():
-    """Поиск ffmpeg в системе"""
-    # Проверяем, установлен ли ffmpeg в PATH
-    ffmpeg_in_path = shutil.which('ffmpeg')
-    if ffmpeg_in_path:
-        return ffmpeg_in_path
+
+# В пакетном режиме ошибки не должны останавливать обработку ожиданием Enter
+INTERACTIVE = True
+
+
+def wait_for_enter(message="\nНажмите Enter для выхода..."):
+    """Ждёт нажатия Enter, если скрипт запущен для одного файла"""
+    if INTERACTIVE:
+        input(message)
+
+
+def require_encoder(name):
+    """Завершает работу с понятной ошибкой, если в ffmpeg нет нужного кодера"""
+    if not has_encoder(name):
+        print(f"ОШИБКА: в установленном ffmpeg нет кодера {name}")
+        print("Установите полную сборку ffmpeg (например, с https://www.gyan.dev/ffmpeg/builds/)")
+        wait_for_enter()
+        sys.exit(1)
+
+
+# Параметры сжатия видео в зависимости от качества.
+# max_size - предел длинной стороны кадра (меньшие видео не увеличиваются),
+# video_bitrate - ориентировочный битрейт x264 при этом CRF для 1080p 30 fps
+QUALITY_SETTINGS = {
+    'low': {
+        'crf': '28',
+        'preset': 'fast',
+        'max_size': 1280,
+        'video_bitrate': 1500000,
+        'audio_bitrate': '96k'
+    },
+    'medium': {
+        'crf': '23',
+        'preset': 'medium',
+        'max_size': 1920,
+        'video_bitrate': 3500000,
+        'audio_bitrate': '128k'
+    },
+    'high': {
+        'crf': '18',
+        'preset': 'slow',
+        'max_size': 1920,
+        'video_bitrate': 8000000,
+        'audio_bitrate': '128k'
+    }
+}
+
+
+# План сжатия видео: action - 'encode' или 'skip'
+CompressionPlan = namedtuple('CompressionPlan', [
+    'action', 'video_filter', 'audio_codec', 'audio_bitrate', 'reason', 'notes'
+])
+
+
+def _bitrate_value(text):
+    """'128k' -> 128000"""
+    text = str(text).lower()
+    if text.endswith('k'):
+        return int(float(text[:-1]) * 1000)
+    if text.endswith('m'):
+        return int(float(text[:-1]) * 1000000)
+    return int(text)
+
+
+def downscale_filter(max_size, portrait=False):
+    """
+    Масштабирование длинной стороны до max_size. Предел записан выражением min(),
+    поэтому кадр не увеличивается, даже если сведения о размере или повороте неверны
+    """
+    if portrait:
+        return f"scale=-2:'min(ih,{max_size})'"
+    return f"scale='min(iw,{max_size})':-2"
+
+
+def plan_compression(info, quality='medium', force=False):
+    """
+    Составляет план сжатия по сведениям ffprobe
     
-    # Получаем папку, где находится скрипт
-    try:
-        script_dir = Path(__file__).parent.absolute().resolve()
-    except:
-        script_dir = Path.cwd()
-    
-    # Проверяем папку проекта (где находится скрипт)
-    project_paths = [
-        script_dir / 'ffmpeg.exe',
-        script_dir / 'ffmpeg' / 'ffmpeg.exe',
-        script_dir / 'ffmpeg' / 'bin' / 'ffmpeg.exe',
+    Args:
+        info: MediaInfo исходного файла (None - план по умолчанию)
+        quality: Качество сжатия ('low', 'medium', 'high')
+        force: Не пропускать файлы, которые вряд ли уменьшатся
+        
+    Returns:
+        CompressionPlan
+    """
+    settings = QUALITY_SETTINGS.get(quality, QUALITY_SETTINGS['medium'])
+    audio_bitrate = settings['audio_bitrate']
+    video = info.video if info else None
+    
+    max_size = settings['max_size']
+    if not video or not video.width or not video.height:
+        # Без данных ffprobe: ширина ограничивается, но кадр не увеличивается
+        return CompressionPlan('encode', downscale_filter(max_size), 'aac', audio_bitrate, None, [])
+    
+    notes = []
+    # Размер при показе: повёрнутый кадр ffmpeg разворачивает до фильтров
+    width, height = video.width, video.height
+    
+    # Только уменьшаем: ограничиваем длинную сторону кадра
+    if width >= height and width > max_size:
+        video_filter = downscale_filter(max_size)
+        out_width, out_height = max_size, height * max_size / width
+    elif height > width and height > max_size:
+        video_filter = downscale_filter(max_size, portrait=True)
+        out_width, out_height = width * max_size / height, max_size
+    else:
+        out_width, out_height = width, height
+        # x264 с yuv420p требует чётных размеров
+        video_filter = None if width % 2 == 0 and height % 2 == 0 else "scale=trunc(iw/2)*2:trunc(ih/2)*2"
+        notes.append(f"Разрешение {width}x{height} сохраняется (увеличение не выполняется)")
+    if video_filter and 'min(' in video_filter:
+        notes.append(f"Уменьшение {width}x{height} → {int(out_width)}x{int(out_height)}")
+    
+    # Аудио AAC в пределах бюджета копируется без перекодирования
+    audio = info.audio
+    budget = _bitrate_value(audio_bitrate)
+    audio_codec = 'aac'
+    if audio and audio.codec_name == 'aac' and audio.bit_rate and audio.bit_rate <= budget * 1.05:
+        audio_codec = 'copy'
+        notes.append(f"Аудио AAC {audio.bit_rate // 1000}k копируется без перекодирования")
+    
+    # Битрейт исходного видео: по потоку или по контейнеру за вычетом аудио
+    source_bitrate = video.bit_rate
+    if not source_bitrate and info.bit_rate:
+        audio_total = sum(s.bit_rate or 0 for s in info.streams_of('audio'))
+        source_bitrate = info.bit_rate - audio_total
+    
+    # Ожидаемый битрейт результата пропорционален числу пикселей в секунду
+    fps = min(video.fps or 30, 60)
+    target_bitrate = settings['video_bitrate'] * (out_width * out_height) / (1920 * 1080) * fps / 30
+    
+    if source_bitrate and source_bitrate <= target_bitrate and not force:
+        reason = (f"битрейт видео {source_bitrate // 1000}k уже ниже целевого "
+                  f"~{int(target_bitrate) // 1000}k - сжатый файл не станет меньше")
+        return CompressionPlan('skip', video_filter, audio_codec, audio_bitrate, reason, notes)
+    
+    return CompressionPlan('encode', video_filter, audio_codec, audio_bitrate, None, notes)
+
+
+def build_encode_args(plan, quality='medium', crf=None, preset=None):
+    """
+    Параметры ffmpeg по плану сжатия
+    
+    Args:
+        plan: CompressionPlan
+        quality: Уровень качества
+        crf, preset: Подобранные настройки вместо настроек уровня
+    
+    Returns:
+        (параметры видео, параметры аудио, параметры контейнера)
+    """
+    settings = QUALITY_SETTINGS.get(quality, QUALITY_SETTINGS['medium'])
+    video_args = [
+        '-c:v', 'libx264',
+        '-crf', str(crf or settings['crf']),
+        '-preset', preset or settings['preset'],
     ]
+    if plan.video_filter:
+        video_args.extend(['-vf', plan.video_filter])
+    if plan.audio_codec == 'copy':
+        audio_args = ['-c:a', 'copy']
+    else:
+        audio_args = ['-c:a', plan.audio_codec, '-b:a', plan.audio_bitrate]
+    extra_args = ['-movflags', '+faststart']
+    return video_args, audio_args, extra_args
+
+
+# Сегментное кодирование включается автоматически для видео не короче
+# CHUNKED_MIN_DURATION секунд на машинах с CHUNKED_MIN_CPUS ядрами и более
+CHUNKED_MIN_DURATION = 600
+CHUNKED_MIN_CPUS = 8
+
+
+def use_chunked_encoding(info):
+    """Стоит ли кодировать видео параллельно по сегментам"""
+    from worker_pool import cpu_count
+    return bool(
+        info and info.video and info.duration
+        and info.duration >= CHUNKED_MIN_DURATION
+        and cpu_count() >= CHUNKED_MIN_CPUS
+    )
+
+
+def _encode_video_chunked(ffmpeg_path, input_path, output_path, video_args, audio_args,
+                          extra_args, info, threads=None):
+    """
+    Сегментное кодирование с журналом, возвращает (код возврата, текст ошибки).
+    С заданным threads (пакетный режим) сегменты кодируются по одному
+    """
+    from chunked_encode import ChunkedEncodeError, encode_chunked, resume_dir
     
-    for path in project_paths:
-        if path.exists():
-            return str(path)
+    print("  Кодирование по сегментам с возможностью продолжения")
+    try:
+        encode_chunked(
+            ffmpeg_path, find_ffprobe(), input_path, output_path,
+            video_args, audio_args, extra_args, source_info=info, live=INTERACTIVE,
+            resumable=True, workers=1 if threads else None, threads=threads
+        )
+    except ChunkedEncodeError as e:
+        if not os.path.isdir(resume_dir(output_path)):
+            return 1, str(e)
+        return 1, f"{e}\nГотовые сегменты сохранены в {resume_dir(output_path)}"
+    return 0, ''
+
+
+def _search_quality(ffmpeg_path, input_path, info, plan, quality_target, threads=None):
+    """
+    Подбор CRF и пресета по качеству фрагментов, возвращает (crf, preset).
+    Пробы идут в один поток каждая: их не больше threads (в пакетном режиме - бюджет задачи)
+    """
+    from quality_search import QualitySearchError, search_settings
     
-    # Также проверяем все файлы в папке проекта
+    metric, target = quality_target
+    if not has_filter(metric):
+        print(f"  В ffmpeg нет фильтра {metric}, используются настройки уровня")
+        return None, None
+    print(f"Подбор настроек: {os.path.basename(input_path)} ({metric.upper()} >= {target})")
     try:
-        for item in script_dir.iterdir():
-            if item.is_file():
-                name_lower = item.name.lower()
-                if name_lower == 'ffmpeg.exe' or name_lower == 'ffmpeg':
-                    return str(item)
-    except:
-        pass
-    
-    # Проверяем возможные стандартные пути установки
-    possible_paths = [
-        r'C:\ffmpeg\bin\ffmpeg.exe',
-        r'C:\ffmpeg\ffmpeg.exe',
-        r'C:\Program Files\ffmpeg\bin\ffmpeg.exe',
-        r'C:\Program Files (x86)\ffmpeg\bin\ffmpeg.exe',
-        r'C:\Program Files\ffmpeg\ffmpeg.exe',
-        r'C:\Program Files (x86)\ffmpeg\ffmpeg.exe',
-    ]
+        choice = search_settings(ffmpeg_path, input_path, info, plan.video_filter, metric, target,
+                                 workers=threads)
+    except QualitySearchError as e:
+        print(f"  Подбор не удался, используются настройки уровня: {e}")
+        return None, None
+    print(f"  Выбрано: CRF {choice.crf}, пресет {choice.preset} "
+          f"({metric.upper()} {choice.score:.4g})")
+    return choice.crf, choice.preset
+
+
+def _encode_video_to_size(ffmpeg_path, input_path, output_path, target_size, plan, quality,
+                          info, threads):
+    """Кодирование под целевой размер, возвращает (код возврата, текст ошибки)"""
+    from target_size import TargetSizeError, encode_to_size
+    
+    settings = QUALITY_SETTINGS.get(quality, QUALITY_SETTINGS['medium'])
+    video_args = ['-c:v', 'libx264', '-preset', settings['preset']]
+    if plan.video_filter:
+        video_args.extend(['-vf', plan.video_filter])
     
-    for path in possible_paths:
-        if os.path.exists(path):
-            return path
+    audio = info.audio if info else None
+    if not audio:
+        audio_args, audio_bitrate = [], 0
+    elif plan.audio_codec == 'copy':
+        audio_args, audio_bitrate = ['-c:a', 'copy'], audio.bit_rate
+    else:
+        audio_args, audio_bitrate = ['-c:a', plan.audio_codec], _bitrate_value(plan.audio_bitrate)
     
-    return None
+    print(f"  Целевой размер: {target_size / (1024 * 1024):.2f} MB")
+    try:
+        encode_to_size(
+            ffmpeg_path, input_path, output_path, target_size,
+            info.duration if info else None, video_args, audio_args, ['-movflags', '+faststart'],
+            audio_bitrate, threads, live=INTERACTIVE
+        )
+    except TargetSizeError as e:
+        return 1, str(e)
+    return 0, ''
+
 
+def discard_if_larger(input_path, output_path):
+    """Удаляет результат, если он не меньше исходника. Возвращает True при удалении"""
+    if os.path.getsize(output_path) < os.path.getsize(input_path):
+        return False
+    os.remove(output_path)
+    print(f"\nПропуск: сжатый файл получился не меньше исходного и не сохранён")
+    print(f"  {os.path.basename(input_path)}")
+    return True
 
-def compress_video(input_path, output_path, quality='medium'):
+
+def compress_video(input_path, output_path, quality='medium', threads=None, force=False,
+                   chunked=None, target_size=None, quality_target=None):
     """
     Сжимает видео файл используя ffmpeg
     
@@ -72,6 +298,15 @@ def compress_video(input_path, output_path, quality='medium'):
         input_path: Путь к исходному видео
         output_path: Путь для сохранения сжатого видео
         quality: Качество сжатия ('low', 'medium', 'high')
+        threads: Число потоков ffmpeg (None - на усмотрение ffmpeg)
+        force: Сжимать, даже если план считает это бесполезным
+        chunked: Кодировать по сегментам с возможностью продолжения (None - для длинных видео
+                 на многоядерных машинах)
+        target_size: Целевой размер файла в байтах (вместо фиксированного CRF)
+        quality_target: (метрика, значение) - подобрать CRF и пресет по качеству фрагментов
+        
+    Returns:
+        Путь к сжатому файлу или None, если сжатие пропущено
     """
     ffmpeg_path = find_ffmpeg()
     
@@ -86,61 +321,80 @@ def compress_video(input_path, output_path, quality='medium'):
         print("1. Скачайте с https://ffmpeg.org/download.html")
         print("2. Распакуйте и добавьте в PATH")
         print(f"3. Или поместите ffmpeg.exe в папку проекта: {script_dir}")
-        input("\nНажмите Enter для выхода...")
+        wait_for_enter()
         sys.exit(1)
     
-    # Параметры сжатия в зависимости от качества
-    quality_settings = {
-        'low': {
-            'crf': '28',
-            'preset': 'fast',
-            'scale': '1280:-2'
-        },
-        'medium': {
-            'crf': '23',
-            'preset': 'medium',
-            'scale': '1920:-2'
-        },
-        'high': {
-            'crf': '18',
-            'preset': 'slow',
-            'scale': '1920:-2'
-        }
-    }
+    require_encoder('libx264')
     
-    settings = quality_settings.get(quality, quality_settings['medium'])
+    # Разрешение, битрейт и кодеки исходника определяют план сжатия
+    info = probe(input_path, find_ffprobe())
+    duration = info.duration if info else None
+    plan = plan_compression(info, quality, force or bool(target_size))
+    
+    if target_size and not force and os.path.getsize(input_path) <= target_size:
+        plan = plan._replace(action='skip', reason="файл уже не больше целевого размера")
+    
+    telemetry.annotate(plan=plan.action, video_filter=plan.video_filter,
+                       audio_codec=plan.audio_codec, reason=plan.reason)
+    if plan.action == 'skip':
+        print(f"Пропуск: {os.path.basename(input_path)}")
+        print(f"  {plan.reason}")
+        return None
+    
+    crf = preset = None
+    if quality_target and info and info.video:
+        crf, preset = _search_quality(ffmpeg_path, input_path, info, plan, quality_target,
+                                      threads)
+    settings = QUALITY_SETTINGS.get(quality, QUALITY_SETTINGS['medium'])
+    telemetry.annotate(crf=crf or settings['crf'], preset=preset or settings['preset'])
     
     # Команда ffmpeg для сжатия
-    cmd = [
-        ffmpeg_path,
-        '-i', input_path,
-        '-c:v', 'libx264',
-        '-crf', settings['crf'],
-        '-preset', settings['preset'],
-        '-vf', f"scale={settings['scale']}",
-        '-c:a', 'aac',
-        '-b:a', '128k',
-        '-movflags', '+faststart',
+    video_args, audio_args, extra_args = build_encode_args(plan, quality, crf, preset)
+    cmd = [ffmpeg_path, '-i', input_path] + video_args + audio_args + extra_args
+    if threads:
+        cmd.extend(['-threads', str(threads)])
+    cmd.extend([
         '-y',  # Перезаписать выходной файл, если существует
         output_path
-    ]
+    ])
     
     try:
         print(f"Сжатие видео: {os.path.basename(input_path)}")
+        for note in plan.notes:
+            print(f"  {note}")
         print("Это может занять некоторое время...")
         
-        # Запускаем ffmpeg
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True
-        )
+        if chunked is None:
+            # В пакетном режиме ядра делит пул задач: сегменты - только по --chunked
+            chunked = use_chunked_encoding(info) if threads is None else False
+        if chunked and not target_size and info and info.video:
+            from chunked_encode import has_space_for_segments
+            if not has_space_for_segments(input_path, output_path):
+                print("  Мало места для сегментов, видео кодируется целиком")
+                chunked = False
         
-        # Ждем завершения
-        stdout, stderr = process.communicate()
+        telemetry.annotate(mode='target_size' if target_size else
+                           'chunked' if chunked and info and info.video else 'single')
+        if target_size:
+            # Двухпроходное кодирование под заданный размер
+            returncode, stderr = _encode_video_to_size(
+                ffmpeg_path, input_path, output_path, target_size, plan, quality, info, threads
+            )
+        elif chunked and info and info.video:
+            # Длинное видео кодируется по сегментам: параллельно и с возможностью продолжения
+            returncode, stderr = _encode_video_chunked(
+                ffmpeg_path, input_path, output_path, video_args, audio_args, extra_args, info,
+                threads
+            )
+        else:
+            # Запускаем ffmpeg и показываем прогресс
+            returncode, stderr = run_ffmpeg(
+                cmd, duration=duration, label=os.path.basename(input_path), live=INTERACTIVE
+            )
         
-        if process.returncode == 0:
+        if returncode == 0:
+            if not force and discard_if_larger(input_path, output_path):
+                return None
             input_size = os.path.getsize(input_path) / (1024 * 1024)  # MB
             output_size = os.path.getsize(output_path) / (1024 * 1024)  # MB
             compression_ratio = (1 - output_size / input_size) * 100
@@ -150,20 +404,19 @@ def compress_video(input_path, output_path, quality='medium'):
             print(f"  Новый размер: {output_size:.2f} MB")
             print(f"  Сжатие: {compression_ratio:.1f}%")
             print(f"  Файл сохранен: {output_path}")
+            return output_path
         elif 'Permission denied' in stderr or 'Отказано в доступе' in stderr:
             # Пробуем сохранить в папку Temp
             fallback_path = generate_output_filename_in_temp(input_path)
             print("\nВ исходную папку записать не удалось (нет прав или файл открыт).")
             print(f"Повторная попытка: сохранение в {fallback_path}")
             cmd[-1] = fallback_path
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True
+            returncode, stderr = run_ffmpeg(
+                cmd, duration=duration, label=os.path.basename(input_path), live=INTERACTIVE
             )
-            stdout, stderr = process.communicate()
-            if process.returncode == 0:
+            if returncode == 0:
+                if not force and discard_if_larger(input_path, fallback_path):
+                    return None
                 input_size = os.path.getsize(input_path) / (1024 * 1024)  # MB
                 output_size = os.path.getsize(fallback_path) / (1024 * 1024)  # MB
                 compression_ratio = (1 - output_size / input_size) * 100
@@ -173,6 +426,7 @@ def compress_video(input_path, output_path, quality='medium'):
                 print(f"  Сжатие: {compression_ratio:.1f}%")
                 print(f"  Файл сохранён в папку Temp:")
                 print(f"  {fallback_path}")
+                return fallback_path
             else:
                 print(f"ОШИБКА при сжатии видео:")
                 print(stderr)
@@ -180,19 +434,19 @@ def compress_video(input_path, output_path, quality='medium'):
                 print("  • Закройте файл, если он открыт в плеере или редакторе")
                 print("  • Запустите скрипт от имени администратора")
                 print("  • Сохраните результат в другую папку (например, Рабочий стол)")
-                input("\nНажмите Enter для выхода...")
+                wait_for_enter()
                 sys.exit(1)
         else:
             print(f"ОШИБКА при сжатии видео:")
             print(stderr)
-            input("\nНажмите Enter для выхода...")
+            wait_for_enter()
             sys.exit(1)
             
     except Exception as e:
         print(f"ОШИБКА: {str(e)}")
         import traceback
         traceback.print_exc()
-        input("\nНажмите Enter для выхода...")
+        wait_for_enter()
         sys.exit(1)
 
 
@@ -218,7 +472,7 @@ def convert_video(input_path, output_path, output_format='mp4'):
         print("1. Скачайте с https://ffmpeg.org/download.html")
         print("2. Распакуйте и добавьте в PATH")
         print(f"3. Или поместите ffmpeg.exe в папку проекта: {script_dir}")
-        input("\nНажмите Enter для выхода...")
+        wait_for_enter()
         sys.exit(1)
     
     # Параметры кодека в зависимости от формата
@@ -230,7 +484,7 @@ def convert_video(input_path, output_path, output_format='mp4'):
         },
         'avi': {
             'video_codec': 'libx264',
-            'audio_codec': 'mp3',
+            'audio_codec': 'libmp3lame',
             'extra': []
         },
         'mov': {
@@ -251,6 +505,11 @@ def convert_video(input_path, output_path, output_format='mp4'):
     }
     
     settings = format_settings.get(output_format.lower(), format_settings['mp4'])
+    require_encoder(settings['video_codec'])
+    require_encoder(settings['audio_codec'])
+    
+    info = probe(input_path, find_ffprobe())
+    duration = info.duration if info else None
     
     # Команда ffmpeg для конвертации
     cmd = [
@@ -270,18 +529,12 @@ def convert_video(input_path, output_path, output_format='mp4'):
         print(f"Формат: {output_format.upper()}")
         print("Это может занять некоторое время...")
         
-        # Запускаем ffmpeg
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True
+        # Запускаем ffmpeg и показываем прогресс
+        returncode, stderr = run_ffmpeg(
+            cmd, duration=duration, label=os.path.basename(input_path), live=INTERACTIVE
         )
         
-        # Ждем завершения
-        stdout, stderr = process.communicate()
-        
-        if process.returncode == 0:
+        if returncode == 0:
             input_size = os.path.getsize(input_path) / (1024 * 1024)  # MB
             output_size = os.path.getsize(output_path) / (1024 * 1024)  # MB
             
@@ -289,76 +542,213 @@ def convert_video(input_path, output_path, output_format='mp4'):
             print(f"  Исходный размер: {input_size:.2f} MB")
             print(f"  Новый размер: {output_size:.2f} MB")
             print(f"  Файл сохранен: {output_path}")
+            return output_path
         else:
             print(f"ОШИБКА при конвертации видео:")
             print(stderr)
-            input("\nНажмите Enter для выхода...")
+            wait_for_enter()
             sys.exit(1)
             
     except Exception as e:
         print(f"ОШИБКА: {str(e)}")
         import traceback
         traceback.print_exc()
-        input("\nНажмите Enter для выхода...")
+        wait_for_enter()
         sys.exit(1)
 
 
-def compress_audio(input_path, output_path, quality='medium'):
-    """Сжимает аудио файл"""
+def report_audio(input_path, output_path, plan):
+    """Выводит итог сжатия аудио; результат не меньше исходника удаляется. True - сохранён"""
+    if discard_if_larger(input_path, output_path):
+        return False
+    input_size = os.path.getsize(input_path) / (1024 * 1024)
+    output_size = os.path.getsize(output_path) / (1024 * 1024)
+    compression_ratio = (1 - output_size / input_size) * 100
+    
+    print(f"\n✓ Аудио успешно сжато!")
+    if plan.action == 'copy':
+        print(f"  {plan.reason}")
+    print(f"  Исходный размер: {input_size:.2f} MB")
+    print(f"  Новый размер: {output_size:.2f} MB")
+    print(f"  Сжатие: {compression_ratio:.1f}%")
+    return True
+
+
+def plan_audio_output(input_path, output_path, quality='medium', force=False):
+    """План сжатия аудио (см. audio_engine.plan_audio); без нужного кодера - ошибка"""
+    from audio_engine import AUDIO_CODECS, plan_audio
+    
+    plan = plan_audio(probe(input_path, find_ffprobe()), output_path, quality, force)
+    if plan.action == 'encode' and plan.codec and not plan.encoder:
+        require_encoder(AUDIO_CODECS[plan.codec]['encoders'][0])
+    return plan
+
+
+def compress_audio(input_path, output_path, quality='medium', threads=None, force=False):
+    """
+    Сжимает аудио файл кодеком, который соответствует контейнеру output_path
+    
+    Returns:
+        Путь к результату или None, если сжатие пропущено как бесполезное
+    """
+    from audio_engine import audio_args
+    
     ffmpeg_path = find_ffmpeg()
     
     if not ffmpeg_path:
         print("ОШИБКА: ffmpeg не найден!")
-        input("\nНажмите Enter для выхода...")
+        wait_for_enter()
         sys.exit(1)
     
-    # Параметры сжатия для аудио
-    quality_settings = {
-        'low': {'bitrate': '96k'},
-        'medium': {'bitrate': '128k'},
-        'high': {'bitrate': '192k'}
-    }
+    plan = plan_audio_output(input_path, output_path, quality, force)
+    telemetry.annotate(plan=plan.action, codec=plan.codec, encoder=plan.encoder,
+                       bitrate=plan.bitrate, reason=plan.reason)
+    if plan.action == 'skip':
+        print(f"Пропуск: {os.path.basename(input_path)}")
+        print(f"  {plan.reason}")
+        return None
     
-    settings = quality_settings.get(quality, quality_settings['medium'])
+    info = probe(input_path, find_ffprobe())
+    duration = info.duration if info else None
     
-    cmd = [
-        ffmpeg_path, '-i', input_path,
-        '-codec:a', 'libmp3lame',
-        '-b:a', settings['bitrate'],
-        '-y', output_path
-    ]
+    cmd = [ffmpeg_path, '-i', input_path] + audio_args(plan, threads) + ['-y', output_path]
     
     try:
         print(f"Сжатие аудио: {os.path.basename(input_path)}")
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-        stdout, stderr = process.communicate()
+        returncode, stderr = run_ffmpeg(
+            cmd, duration=duration, label=os.path.basename(input_path), live=INTERACTIVE
+        )
         
-        if process.returncode == 0:
-            input_size = os.path.getsize(input_path) / (1024 * 1024)
-            output_size = os.path.getsize(output_path) / (1024 * 1024)
-            compression_ratio = (1 - output_size / input_size) * 100
-            
-            print(f"\n✓ Аудио успешно сжато!")
-            print(f"  Исходный размер: {input_size:.2f} MB")
-            print(f"  Новый размер: {output_size:.2f} MB")
-            print(f"  Сжатие: {compression_ratio:.1f}%")
+        if returncode == 0:
+            return output_path if report_audio(input_path, output_path, plan) else None
         else:
             print(f"ОШИБКА: {stderr}")
-            input("\nНажмите Enter для выхода...")
+            wait_for_enter()
             sys.exit(1)
     except Exception as e:
         print(f"ОШИБКА: {str(e)}")
-        input("\nНажмите Enter для выхода...")
+        wait_for_enter()
         sys.exit(1)
 
 
-def compress_image(input_path, output_path, quality='medium'):
-    """Сжимает изображение"""
+def report_image(input_path, output_path):
+    """Выводит итог сжатия изображения"""
+    input_size = os.path.getsize(input_path) / (1024 * 1024)
+    output_size = os.path.getsize(output_path) / (1024 * 1024)
+    compression_ratio = (1 - output_size / input_size) * 100
+    
+    print(f"\n✓ Изображение успешно сжато!")
+    print(f"  Исходный размер: {input_size:.2f} MB")
+    print(f"  Новый размер: {output_size:.2f} MB")
+    print(f"  Сжатие: {compression_ratio:.1f}%")
+
+
+def optimize_png_image(input_path, output_path, threads=None):
+    """
+    Оптимизирует PNG без потерь (см. png_optimize)
+    
+    Returns:
+        Путь к результату или None, если файл не удалось разобрать
+    """
+    import shutil
+    import png_optimize
+    from worker_pool import cpu_count
+    
+    ffmpeg_path = find_ffmpeg()
+    if not ffmpeg_path:
+        return None
+    try:
+        result = png_optimize.optimize_png(
+            ffmpeg_path, input_path, probe(input_path, find_ffprobe()),
+            workers=threads or cpu_count()
+        )
+    except png_optimize.PngOptimizeError as e:
+        print(f"  Оптимизация PNG невозможна ({e}), обычное сжатие")
+        return None
+    
+    if result.data:
+        with open(output_path, 'wb') as f:
+            f.write(result.data)
+        print(f"  PNG без потерь: {result.strategy} (проб: {result.trials}, "
+              f"прервано: {result.aborted})")
+    else:
+        # Исходник уже записан оптимально - результат не должен быть больше него
+        shutil.copyfile(input_path, output_path)
+        print(f"  PNG уже оптимален (проб: {result.trials})")
+    return output_path
+
+
+def search_image_quality(input_path, output_path, quality_target):
+    """
+    Подбирает качество JPEG/WebP по метрике (см. image_quality)
+    
+    Returns:
+        Путь к результату или None, если подбор невозможен
+    """
+    import image_engine
+    import image_quality
+    
+    if not image_quality.available():
+        print("  Для подбора качества изображений нужны Pillow и numpy "
+              "(pip install Pillow numpy), обычное сжатие")
+        return None
+    metric, target = quality_target
+    try:
+        choice = image_engine.run(
+            image_quality.search_quality, input_path, output_path, metric, target
+        )
+    except image_quality.ImageQualityError as e:
+        print(f"  Подбор качества невозможен ({e}), обычное сжатие")
+        return None
+    if choice.quality is None:
+        print(f"  {metric.upper()} {target} не достигается с выигрышем в размере - "
+              f"сохранён исходник (проб: {choice.evaluations})")
+    else:
+        print(f"  Качество {choice.quality}: {metric.upper()} {choice.score:.4g} "
+              f"(проб: {choice.evaluations})")
+    return output_path
+
+
+def compress_image(input_path, output_path, quality='medium', threads=None, optimize_png=False,
+                   quality_target=None):
+    """
+    Сжимает изображение, возвращает путь к результату.
+    Если установлен Pillow, изображение кодируется без запуска ffmpeg
+    (см. image_engine), ffmpeg остаётся для форматов, с которыми Pillow не справляется.
+    optimize_png - для PNG подобрать самую компактную запись без потерь,
+    quality_target - (метрика, значение): для JPEG/WebP подобрать качество кодера
+    """
+    import image_engine
+    import image_quality
+    
+    print(f"Сжатие изображения: {os.path.basename(input_path)}")
+    if optimize_png and Path(output_path).suffix.lower() == '.png':
+        if optimize_png_image(input_path, output_path, threads):
+            telemetry.annotate(backend='png_optimize')
+            report_image(input_path, output_path)
+            return output_path
+    if quality_target and image_quality.supports(output_path):
+        if search_image_quality(input_path, output_path, quality_target):
+            telemetry.annotate(backend='quality_search')
+            report_image(input_path, output_path)
+            return output_path
+    try:
+        encoded = image_engine.encode_image(input_path, output_path, quality)
+    except Exception as e:
+        print(f"ОШИБКА: {str(e)}")
+        wait_for_enter()
+        sys.exit(1)
+    if encoded:
+        telemetry.annotate(backend='pillow')
+        report_image(input_path, output_path)
+        return output_path
+    telemetry.annotate(backend='ffmpeg')
+    
     ffmpeg_path = find_ffmpeg()
     
     if not ffmpeg_path:
         print("ОШИБКА: ffmpeg не найден!")
-        input("\nНажмите Enter для выхода...")
+        wait_for_enter()
         sys.exit(1)
     
     # Параметры сжатия для изображений
@@ -377,77 +767,223 @@ def compress_image(input_path, output_path, quality='medium'):
     elif ext == '.png':
         cmd = [ffmpeg_path, '-i', input_path, '-compression_level', '6', '-y', output_path]
     elif ext == '.webp':
+        require_encoder('libwebp')
         cmd = [ffmpeg_path, '-i', input_path, '-quality', '80', '-y', output_path]
     else:
         cmd = [ffmpeg_path, '-i', input_path, '-y', output_path]
+    if threads:
+        cmd[-2:-2] = ['-threads', str(threads)]
     
     try:
-        print(f"Сжатие изображения: {os.path.basename(input_path)}")
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-        stdout, stderr = process.communicate()
+        returncode, stderr = run_ffmpeg(cmd, report=False)
         
-        if process.returncode == 0:
-            input_size = os.path.getsize(input_path) / (1024 * 1024)
-            output_size = os.path.getsize(output_path) / (1024 * 1024)
-            compression_ratio = (1 - output_size / input_size) * 100
-            
-            print(f"\n✓ Изображение успешно сжато!")
-            print(f"  Исходный размер: {input_size:.2f} MB")
-            print(f"  Новый размер: {output_size:.2f} MB")
-            print(f"  Сжатие: {compression_ratio:.1f}%")
+        if returncode == 0:
+            report_image(input_path, output_path)
+            return output_path
         else:
             print(f"ОШИБКА: {stderr}")
-            input("\nНажмите Enter для выхода...")
+            wait_for_enter()
             sys.exit(1)
     except Exception as e:
         print(f"ОШИБКА: {str(e)}")
-        input("\nНажмите Enter для выхода...")
+        wait_for_enter()
         sys.exit(1)
 
 
-def detect_file_type(file_path):
-    """Определяет тип файла"""
-    ext = Path(file_path).suffix.lower()
+def compress_video_ladder(input_path, output_dir=None, abr='hls'):
+    """
+    Лесенка битрейтов для веб-плееров (см. abr_ladder): ступени - уровни
+    QUALITY_SETTINGS, все кодируются из одного декодирования
     
-    video_ext = ['.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm', '.m4v', '.3gp', '.mpg', '.mpeg']
-    audio_ext = ['.mp3', '.wav', '.flac', '.aac', '.ogg', '.wma', '.m4a', '.opus', '.ac3']
-    image_ext = ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.tif', '.webp', '.heic', '.heif']
+    Args:
+        input_path: Исходное видео
+        output_dir: Папка результата (по умолчанию - <имя>_abr рядом с исходником)
+        abr: 'hls', 'dash' или 'both'
+    
+    Returns:
+        Путь к папке с плейлистами и сегментами
+    """
+    from abr_ladder import AbrLadderError, build_ladder, output_dir_for, package_ladder
+    
+    ffmpeg_path = find_ffmpeg()
+    if not ffmpeg_path:
+        print("ОШИБКА: ffmpeg не найден!")
+        wait_for_enter()
+        sys.exit(1)
+    require_encoder('libx264')
+    require_encoder('aac')
+    
+    info = probe(input_path, find_ffprobe())
+    output_dir = output_dir or output_dir_for(input_path)
+    try:
+        ladder = build_ladder(info, QUALITY_SETTINGS)
+        telemetry.annotate(plan='abr', abr=abr,
+                           renditions=[f"{r.quality} {r.width}x{r.height}" for r in ladder])
+        print(f"Лесенка {abr.upper()}: {os.path.basename(input_path)}")
+        for rendition in ladder:
+            print(f"  {rendition.quality}: {rendition.width}x{rendition.height}, "
+                  f"CRF {rendition.crf}, до {rendition.maxrate // 1000}k")
+        playlist = package_ladder(ffmpeg_path, input_path, output_dir, info, ladder, abr,
+                                  live=INTERACTIVE)
+    except AbrLadderError as e:
+        print(f"ОШИБКА: {e}")
+        wait_for_enter()
+        sys.exit(1)
+    
+    input_size = os.path.getsize(input_path) / (1024 * 1024)
+    output_size = output_size_of(output_dir) / (1024 * 1024)
+    print(f"\n✓ Лесенка битрейтов готова!")
+    print(f"  Исходный размер: {input_size:.2f} MB")
+    print(f"  Все ступени: {output_size:.2f} MB")
+    print(f"  Плейлист: {playlist}")
+    return output_dir
+
+
+def make_video_previews(input_path):
+    """Постер и контактный лист видео (см. video_preview); ошибка не прерывает сжатие"""
+    from video_preview import PreviewError, make_previews
     
-    if ext in video_ext:
-        return 'video'
-    elif ext in audio_ext:
-        return 'audio'
-    elif ext in image_ext:
-        return 'image'
-    return None
+    try:
+        result = make_previews(input_path)
+    except PreviewError as e:
+        print(f"  Превью не созданы: {e}")
+        return
+    print(f"Превью: {result.poster}, {result.sheet}")
+
+
+def output_size_of(path):
+    """Размер результата; у папки (лесенка битрейтов) - суммарный размер файлов"""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(entry.stat().st_size for entry in Path(path).rglob('*') if entry.is_file())
 
 
-def compress_file(input_path, output_path=None, quality='medium'):
-    """Универсальная функция сжатия файлов"""
+def compress_file(input_path, output_path=None, quality='medium', threads=None, force=False,
+                  chunked=None, target_size=None, quality_target=None, optimize_png=False,
+                  abr=None, previews=False):
+    """
+    Универсальная функция сжатия файлов. Метрики задачи записываются в журнал
+    (см. telemetry)
+    
+    Returns:
+        Путь к результату или None, если сжатие пропущено как бесполезное
+    """
     file_type = detect_file_type(input_path)
     
     if not file_type:
         print(f"ОШИБКА: Неподдерживаемый тип файла: {input_path}")
-        input("\nНажмите Enter для выхода...")
+        wait_for_enter()
         sys.exit(1)
     
+    with telemetry.job('compress', input_path, file_type, quality=quality, force=force,
+                       threads=threads, target_size=target_size,
+                       quality_target=list(quality_target) if quality_target else None,
+                       optimize_png=optimize_png, abr=abr) as metrics:
+        result = _compress_file(input_path, output_path, file_type, quality, threads, force,
+                                chunked, target_size, quality_target, optimize_png, abr,
+                                previews)
+        metrics.finish(result)
+    return result
+
+
+def _compress_file(input_path, output_path, file_type, quality, threads, force, chunked,
+                   target_size, quality_target, optimize_png, abr, previews):
+    if previews and file_type == 'video':
+        make_video_previews(input_path)
+    
+    # Лесенка - папка сегментов, а не один файл: кэш результатов к ней не применяется
+    if abr and file_type == 'video':
+        return compress_video_ladder(input_path, output_path, abr)
+    
+    # Аудио сохраняется в контейнер, который подходит кодеку (WAV и FLAC - в сжатый)
+    suffix = None
+    if file_type == 'audio':
+        from audio_engine import output_suffix
+        suffix = output_suffix(input_path)
+    
+    # Тот же исходник с теми же настройками уже сжимали - результат берётся из кэша
+    cache, key, cached_path = lookup_cached_output(
+        input_path, output_path, file_type, quality, force, suffix,
+        target_size=target_size,
+        quality_target=list(quality_target) if quality_target else None,
+        optimize_png=optimize_png,
+    )
+    if cached_path is False:
+        return None
+    if cached_path:
+        telemetry.annotate(cached=True)
+        return cached_path
+    
     if not output_path:
-        output_path = generate_output_filename(input_path)
+        output_path = generate_output_filename(input_path, suffix)
     
     if file_type == 'video':
-        compress_video(input_path, output_path, quality)
+        result = compress_video(input_path, output_path, quality, threads, force, chunked,
+                                target_size, quality_target)
     elif file_type == 'audio':
-        compress_audio(input_path, output_path, quality)
+        result = compress_audio(input_path, output_path, quality, threads, force)
     elif file_type == 'image':
-        compress_image(input_path, output_path, quality)
+        result = compress_image(input_path, output_path, quality, threads, optimize_png,
+                                quality_target)
+    
+    store_cached_output(cache, key, result)
+    return result
+
+
+def lookup_cached_output(input_path, output_path, file_type, quality, force=False,
+                         suffix=None, **settings):
+    """
+    Ищет результат сжатия в кэше результатов
+    
+    Args:
+        suffix: Расширение результата, если оно отличается от исходного
+        settings: Прочие настройки, от которых зависит результат
+    
+    Returns:
+        (cache, key, путь): путь - False, если исходник сам является результатом
+        сжатия, None - если результата в кэше нет
+    """
+    cache = get_output_cache()
+    if not cache:
+        return None, None, None
+    try:
+        fingerprint = content_fingerprint(input_path)
+        if not force and cache.is_output(fingerprint):
+            print(f"Пропуск: {os.path.basename(input_path)}")
+            print("  файл уже является результатом сжатия")
+            return cache, None, False
+        settings = dict(settings, action='compress', type=file_type, quality=quality, force=force)
+        if suffix:
+            settings['format'] = suffix
+        key = job_key(fingerprint, settings)
+        cached_path = cache.fetch(
+            key, output_path, lambda: generate_output_filename(input_path, suffix),
+            existing_output_filenames(input_path, suffix)
+        )
+    except (sqlite3.Error, OSError):
+        return None, None, None
+    if cached_path:
+        print(f"Результат взят из кэша: {os.path.basename(input_path)}")
+        print(f"  Файл сохранен: {cached_path}")
+    return cache, key, cached_path
+
+
+def store_cached_output(cache, key, result):
+    """Запоминает результат сжатия в кэше результатов"""
+    if cache and key and result and os.path.exists(result):
+        try:
+            cache.store(key, result)
+        except (sqlite3.Error, OSError):
+            pass
 
 
-def generate_output_filename(input_path):
+def generate_output_filename(input_path, suffix=None):
     """
     Генерирует имя выходного файла с префиксом compresed001
     
     Args:
         input_path: Путь к исходному файлу
+        suffix: Расширение результата (по умолчанию - как у исходника)
         
     Returns:
         Путь к выходному файлу
@@ -455,15 +991,17 @@ def generate_output_filename(input_path):
     path = Path(input_path)
     directory = path.parent
     stem = path.stem
-    suffix = path.suffix
+    suffix = suffix or path.suffix
     
     # Добавляем compresed001 перед расширением
     output_name = f"{stem}compresed001{suffix}"
     output_path = directory / output_name
     
-    # Если файл уже существует, добавляем номер
+    # Если файл уже существует, добавляем номер. Имя с сегментами прерванного
+    # кодирования занимается повторно, чтобы продолжить его
+    from chunked_encode import resume_dir
     counter = 1
-    while output_path.exists():
+    while output_path.exists() and not os.path.isdir(resume_dir(str(output_path))):
         output_name = f"{stem}compresed001_{counter}{suffix}"
         output_path = directory / output_name
         counter += 1
@@ -471,9 +1009,18 @@ def generate_output_filename(input_path):
     return str(output_path)
 
 
+def existing_output_filenames(input_path, suffix=None):
+    """Уже существующие результаты сжатия файла в его папке"""
+    path = Path(input_path)
+    pattern = (glob.escape(str(path.parent / f"{path.stem}compresed001")) + '*'
+               + glob.escape(suffix or path.suffix))
+    return sorted(glob.glob(pattern))
+
+
 def generate_output_filename_in_temp(input_path):
     """Генерирует путь для сохранения в папку Temp (если в исходной папке нет прав записи)."""
     path = Path(input_path)
+    import tempfile
     directory = Path(tempfile.gettempdir()) / "video_compressed"
     directory.mkdir(parents=True, exist_ok=True)
     stem = path.stem
@@ -517,20 +1064,363 @@ def generate_convert_filename(input_path, output_format='mp4'):
     return str(output_path)
 
 
+def collect_input_files(paths):
+    """
+    Разворачивает аргументы командной строки в список файлов
+    
+    Args:
+        paths: Пути к файлам, папкам или шаблоны (*.mp4, **/*.jpg)
+        
+    Returns:
+        Список поддерживаемых файлов без повторов
+    """
+    from video_preview import is_preview
+    
+    files = []
+    seen = set()
+    
+    def add(file_path):
+        key = os.path.normcase(os.path.abspath(file_path))
+        if key not in seen and detect_file_type(file_path):
+            seen.add(key)
+            files.append(file_path)
+    
+    for arg in paths:
+        if os.path.isdir(arg):
+            for root, dirs, names in os.walk(arg):
+                # Скрытые папки, в том числе сегменты незавершённого кодирования
+                dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+                for name in sorted(names):
+                    # Уже сжатые файлы и превью видео повторно не обрабатываем
+                    if 'compresed001' not in name and not is_preview(name):
+                        add(os.path.join(root, name))
+        elif os.path.isfile(arg):
+            add(arg)
+        else:
+            # В Windows оболочка не раскрывает шаблоны сама
+            for match in sorted(glob.glob(arg, recursive=True)):
+                if os.path.isfile(match):
+                    add(match)
+    
+    return files
+
+
+def _job_result(input_path):
+    return {
+        'input': input_path,
+        'output': None,
+        'input_size': os.path.getsize(input_path),
+        'output_size': 0,
+        'skipped': False,
+        'error': None,
+    }
+
+
+def _set_job_output(result, output_path):
+    if output_path is None:
+        result['skipped'] = True
+    elif os.path.exists(output_path):
+        result['output'] = output_path
+        result['output_size'] = output_size_of(output_path)
+    else:
+        result['error'] = 'нет выходного файла'
+
+
+def _compress_job(input_path, quality, threads, **options):
+    """Сжимает один файл в пакете, ошибки возвращает в результате"""
+    result = _job_result(input_path)
+    try:
+        _set_job_output(result, compress_file(input_path, quality=quality, threads=threads,
+                                              **options))
+    except SystemExit:
+        result['error'] = 'ffmpeg завершился с ошибкой'
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+def _compress_audio_group_job(input_paths, quality, threads, force=False, **options):
+    """
+    Сжимает группу коротких аудиофайлов пакета одним запуском ffmpeg: на каждый
+    файл не тратится запуск процесса. Если ffmpeg не справился с группой,
+    файлы сжимаются по одному
+    
+    Returns:
+        Список результатов в формате _compress_job
+    """
+    with telemetry.job('compress', input_paths, 'audio', quality=quality, force=force,
+                       threads=threads, group=len(input_paths)) as metrics:
+        results = _compress_audio_group(input_paths, quality, threads, force, **options)
+        metrics.finish([result['output'] for result in results])
+    return results
+
+
+def _compress_audio_group(input_paths, quality, threads, force=False, **options):
+    from audio_engine import build_group_command, output_suffix
+    
+    results = []
+    pending = []
+    for input_path in input_paths:
+        result = _job_result(input_path)
+        results.append(result)
+        try:
+            suffix = output_suffix(input_path)
+            cache, key, cached_path = lookup_cached_output(
+                input_path, None, 'audio', quality, force, suffix,
+                target_size=options.get('target_size'),
+                quality_target=(list(options['quality_target'])
+                                if options.get('quality_target') else None),
+                optimize_png=options.get('optimize_png', False),
+            )
+            if cached_path is not False and not cached_path:
+                output_path = generate_output_filename(input_path, suffix)
+                plan = plan_audio_output(input_path, output_path, quality, force)
+                if plan.action != 'skip':
+                    # Имя занимается сразу: у a.wav и a.flac группы результат один - .opus
+                    Path(output_path).touch()
+                    pending.append((result, cache, key, (input_path, output_path, plan)))
+                    continue
+                print(f"Пропуск: {os.path.basename(input_path)}")
+                print(f"  {plan.reason}")
+                cached_path = None
+            _set_job_output(result, cached_path or None)
+        except SystemExit:
+            result['error'] = 'ffmpeg завершился с ошибкой'
+        except Exception as e:
+            result['error'] = str(e)
+    if not pending:
+        return results
+    
+    items = [item for _, _, _, item in pending]
+    print(f"Сжатие аудио: {len(items)} файлов одним запуском ffmpeg")
+    returncode, stderr = run_ffmpeg(build_group_command(find_ffmpeg(), items, threads),
+                                    report=False)
+    for result, cache, key, (input_path, output_path, plan) in pending:
+        if returncode != 0:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            result.update(_compress_job(input_path, quality, threads, force=force, **options))
+            continue
+        print(f"\n{os.path.basename(input_path)}")
+        output_path = output_path if report_audio(input_path, output_path, plan) else None
+        store_cached_output(cache, key, output_path)
+        _set_job_output(result, output_path)
+    return results
+
+
+def _audio_durations(paths):
+    """{путь: длительность или None} для части аудиофайлов пакета"""
+    ffprobe_path = find_ffprobe()
+    durations = {}
+    for path in paths:
+        info = probe(path, ffprobe_path)
+        durations[path] = info.duration if info else None
+    return durations
+
+
+def compress_batch(input_files, quality='medium', jobs=None, **options):
+    """
+    Сжимает набор файлов через пул задач, размер которого
+    определяется числом ядер и типом каждого файла
+    
+    Args:
+        input_files: Список файлов
+        quality: Качество сжатия ('low', 'medium', 'high')
+        jobs: Ёмкость пула (по умолчанию - число ядер)
+        options: Дополнительные параметры compress_file (force, chunked...)
+        
+    Returns:
+        Список результатов по каждому файлу
+    """
+    from worker_pool import WorkerPool
+    from image_engine import process_pool
+    from audio_engine import AUDIO_GROUP_SIZE, short_audio_groups
+    
+    file_types = {path: detect_file_type(path) for path in input_files}
+    audio_files = [path for path in input_files if file_types[path] == 'audio']
+    
+    # Изображения кодируются Pillow в пуле процессов того же размера
+    with WorkerPool(jobs) as pool, process_pool(pool.capacity):
+        # Длительности аудио (для групп коротких файлов) определяются в пуле частями,
+        # а не по одному файлу до начала работы: остальные файлы тем временем сжимаются
+        probes = [
+            pool.submit('audio', _audio_durations, audio_files[start:start + AUDIO_GROUP_SIZE])
+            for start in range(0, len(audio_files), AUDIO_GROUP_SIZE)
+        ]
+        futures = []
+        for path in input_files:
+            file_type = file_types[path]
+            if file_type != 'audio':
+                futures.append(pool.submit(
+                    file_type, _compress_job, path, quality, pool.threads_for(file_type), **options
+                ))
+        durations = {}
+        for probe_future in probes:
+            durations.update(probe_future.result())
+        groups, singles = short_audio_groups(audio_files, file_types, durations)
+        for group in groups:
+            futures.append(pool.submit(
+                'audio', _compress_audio_group_job, group, quality,
+                pool.threads_for('audio'), **options
+            ))
+        for path in singles:
+            futures.append(pool.submit(
+                'audio', _compress_job, path, quality, pool.threads_for('audio'), **options
+            ))
+        results = {}
+        for future in futures:
+            done = future.result()
+            for result in (done if isinstance(done, list) else [done]):
+                results[result['input']] = result
+        return [results[path] for path in input_files]
+
+
+def print_batch_summary(results, elapsed):
+    """Выводит общий итог пакетной обработки"""
+    done = [r for r in results if not r['error'] and not r.get('skipped')]
+    skipped = [r for r in results if r.get('skipped')]
+    failed = [r for r in results if r['error']]
+    input_total = sum(r['input_size'] for r in done)
+    output_total = sum(r['output_size'] for r in done)
+    saved = input_total - output_total
+    elapsed = max(elapsed, 1e-6)
+    
+    print("\n" + "="*60)
+    print("ИТОГ ПАКЕТНОЙ ОБРАБОТКИ")
+    print("="*60)
+    print(f"  Файлов: {len(results)}, успешно: {len(done)}, пропущено: {len(skipped)}, "
+          f"ошибок: {len(failed)}")
+    print(f"  Время: {elapsed:.1f} с")
+    print(f"  Скорость: {len(results) / elapsed:.2f} файл/с, "
+          f"{input_total / (1024 * 1024) / elapsed:.2f} MB/с")
+    print(f"  Исходный объём: {input_total / (1024 * 1024):.2f} MB")
+    print(f"  Итоговый объём: {output_total / (1024 * 1024):.2f} MB")
+    if input_total:
+        print(f"  Сэкономлено: {saved / (1024 * 1024):.2f} MB ({saved / input_total * 100:.1f}%)")
+    if failed:
+        print("\nНе удалось обработать:")
+        for r in failed:
+            print(f"  • {r['input']}: {r['error']}")
+
+
+# Модули режимов загружаются, только если режим выбран: каждый импорт
+# удлиняет запуск из контекстного меню (см. benchmarks/startup.py)
+def _parse_size_arg(text):
+    from target_size import parse_size
+    return parse_size(text)
+
+
+def _parse_target_arg(text):
+    from quality_search import parse_target
+    return parse_target(text)
+
+
 def main():
     """Главная функция"""
+    global INTERACTIVE
+    
     if len(sys.argv) < 2:
-        print("Использование: compress_video.py <путь_к_файлу>")
-        print("Поддерживаются: видео, аудио, изображения")
-        input("Нажмите Enter для выхода...")
+        print("Использование: compress_video.py <путь_к_файлу> [<путь> ...]")
+        print("Поддерживаются: видео, аудио, изображения, папки и шаблоны (*.mp4)")
+        wait_for_enter("Нажмите Enter для выхода...")
         sys.exit(1)
     
-    input_path = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Сжатие видео, аудио и изображений")
+    parser.add_argument('paths', nargs='+', help="Файлы, папки или шаблоны")
+    parser.add_argument('--quality', choices=['low', 'medium', 'high'], default='medium')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help="Ёмкость пула задач (по умолчанию - число ядер)")
+    parser.add_argument('--no-pause', action='store_true',
+                        help="Не ждать Enter после завершения")
+    parser.add_argument('--no-server', action='store_true',
+                        help="Не объединять запуски в общую очередь")
+    parser.add_argument('--force', action='store_true',
+                        help="Сжимать даже файлы, которые вряд ли уменьшатся")
+    parser.add_argument('--chunked', action='store_true', default=None,
+                        help="Кодировать видео по сегментам: параллельно и с возможностью "
+                             "продолжения после прерывания")
+    target_group = parser.add_mutually_exclusive_group()
+    target_group.add_argument('--target-size', type=_parse_size_arg, default=None,
+                              help="Целевой размер видео, например 25M")
+    target_group.add_argument('--quality-target', type=_parse_target_arg, default=None,
+                              help="Подобрать CRF видео или качество JPEG/WebP по метрике, "
+                                   "например ssim:0.98 или psnr:42")
+    parser.add_argument('--optimize-png', action='store_true',
+                        help="Сжимать PNG без потерь, подбирая самую компактную запись")
+    parser.add_argument('--abr', choices=['hls', 'dash', 'both'], default=None,
+                        help="Вместо сжатия видео собрать лесенку битрейтов для веб-плееров "
+                             "из всех уровней качества")
+    parser.add_argument('--previews', action='store_true',
+                        help="Создать для видео постер и контактный лист (по ключевым кадрам)")
+    parser.add_argument('--watch', action='store_true',
+                        help="Наблюдать за папкой (первый путь) и сжимать новые файлы")
+    parser.add_argument('--done', default=None,
+                        help="Режим наблюдения: папка результатов (по умолчанию - done)")
+    parser.add_argument('--originals', default=None,
+                        help="Режим наблюдения: папка исходников (по умолчанию - originals)")
+    parser.add_argument('--failed', default=None,
+                        help="Режим наблюдения: папка файлов с ошибкой (по умолчанию - failed)")
+    parser.add_argument('--settle', type=float, default=None,
+                        help="Режим наблюдения: сколько секунд файл не должен меняться")
+    args = parser.parse_args()
+    
+    if args.no_pause:
+        INTERACTIVE = False
+    
+    # Задача для очереди и режима наблюдения (без пути к файлу)
+    job_options = {
+        'action': 'compress',
+        'quality': args.quality,
+        'force': args.force,
+        'chunked': args.chunked,
+        'target_size': args.target_size,
+        'quality_target': args.quality_target,
+        'optimize_png': args.optimize_png,
+        'abr': args.abr,
+        'previews': args.previews,
+    }
+    
+    if args.watch:
+        import hot_folder
+        INTERACTIVE = False
+        start = time.time()
+        results = hot_folder.watch(
+            args.paths[0], lambda path, file_type: dict(job_options, path=path), args
+        )
+        print_batch_summary(results, time.time() - start)
+        sys.exit(1 if any(r['error'] for r in results) else 0)
+    
+    # Несколько файлов, папка или шаблон - пакетный режим
+    first = args.paths[0]
+    if len(args.paths) > 1 or os.path.isdir(first) or any(c in first for c in '*?['):
+        input_files = collect_input_files(args.paths)
+        if not input_files:
+            print("ОШИБКА: Не найдено ни одного поддерживаемого файла")
+            wait_for_enter("Нажмите Enter для выхода...")
+            sys.exit(1)
+        
+        print(f"Найдено файлов: {len(input_files)}")
+        interactive = INTERACTIVE
+        INTERACTIVE = False
+        start = time.time()
+        results = compress_batch(input_files, args.quality, args.jobs,
+                                 force=args.force, chunked=args.chunked,
+                                 target_size=args.target_size,
+                                 quality_target=args.quality_target,
+                                 optimize_png=args.optimize_png, abr=args.abr,
+                                 previews=args.previews)
+        print_batch_summary(results, time.time() - start)
+        INTERACTIVE = interactive
+        
+        wait_for_enter("\nНажмите Enter для выхода...")
+        sys.exit(1 if any(r['error'] for r in results) else 0)
+    
+    input_path = first
     
     # Проверяем существование файла
     if not os.path.exists(input_path):
         print(f"ОШИБКА: Файл не найден: {input_path}")
-        input("Нажмите Enter для выхода...")
+        wait_for_enter("Нажмите Enter для выхода...")
         sys.exit(1)
     
     # Определяем тип файла
@@ -538,17 +1428,33 @@ def main():
     if not file_type:
         print(f"ОШИБКА: Неподдерживаемый тип файла: {input_path}")
         print("Поддерживаются: видео, аудио, изображения")
-        input("Нажмите Enter для выхода...")
+        wait_for_enter("Нажмите Enter для выхода...")
         sys.exit(1)
     
-    # Генерируем имя выходного файла
-    output_path = generate_output_filename(input_path)
-    
-    # Сжимаем файл
-    compress_file(input_path, output_path, quality='medium')
+    if args.no_server:
+        # Имя результата выбирается в compress_file: при попадании в кэш
+        # может вернуться уже существующий файл
+        compress_file(input_path, quality=args.quality, force=args.force,
+                      chunked=args.chunked, target_size=args.target_size,
+                      quality_target=args.quality_target, optimize_png=args.optimize_png,
+                      abr=args.abr, previews=args.previews)
+    else:
+        # Запуски из контекстного меню собираются в одну очередь
+        import job_server
+        job = dict(job_options, path=os.path.abspath(input_path))
+        start = time.time()
+        results = job_server.run_or_submit(job, args.jobs)
+        if results is None:
+            print(f"Файл добавлен в очередь сжатия: {os.path.basename(input_path)}")
+            sys.exit(0)
+        if len(results) > 1:
+            print_batch_summary(results, time.time() - start)
+        if any(r['error'] for r in results):
+            wait_for_enter("\nНажмите Enter для выхода...")
+            sys.exit(1)
     
     print("\nГотово!")
-    input("Нажмите Enter для выхода...")
+    wait_for_enter("Нажмите Enter для выхода...")
 
 
 if __name__ == '__main__':
@@ -7,100 +7,300 @@
 
 import os
 import sys
-import subprocess
-import shutil
+import glob
+import time
+import sqlite3
+from collections import namedtuple
 from pathlib import Path
 
+from ffmpeg_progress import run_ffmpeg
+from media_probe import detect_file_type, probe
+from toolchain import encoder_args, find_ffmpeg, find_ffprobe, pick_encoder
+from output_cache import get_output_cache, job_key, content_fingerprint
+import telemetry
 
-def find_ffmpeg():
-    """Поиск ffmpeg в системе"""
-    ffmpeg_in_path = shutil.which('ffmpeg')
-    if ffmpeg_in_path:
-        return ffmpeg_in_path
-    
-    try:
-        script_dir = Path(__file__).parent.absolute().resolve()
-    except:
-        script_dir = Path.cwd()
-    
-    project_paths = [
-        script_dir / 'ffmpeg.exe',
-        script_dir / 'ffmpeg' / 'ffmpeg.exe',
-        script_dir / 'ffmpeg' / 'bin' / 'ffmpeg.exe',
-    ]
-    
-    for path in project_paths:
-        if path.exists():
-            return str(path)
-    
-    possible_paths = [
-        r'C:\ffmpeg\bin\ffmpeg.exe',
-        r'C:\ffmpeg\ffmpeg.exe',
-        r'C:\Program Files\ffmpeg\bin\ffmpeg.exe',
-        r'C:\Program Files (x86)\ffmpeg\bin\ffmpeg.exe',
-    ]
-    
-    for path in possible_paths:
-        if os.path.exists(path):
-            return path
-    
-    return None
 
+# Запуск для одного файла из контекстного меню: ждать Enter перед выходом.
+# Пакетный режим и сервер очереди отключают ожидание
+INTERACTIVE = True
 
-def detect_file_type(file_path):
-    """Определяет тип файла: video, audio, image"""
-    ext = Path(file_path).suffix.lower()
-    
-    video_extensions = ['.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm', '.m4v', '.3gp', '.mpg', '.mpeg', '.ts', '.m2ts']
-    audio_extensions = ['.mp3', '.wav', '.flac', '.aac', '.ogg', '.wma', '.m4a', '.opus', '.ac3']
-    image_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.tif', '.webp', '.heic', '.heif']
-    
-    if ext in video_extensions:
-        return 'video'
-    elif ext in audio_extensions:
-        return 'audio'
-    elif ext in image_extensions:
-        return 'image'
-    else:
-        return None
+
+def wait_for_enter(message="\nНажмите Enter для выхода..."):
+    """Ждёт нажатия Enter, если скрипт запущен для одного файла"""
+    if INTERACTIVE:
+        input(message)
 
 
 def get_available_formats(file_type):
-    """Возвращает доступные форматы для конвертации"""
+    """
+    Возвращает доступные форматы для конвертации.
+    Аудио и изображения без кодера в установленном ffmpeg не предлагаются
+    """
     formats = {
         'video': ['mp4', 'avi', 'mov', 'mkv', 'webm', 'wmv', 'flv'],
         'audio': ['mp3', 'wav', 'flac', 'aac', 'ogg', 'm4a', 'opus'],
         'image': ['jpg', 'png', 'webp', 'bmp', 'tiff', 'gif']
     }
+    if file_type == 'audio':
+        return [fmt for fmt in formats['audio'] if pick_encoder(AUDIO_FORMAT_SETTINGS[fmt][0])]
+    if file_type == 'image':
+        import image_engine
+        return [fmt for fmt in formats['image']
+                if pick_encoder(IMAGE_FORMAT_ENCODERS[fmt]) or image_engine.can_write(fmt)]
     return formats.get(file_type, [])
 
 
+# Кодеры аудиоформатов в порядке предпочтения и их параметры
+AUDIO_FORMAT_SETTINGS = {
+    'mp3': (['libmp3lame'], ['-b:a', '192k']),
+    'wav': (['pcm_s16le'], []),
+    'flac': (['flac'], []),
+    'aac': (['aac', 'aac_at', 'libfdk_aac'], ['-b:a', '192k']),
+    'ogg': (['libvorbis', 'vorbis'], []),
+    'm4a': (['aac', 'aac_at', 'libfdk_aac'], ['-b:a', '192k']),
+    'opus': (['libopus', 'opus'], []),
+}
+
+# Кодеры форматов изображений
+IMAGE_FORMAT_ENCODERS = {
+    'jpg': ['mjpeg'],
+    'png': ['png'],
+    'webp': ['libwebp', 'libwebp_anim'],
+    'bmp': ['bmp'],
+    'tiff': ['tiff'],
+    'gif': ['gif'],
+}
+
+# Миниатюра видео: кадр на доле длительности THUMBNAIL_POSITION (не дальше
+# THUMBNAIL_MAX_SECONDS от начала), шириной не больше THUMBNAIL_WIDTH
+THUMBNAIL = 'thumbnail'
+THUMBNAIL_FORMAT = 'jpg'
+THUMBNAIL_POSITION = 0.1
+THUMBNAIL_MAX_SECONDS = 10
+THUMBNAIL_WIDTH = 640
+
+
+# Настройки видеоконтейнеров: кодеры для перекодирования в порядке предпочтения
+# (берётся первый, который есть в ffmpeg) и кодеки, которые контейнер принимает
+# как есть (такие потоки копируются)
+VIDEO_FORMAT_SETTINGS = {
+    'mp4': {
+        'video_codecs': ['libx264', 'libopenh264', 'h264_mf', 'mpeg4'],
+        'audio_codecs': ['aac', 'aac_at', 'libfdk_aac'],
+        'copy_video': ['h264', 'hevc', 'mpeg4', 'av1', 'vp9'],
+        'copy_audio': ['aac', 'mp3', 'ac3', 'eac3', 'alac', 'opus', 'flac'],
+        'extra': ['-movflags', '+faststart']
+    },
+    'mov': {
+        'video_codecs': ['libx264', 'libopenh264', 'mpeg4'],
+        'audio_codecs': ['aac', 'aac_at', 'libfdk_aac'],
+        'copy_video': ['h264', 'hevc', 'mpeg4', 'prores', 'mjpeg'],
+        'copy_audio': ['aac', 'mp3', 'ac3', 'alac', 'pcm_s16le', 'pcm_s24le'],
+        'extra': ['-movflags', '+faststart']
+    },
+    'mkv': {
+        'video_codecs': ['libx264', 'libopenh264', 'mpeg4'],
+        'audio_codecs': ['aac', 'libopus', 'libvorbis'],
+        'copy_video': ['h264', 'hevc', 'av1', 'vp8', 'vp9', 'mpeg4', 'mpeg2video',
+                       'mpeg1video', 'theora', 'prores', 'mjpeg'],
+        'copy_audio': ['aac', 'mp3', 'mp2', 'ac3', 'eac3', 'dts', 'truehd', 'opus',
+                       'vorbis', 'flac', 'alac', 'pcm_s16le', 'pcm_s24le'],
+        'extra': []
+    },
+    'webm': {
+        'video_codecs': ['libvpx-vp9', 'libvpx', 'libaom-av1'],
+        'audio_codecs': ['libopus', 'opus', 'libvorbis'],
+        'copy_video': ['vp8', 'vp9', 'av1'],
+        'copy_audio': ['opus', 'vorbis'],
+        'extra': []
+    },
+    'avi': {
+        'video_codecs': ['libx264', 'mpeg4'],
+        'audio_codecs': ['libmp3lame', 'ac3'],
+        'copy_video': ['h264', 'mpeg4', 'mjpeg', 'msmpeg4v3', 'mpeg2video'],
+        'copy_audio': ['mp3', 'ac3', 'pcm_s16le'],
+        'extra': []
+    },
+    'wmv': {
+        'video_codecs': ['wmv2'],
+        'audio_codecs': ['wmav2'],
+        'copy_video': ['wmv1', 'wmv2', 'wmv3', 'vc1'],
+        'copy_audio': ['wmav1', 'wmav2', 'wmapro'],
+        'extra': []
+    },
+    'flv': {
+        'video_codecs': ['libx264', 'flv'],
+        'audio_codecs': ['aac', 'libmp3lame'],
+        'copy_video': ['h264', 'flv1'],
+        'copy_audio': ['aac', 'mp3'],
+        'extra': []
+    },
+}
+
+
+# Решение по одному потоку: копировать ('copy') или кодировать указанным кодером
+StreamPlan = namedtuple('StreamPlan', ['index', 'codec_type', 'codec_name', 'encoder'])
+
+
+def plan_streams(info, output_format):
+    """
+    Решает для каждого потока, можно ли его скопировать в новый контейнер
+    
+    Args:
+        info: MediaInfo исходного файла
+        output_format: Целевой формат ('mp4', 'mkv', ...)
+        
+    Returns:
+        Список StreamPlan (видео и аудио потоки в исходном порядке).
+        encoder равен None, если подходящего кодера в ffmpeg нет
+    """
+    settings = VIDEO_FORMAT_SETTINGS.get(output_format, VIDEO_FORMAT_SETTINGS['mp4'])
+    plan = []
+    for stream in info.streams:
+        if stream.codec_type == 'video' and stream.fps:
+            accepted, encoder = settings['copy_video'], pick_encoder(settings['video_codecs'])
+        elif stream.codec_type == 'audio':
+            accepted, encoder = settings['copy_audio'], pick_encoder(settings['audio_codecs'])
+        else:
+            # Субтитры, обложки и служебные потоки не переносим
+            continue
+        if stream.codec_name in accepted:
+            encoder = 'copy'
+        plan.append(StreamPlan(stream.index, stream.codec_type, stream.codec_name, encoder))
+    return plan
+
+
+def describe_plan(plan):
+    """Описание выбранного пути конвертации для пользователя"""
+    if plan and all(p.encoder == 'copy' for p in plan):
+        return "ремукс без перекодирования (потоки копируются)"
+    if not any(p.encoder == 'copy' for p in plan):
+        return "полное перекодирование"
+    parts = []
+    for p in plan:
+        kind = 'видео' if p.codec_type == 'video' else 'аудио'
+        action = 'копируется' if p.encoder == 'copy' else f"{p.codec_name} → {p.encoder}"
+        parts.append(f"{kind} #{p.index}: {action}")
+    return "частичное перекодирование (" + ", ".join(parts) + ")"
+
+
+def video_output_args(output_format, plan):
+    """Параметры ffmpeg одного результата по плану потоков (без входа и имени файла)"""
+    settings = VIDEO_FORMAT_SETTINGS.get(output_format, VIDEO_FORMAT_SETTINGS['mp4'])
+    args = []
+    if plan:
+        for out_index, p in enumerate(plan):
+            args.extend(['-map', f"0:{p.index}", f"-c:{out_index}", p.encoder])
+            args.extend(encoder_args(p.encoder))
+            if p.encoder == 'copy' and p.codec_name == 'hevc' and output_format in ('mp4', 'mov'):
+                # Без тега hvc1 HEVC не воспроизводится в плеерах Apple
+                args.extend([f"-tag:{out_index}", 'hvc1'])
+    else:
+        # Нет данных ffprobe - перекодируем всё
+        video_encoder = pick_encoder(settings['video_codecs'])
+        audio_encoder = pick_encoder(settings['audio_codecs'])
+        args.extend(['-c:v', video_encoder, '-c:a', audio_encoder])
+        args.extend(encoder_args(audio_encoder))
+    return args + settings['extra']
+
+
+def build_video_command(ffmpeg_path, input_path, output_path, output_format, plan):
+    """Команда ffmpeg по плану потоков"""
+    return ([ffmpeg_path, '-i', input_path] + video_output_args(output_format, plan)
+            + ['-y', output_path])
+
+
+def thumbnail_args(info):
+    """Параметры ffmpeg для миниатюры видео (кадр JPEG)"""
+    duration = info.duration if info else None
+    position = min((duration or 0) * THUMBNAIL_POSITION, THUMBNAIL_MAX_SECONDS)
+    stream = f"0:{info.video.index}" if info and info.video else '0:v:0'
+    return [
+        '-map', stream, '-ss', f"{position:.3f}", '-frames:v', '1',
+        '-vf', f"scale='min({THUMBNAIL_WIDTH},iw)':-2", '-q:v', '3',
+    ]
+
+
+def output_args(file_type, output_format, info):
+    """
+    Параметры ffmpeg одного результата (без входа и имени файла). Кодеры
+    проверяются до запуска, а не после долгого декодирования
+    
+    Returns:
+        (параметры, план потоков видео или None)
+    """
+    if output_format == THUMBNAIL:
+        return thumbnail_args(info), None
+    if file_type == 'video':
+        plan = plan_streams(info, output_format) if info else []
+        settings = VIDEO_FORMAT_SETTINGS.get(output_format, VIDEO_FORMAT_SETTINGS['mp4'])
+        if plan:
+            for p in plan:
+                if p.encoder is None:
+                    missing_encoder(settings[f"{p.codec_type}_codecs"])
+        else:
+            for codecs in (settings['video_codecs'], settings['audio_codecs']):
+                if not pick_encoder(codecs):
+                    missing_encoder(codecs)
+        return video_output_args(output_format, plan), plan
+    if file_type == 'audio':
+        encoders, audio_args = AUDIO_FORMAT_SETTINGS.get(output_format, ([], []))
+        encoder = pick_encoder(encoders)
+        if encoders and not encoder:
+            missing_encoder(encoders)
+        if not encoder:
+            return [], None
+        return ['-codec:a', encoder] + encoder_args(encoder) + audio_args, None
+    if file_type == 'image':
+        encoders = IMAGE_FORMAT_ENCODERS.get(output_format, [])
+        if encoders and not pick_encoder(encoders):
+            missing_encoder(encoders)
+        return [], None
+    print(f"ОШИБКА: Неподдерживаемый тип файла: {file_type}")
+    sys.exit(1)
+
+
 def show_format_menu(file_type, available_formats):
-    """Показывает меню выбора формата"""
+    """
+    Показывает меню выбора формата
+    
+    Returns:
+        Список выбранных форматов (несколько - через запятую) или None
+    """
     print(f"\n{'='*60}")
     print(f"Конвертация {file_type.upper()}")
     print(f"{'='*60}")
     print("\nДоступные форматы для конвертации:")
     
     for i, fmt in enumerate(available_formats, 1):
-        print(f"  {i}. {fmt.upper()}")
+        print(f"  {i}. {format_title(fmt)}")
+    print("\nНесколько форматов можно указать через запятую (например, 1,5) -")
+    print("исходник будет декодирован один раз для всех")
     
     while True:
         try:
             choice = input(f"\nВыберите формат (1-{len(available_formats)}) или 'q' для выхода: ").strip().lower()
             if choice == 'q':
                 return None
-            choice_num = int(choice)
-            if 1 <= choice_num <= len(available_formats):
-                return available_formats[choice_num - 1]
+            choice_nums = [int(part) for part in choice.replace(' ', ',').split(',') if part]
+            if choice_nums and all(1 <= num <= len(available_formats) for num in choice_nums):
+                return [available_formats[num - 1] for num in choice_nums]
             else:
                 print("Неверный выбор! Попробуйте снова.")
         except ValueError:
             print("Неверный ввод! Введите число или 'q'.")
 
 
-def convert_file(input_path, output_path, file_type, output_format):
-    """Конвертирует файл в указанный формат"""
+def missing_encoder(encoders):
+    """Завершает работу, если в ffmpeg нет ни одного подходящего кодера"""
+    print(f"ОШИБКА: в установленном ffmpeg нет кодера ({', '.join(encoders)})")
+    print("Установите полную сборку ffmpeg (например, с https://www.gyan.dev/ffmpeg/builds/)")
+    wait_for_enter()
+    sys.exit(1)
+
+
+def require_ffmpeg():
+    """Путь к ffmpeg; если его нет - объясняет, как установить, и завершает работу"""
     ffmpeg_path = find_ffmpeg()
     
     if not ffmpeg_path:
@@ -110,63 +310,101 @@ def convert_file(input_path, output_path, file_type, output_format):
         print("\nПожалуйста, установите ffmpeg:")
         print("1. Скачайте с https://ffmpeg.org/download.html")
         print("2. Распакуйте и добавьте в PATH")
-        input("\nНажмите Enter для выхода...")
-        sys.exit(1)
-    
-    # Параметры для разных типов файлов
-    if file_type == 'video':
-        cmd = [
-            ffmpeg_path, '-i', input_path,
-            '-c:v', 'libx264',
-            '-c:a', 'aac',
-            '-movflags', '+faststart',
-            '-y', output_path
-        ]
-    elif file_type == 'audio':
-        if output_format == 'mp3':
-            cmd = [ffmpeg_path, '-i', input_path, '-codec:a', 'libmp3lame', '-b:a', '192k', '-y', output_path]
-        elif output_format == 'wav':
-            cmd = [ffmpeg_path, '-i', input_path, '-codec:a', 'pcm_s16le', '-y', output_path]
-        elif output_format == 'flac':
-            cmd = [ffmpeg_path, '-i', input_path, '-codec:a', 'flac', '-y', output_path]
-        elif output_format == 'aac':
-            cmd = [ffmpeg_path, '-i', input_path, '-codec:a', 'aac', '-b:a', '192k', '-y', output_path]
-        elif output_format == 'ogg':
-            cmd = [ffmpeg_path, '-i', input_path, '-codec:a', 'libvorbis', '-y', output_path]
-        elif output_format == 'm4a':
-            cmd = [ffmpeg_path, '-i', input_path, '-codec:a', 'aac', '-b:a', '192k', '-y', output_path]
-        elif output_format == 'opus':
-            cmd = [ffmpeg_path, '-i', input_path, '-codec:a', 'libopus', '-y', output_path]
-        else:
-            cmd = [ffmpeg_path, '-i', input_path, '-y', output_path]
-    elif file_type == 'image':
-        cmd = [ffmpeg_path, '-i', input_path, '-y', output_path]
-    else:
-        print(f"ОШИБКА: Неподдерживаемый тип файла: {file_type}")
+        wait_for_enter()
         sys.exit(1)
+    return ffmpeg_path
+
+
+def lookup_cached_output(input_path, output_path, file_type, output_format):
+    """
+    Ищет уже выполненную конвертацию того же содержимого в кэше результатов
     
+    Returns:
+        (cache, key, путь к результату из кэша или None)
+    """
+    cache = get_output_cache()
+    if not cache:
+        return None, None, None
     try:
+        key = job_key(content_fingerprint(input_path), {
+            'action': 'convert',
+            'type': file_type,
+            'format': output_format,
+        })
+        cached_path = cache.fetch(
+            key, output_path, lambda: generate_output_filename(input_path, output_format),
+            existing_output_filenames(input_path, output_format)
+        )
+    except (sqlite3.Error, OSError):
+        return None, None, None
+    if cached_path:
+        print(f"\nРезультат взят из кэша: {os.path.basename(input_path)}")
+        print(f"  Файл сохранен: {cached_path}")
+    return cache, key, cached_path
+
+
+def convert_file(input_path, output_path, file_type, output_format):
+    """
+    Конвертирует файл в указанный формат, возвращает путь к результату.
+    Если output_path не задан, имя выбирается автоматически, а уже выполненная
+    конвертация того же содержимого берётся из кэша результатов.
+    Метрики задачи записываются в журнал (см. telemetry)
+    """
+    with telemetry.job('convert', input_path, file_type, formats=[output_format]) as metrics:
+        result = _convert_file(input_path, output_path, file_type, output_format)
+        metrics.finish(result)
+    return result
+
+
+def _convert_file(input_path, output_path, file_type, output_format):
+    cache, key, cached_path = lookup_cached_output(input_path, output_path, file_type, output_format)
+    if cached_path:
+        telemetry.annotate(cached=True)
+        return cached_path
+    
+    if not output_path:
+        output_path = generate_output_filename(input_path, output_format)
+    
+    # Изображения по возможности конвертируются Pillow, без запуска ffmpeg
+    if file_type == 'image':
+        import image_engine
         print(f"\nКонвертация: {os.path.basename(input_path)}")
         print(f"Формат: {output_format.upper()}")
+        try:
+            converted = image_engine.encode_image(input_path, output_path)
+        except Exception as e:
+            print(f"ОШИБКА: {str(e)}")
+            sys.exit(1)
+        if converted:
+            telemetry.annotate(backend='pillow')
+            return report_converted(input_path, output_path, cache, key)
+    
+    ffmpeg_path = require_ffmpeg()
+    
+    info = None
+    if file_type in ('video', 'audio'):
+        info = probe(input_path, find_ffprobe())
+    duration = info.duration if info else None
+    
+    args, plan = output_args(file_type, output_format, info)
+    cmd = [ffmpeg_path, '-i', input_path] + args + ['-y', output_path]
+    if plan:
+        telemetry.annotate(plan=describe_plan(plan))
+    
+    try:
+        print(f"\nКонвертация: {os.path.basename(input_path)}")
+        print(f"Формат: {format_title(output_format)}")
+        if plan:
+            print(f"Способ: {describe_plan(plan)}")
         print("Это может занять некоторое время...")
         
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True
+        returncode, stderr = run_ffmpeg(
+            cmd, duration=duration, label=os.path.basename(input_path),
+            report=file_type != 'image', live=INTERACTIVE
         )
         
-        stdout, stderr = process.communicate()
-        
-        if process.returncode == 0:
-            input_size = os.path.getsize(input_path) / (1024 * 1024)  # MB
-            output_size = os.path.getsize(output_path) / (1024 * 1024)  # MB
-            
-            print(f"\n✓ Файл успешно конвертирован!")
-            print(f"  Исходный размер: {input_size:.2f} MB")
-            print(f"  Новый размер: {output_size:.2f} MB")
-            print(f"  Файл сохранен: {output_path}")
+        if returncode == 0:
+            return report_converted(input_path, output_path, cache, key)
         else:
             print(f"ОШИБКА при конвертации:")
             print(stderr)
@@ -179,11 +417,112 @@ def convert_file(input_path, output_path, file_type, output_format):
         sys.exit(1)
 
 
+def convert_formats(input_path, file_type, output_formats, thumbnail=False):
+    """
+    Конвертирует файл сразу в несколько форматов одним запуском ffmpeg: исходник
+    декодируется один раз, и кадры получают все кодеры (у каждого результата
+    свои параметры из таблиц форматов). Для видео можно добавить миниатюру
+    
+    Args:
+        input_path: Исходный файл
+        file_type: Тип файла ('video', 'audio', 'image')
+        output_formats: Форматы ('mp4', 'webm', ...)
+        thumbnail: Сохранить также миниатюру видео в JPEG
+    
+    Returns:
+        Пути к результатам в порядке форматов, миниатюра - последней
+    """
+    targets = list(dict.fromkeys(output_formats))
+    if thumbnail and file_type == 'video':
+        targets.append(THUMBNAIL)
+    with telemetry.job('convert', input_path, file_type, formats=targets) as metrics:
+        results = _convert_formats(input_path, file_type, targets)
+        metrics.finish(results)
+    return results
+
+
+def _convert_formats(input_path, file_type, targets):
+    if file_type == 'image' or len(targets) == 1:
+        # Изображение декодируется быстрее запуска ffmpeg - конвертируется по одному
+        return [convert_file(input_path, None, file_type, fmt) for fmt in targets]
+    
+    results = {}
+    pending = []
+    for fmt in targets:
+        cache, key, cached_path = lookup_cached_output(input_path, None, file_type, fmt)
+        if cached_path:
+            results[fmt] = cached_path
+        else:
+            pending.append((fmt, generate_output_filename(input_path, fmt), cache, key))
+    if not pending:
+        return [results[fmt] for fmt in targets]
+    
+    ffmpeg_path = require_ffmpeg()
+    info = probe(input_path, find_ffprobe())
+    duration = info.duration if info else None
+    
+    cmd = [ffmpeg_path, '-i', input_path]
+    plans = {}
+    for fmt, output_path, _, _ in pending:
+        args, plans[fmt] = output_args(file_type, fmt, info)
+        cmd.extend(args + ['-y', output_path])
+    telemetry.annotate(plan={fmt: describe_plan(plan) for fmt, plan in plans.items() if plan} or None)
+    
+    print(f"\nКонвертация: {os.path.basename(input_path)}")
+    print(f"Форматы: {', '.join(format_title(fmt) for fmt, _, _, _ in pending)}")
+    for fmt, _, _, _ in pending:
+        if plans[fmt]:
+            print(f"Способ для {fmt.upper()}: {describe_plan(plans[fmt])}")
+    print("Исходник декодируется один раз для всех форматов")
+    print("Это может занять некоторое время...")
+    
+    returncode, stderr = run_ffmpeg(cmd, duration=duration, label=os.path.basename(input_path),
+                                    live=INTERACTIVE)
+    if returncode != 0:
+        for _, output_path, _, _ in pending:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+        print(f"ОШИБКА при конвертации:")
+        print(stderr)
+        sys.exit(1)
+    for fmt, output_path, cache, key in pending:
+        print(f"\n{format_title(fmt)}:", end='')
+        results[fmt] = report_converted(input_path, output_path, cache, key)
+    return [results[fmt] for fmt in targets]
+
+
+def format_title(output_format):
+    return f"миниатюра {THUMBNAIL_FORMAT.upper()}" if output_format == THUMBNAIL else output_format.upper()
+
+
+def report_converted(input_path, output_path, cache=None, key=None):
+    """Выводит итог конвертации и запоминает результат в кэше"""
+    input_size = os.path.getsize(input_path) / (1024 * 1024)  # MB
+    output_size = os.path.getsize(output_path) / (1024 * 1024)  # MB
+    
+    print(f"\n✓ Файл успешно конвертирован!")
+    print(f"  Исходный размер: {input_size:.2f} MB")
+    print(f"  Новый размер: {output_size:.2f} MB")
+    print(f"  Файл сохранен: {output_path}")
+    if cache:
+        try:
+            cache.store(key, output_path)
+        except (sqlite3.Error, OSError):
+            pass
+    return output_path
+
+
+def _extension(output_format):
+    """Расширение результата: у миниатюры - формат кадра"""
+    return THUMBNAIL_FORMAT if output_format == THUMBNAIL else output_format
+
+
 def generate_output_filename(input_path, output_format):
     """Генерирует имя выходного файла"""
     path = Path(input_path)
     directory = path.parent
     stem = path.stem
+    output_format = _extension(output_format)
     
     output_name = f"{stem}.{output_format.lower()}"
     output_path = directory / output_name
@@ -197,18 +536,89 @@ def generate_output_filename(input_path, output_format):
     return str(output_path)
 
 
+def existing_output_filenames(input_path, output_format):
+    """Уже существующие результаты конвертации файла в его папке"""
+    path = Path(input_path)
+    suffix = f".{_extension(output_format).lower()}"
+    names = [path.parent / f"{path.stem}{suffix}"]
+    names += sorted(path.parent.glob(glob.escape(path.stem) + '_*' + suffix))
+    return [str(name) for name in names if name != path]
+
+
+def convert_job(input_path, file_type, output_formats):
+    """Задача очереди для конвертации файла в форматы (миниатюра - THUMBNAIL)"""
+    formats = [fmt for fmt in output_formats if fmt != THUMBNAIL]
+    job = {
+        'action': 'convert',
+        'path': os.path.abspath(input_path),
+        'file_type': file_type,
+        'format': formats[0] if formats else THUMBNAIL,
+    }
+    if len(formats) > 1 or (formats and THUMBNAIL in output_formats):
+        job['formats'] = formats
+        job['thumbnail'] = THUMBNAIL in output_formats
+    return job
+
+
+def watch_main(argv):
+    """
+    Режим наблюдения за папкой: convert_video.py --watch <папка> <формат> [формат ...].
+    Каждый файл конвертируется в те из форматов, что подходят его типу
+    """
+    import argparse
+    import hot_folder
+    from compress_video import print_batch_summary
+    
+    parser = argparse.ArgumentParser(prog='convert_video.py --watch',
+                                     description="Конвертация новых файлов папки")
+    parser.add_argument('folder', help="Папка наблюдения")
+    parser.add_argument('formats', nargs='+', help="Форматы, например mp4 mp3 webp thumbnail")
+    parser.add_argument('--jobs', type=int, default=None,
+                        help="Ёмкость пула задач (по умолчанию - число ядер)")
+    parser.add_argument('--done', default=None, help="Папка результатов (по умолчанию - done)")
+    parser.add_argument('--originals', default=None,
+                        help="Папка исходников (по умолчанию - originals)")
+    parser.add_argument('--failed', default=None,
+                        help="Папка файлов с ошибкой (по умолчанию - failed)")
+    parser.add_argument('--settle', type=float, default=None,
+                        help="Сколько секунд файл не должен меняться, чтобы его взять")
+    args = parser.parse_args(argv)
+    
+    requested = [fmt.lower().lstrip('.') for fmt in args.formats]
+    available = {}
+    for file_type in ('video', 'audio', 'image'):
+        available[file_type] = get_available_formats(file_type)
+    available['video'] = available['video'] + [THUMBNAIL]
+    if not any(fmt in formats for fmt in requested for formats in available.values()):
+        print(f"ОШИБКА: Недоступные форматы: {', '.join(requested)}")
+        sys.exit(1)
+    
+    def make_job(input_path, file_type):
+        formats = [fmt for fmt in requested if fmt in available.get(file_type, [])]
+        return convert_job(input_path, file_type, formats) if formats else None
+    
+    start = time.time()
+    results = hot_folder.watch(args.folder, make_job, args)
+    print_batch_summary(results, time.time() - start)
+    sys.exit(1 if any(r['error'] for r in results) else 0)
+
+
 def main():
     """Главная функция"""
     if len(sys.argv) < 2:
-        print("Использование: convert_video.py <путь_к_файлу>")
-        input("Нажмите Enter для выхода...")
+        print("Использование: convert_video.py <путь_к_файлу> [формат ...]")
+        print("               convert_video.py --watch <папка> <формат> [формат ...]")
+        wait_for_enter("Нажмите Enter для выхода...")
         sys.exit(1)
     
+    if sys.argv[1] == '--watch':
+        watch_main(sys.argv[2:])
+    
     input_path = sys.argv[1]
     
     if not os.path.exists(input_path):
         print(f"ОШИБКА: Файл не найден: {input_path}")
-        input("Нажмите Enter для выхода...")
+        wait_for_enter("Нажмите Enter для выхода...")
         sys.exit(1)
     
     # Определяем тип файла
@@ -217,7 +627,7 @@ def main():
     if not file_type:
         print(f"ОШИБКА: Неподдерживаемый тип файла: {input_path}")
         print("Поддерживаются: видео, аудио, изображения")
-        input("Нажмите Enter для выхода...")
+        wait_for_enter("Нажмите Enter для выхода...")
         sys.exit(1)
     
     # Получаем доступные форматы
@@ -225,25 +635,45 @@ def main():
     
     if not available_formats:
         print(f"ОШИБКА: Нет доступных форматов для типа: {file_type}")
-        input("Нажмите Enter для выхода...")
+        wait_for_enter("Нажмите Enter для выхода...")
         sys.exit(1)
+    if file_type == 'video':
+        available_formats = available_formats + [THUMBNAIL]
     
-    # Показываем меню выбора формата
-    output_format = show_format_menu(file_type, available_formats)
+    # Форматы можно передать после пути (convert_video.py видео.mov mp4 webm thumbnail),
+    # иначе показывается меню
+    output_formats = [fmt.lower().lstrip('.') for fmt in sys.argv[2:]]
+    unknown = [fmt for fmt in output_formats if fmt not in available_formats]
+    if unknown:
+        print(f"ОШИБКА: Недоступные форматы: {', '.join(unknown)}")
+        print(f"Доступны: {', '.join(available_formats)}")
+        wait_for_enter("Нажмите Enter для выхода...")
+        sys.exit(1)
+    if not output_formats:
+        output_formats = show_format_menu(file_type, available_formats)
     
-    if not output_format:
+    if not output_formats:
         print("Конвертация отменена.")
-        input("Нажмите Enter для выхода...")
+        wait_for_enter("Нажмите Enter для выхода...")
         sys.exit(0)
     
-    # Генерируем имя выходного файла
-    output_path = generate_output_filename(input_path, output_format)
-    
-    # Конвертируем файл
-    convert_file(input_path, output_path, file_type, output_format)
+    # Запуски из контекстного меню собираются в одну очередь
+    import job_server
+    job = convert_job(input_path, file_type, output_formats)
+    start = time.time()
+    results = job_server.run_or_submit(job)
+    if results is None:
+        print(f"Файл добавлен в очередь конвертации: {os.path.basename(input_path)}")
+        sys.exit(0)
+    if len(results) > 1:
+        from compress_video import print_batch_summary
+        print_batch_summary(results, time.time() - start)
+    if any(r['error'] for r in results):
+        wait_for_enter()
+        sys.exit(1)
     
     print("\nГотово!")
-    input("Нажмите Enter для выхода...")
+    wait_for_enter("Нажмите Enter для выхода...")
 
 
 if __name__ == '__main__':
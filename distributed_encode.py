@@ -0,0 +1,502 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Распределённое сжатие видео на нескольких машинах.
+Координатор режет исходник по ключевым кадрам и раздаёт сегменты по TCP
+рабочим узлам, которые кодируют их с настройками compress_video.
+Узлы присылают сигналы активности; сегмент пропавшего узла отдаётся другому.
+
+Узлы подключаются только с общим ключом (--token или SZIMAT_DIST_TOKEN); без ключа
+координатор слушает лишь 127.0.0.1.
+
+Запуск:
+    python distributed_encode.py coordinator видео.mp4 [--port 47700] [--local-workers 2]
+    python distributed_encode.py coordinator видео.mp4 --host 0.0.0.0 --token ключ
+    python distributed_encode.py worker адрес_координатора:47700 --token ключ
+"""
+
+import os
+import re
+import sys
+import hmac
+import json
+import time
+import queue
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+
+from chunked_encode import (
+    ChunkedEncodeError, encode_segment, join_segments, keyframe_times,
+    plan_cut_points, split_source, verify_output,
+)
+
+
+DEFAULT_PORT = 47700
+
+# Рабочий узел шлёт сигнал активности каждые HEARTBEAT_INTERVAL секунд;
+# узел, молчащий дольше HEARTBEAT_TIMEOUT, считается пропавшим
+HEARTBEAT_INTERVAL = 5
+HEARTBEAT_TIMEOUT = 20
+
+# Сколько раз сегмент можно выдать повторно, прежде чем считать задачу неудачной
+MAX_ATTEMPTS = 3
+
+# Сколько секунд координатор ждёт, если не подключён ни один узел, а сегменты остались
+WORKER_WAIT = 300
+
+# Общий ключ узлов по умолчанию
+TOKEN_ENV = 'SZIMAT_DIST_TOKEN'
+
+DEFAULT_HOST = '127.0.0.1'
+
+CHUNK_SIZE = 1024 * 1024
+
+# Узлы принимают только фильтр масштабирования, а не произвольные параметры ffmpeg
+# (включая предел из compress_video.downscale_filter: scale='min(iw,N)':-2)
+_SAFE_FILTER_RE = re.compile(
+    r"^scale=(?:[\w\-():*/.]+|'min\(iw,\d+\)':-2|-2:'min\(ih,\d+\)')$"
+)
+
+
+class DistributedEncodeError(Exception):
+    """Ошибка распределённого кодирования"""
+
+
+def send_message(sock, header, payload_path=None):
+    """Отправляет заголовок JSON одной строкой и, при необходимости, содержимое файла"""
+    header = dict(header)
+    if payload_path:
+        header['size'] = os.path.getsize(payload_path)
+    sock.sendall((json.dumps(header) + '\n').encode('utf-8'))
+    if payload_path:
+        with open(payload_path, 'rb') as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                sock.sendall(chunk)
+
+
+def read_header(stream):
+    """Читает заголовок сообщения"""
+    line = stream.readline(65536)
+    if not line:
+        raise ConnectionError("соединение закрыто")
+    return json.loads(line.decode('utf-8'))
+
+
+def read_payload(stream, size, dest_path):
+    """Сохраняет size байт содержимого сообщения в файл"""
+    tmp_path = dest_path + '.part'
+    remaining = size
+    with open(tmp_path, 'wb') as f:
+        while remaining > 0:
+            chunk = stream.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ConnectionError("соединение закрыто при передаче файла")
+            f.write(chunk)
+            remaining -= len(chunk)
+    os.replace(tmp_path, dest_path)
+
+
+def _is_loopback(host):
+    return host in ('localhost', '::1') or host.startswith('127.')
+
+
+class Coordinator:
+    """Раздаёт сегменты рабочим узлам и собирает результаты"""
+
+    def __init__(self, segment_paths, quality, video_filter, work_dir,
+                 host=DEFAULT_HOST, port=DEFAULT_PORT, token=None,
+                 heartbeat_timeout=HEARTBEAT_TIMEOUT, max_attempts=MAX_ATTEMPTS,
+                 worker_wait=WORKER_WAIT):
+        if not token and not _is_loopback(host):
+            raise DistributedEncodeError(
+                f"для адреса {host} нужен общий ключ узлов (--token или {TOKEN_ENV})"
+            )
+        self.sources = list(segment_paths)
+        self.encoded = [os.path.join(work_dir, f"enc_{i:04d}.mkv") for i in range(len(self.sources))]
+        self.quality = quality
+        self.video_filter = video_filter
+        self.token = (token or '').encode('utf-8')
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_attempts = max_attempts
+        self.worker_wait = worker_wait
+
+        self._pending = queue.Queue()
+        for i in range(len(self.sources)):
+            self._pending.put(i)
+        self._attempts = [0] * len(self.sources)
+        self._done = set()
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        self._error = None
+        # Подключённые узлы и момент, с которого не осталось ни одного
+        self._workers = 0
+        self._idle_since = time.time()
+
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(16)
+        self.port = self.listener.getsockname()[1]
+
+    def _mark_done(self, segment_id):
+        with self._lock:
+            self._done.add(segment_id)
+            print(f"  Сегменты: {len(self._done)}/{len(self.sources)}")
+            if len(self._done) == len(self.sources):
+                self._finished.set()
+
+    def _requeue(self, segment_id, reason):
+        with self._lock:
+            if segment_id in self._done:
+                return
+            self._attempts[segment_id] += 1
+            print(f"  Сегмент {segment_id} будет выдан повторно: {reason}")
+            if self._attempts[segment_id] >= self.max_attempts:
+                self._error = f"сегмент {segment_id} не удалось закодировать: {reason}"
+                self._finished.set()
+                return
+        self._pending.put(segment_id)
+
+    def _check_workers(self):
+        """Завершает задачу с ошибкой, если узлов нет дольше worker_wait секунд"""
+        with self._lock:
+            if self._workers or time.time() - self._idle_since < self.worker_wait:
+                return
+            left = len(self.sources) - len(self._done)
+            self._error = (f"нет подключённых узлов дольше {self.worker_wait:g} с, "
+                           f"осталось сегментов: {left}")
+        self._finished.set()
+
+    def _next_segment(self):
+        # Задача завершается и при ошибке, и когда пропали все узлы (см. run)
+        while not self._finished.is_set():
+            try:
+                return self._pending.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return None
+
+    def _token_matches(self, token):
+        """Сравнивает ключ узла с ожидаемым за постоянное время"""
+        try:
+            return hmac.compare_digest(str(token).encode('utf-8'), self.token)
+        except (TypeError, ValueError):
+            # Например, одиночные суррогаты из JSON не кодируются в UTF-8
+            return False
+
+    def _serve_worker(self, conn, address):
+        name = f"{address[0]}:{address[1]}"
+        with conn:
+            try:
+                conn.settimeout(self.heartbeat_timeout)
+                stream = conn.makefile('rb')
+                hello = read_header(stream)
+                name = hello.get('name', name)
+                if not self._token_matches(hello.get('token', '')):
+                    print(f"  Узел {name} отклонён: неверный ключ")
+                    send_message(conn, {'type': 'rejected'})
+                    return
+                with self._lock:
+                    self._workers += 1
+                print(f"  Подключён узел {name}")
+                try:
+                    self._serve_tasks(conn, stream, name)
+                finally:
+                    with self._lock:
+                        self._workers -= 1
+                        if not self._workers:
+                            self._idle_since = time.time()
+            except (OSError, ValueError, KeyError) as e:
+                print(f"  Узел {name} отключился: {e}")
+
+    def _serve_tasks(self, conn, stream, name):
+        """Выдаёт узлу сегменты, пока они не кончатся"""
+        segment_id = None
+        try:
+            while True:
+                segment_id = self._next_segment()
+                if segment_id is None:
+                    send_message(conn, {'type': 'shutdown'})
+                    return
+                send_message(conn, {
+                    'type': 'task',
+                    'id': segment_id,
+                    'quality': self.quality,
+                    'video_filter': self.video_filter,
+                }, self.sources[segment_id])
+                # Ждём результат; между ними узел шлёт сигналы активности
+                while True:
+                    header = read_header(stream)
+                    if header.get('type') == 'heartbeat':
+                        continue
+                    if header.get('type') == 'result' and header.get('id') == segment_id:
+                        read_payload(stream, header['size'], self.encoded[segment_id])
+                        self._mark_done(segment_id)
+                    else:
+                        self._requeue(segment_id, f"узел {name}: {header.get('message', 'ошибка')}")
+                    segment_id = None
+                    break
+        except (OSError, ValueError, KeyError):
+            if segment_id is not None:
+                self._requeue(segment_id, f"узел {name} не отвечает")
+            raise
+
+    def _accept_loop(self):
+        self.listener.settimeout(0.5)
+        while not self._finished.is_set():
+            try:
+                conn, address = self.listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            threading.Thread(target=self._serve_worker, args=(conn, address), daemon=True).start()
+
+    def run(self):
+        """Ждёт, пока все сегменты не будут закодированы. Возвращает пути результатов"""
+        accept_thread = threading.Thread(target=self._accept_loop, daemon=True)
+        accept_thread.start()
+        try:
+            while not self._finished.wait(0.5):
+                self._check_workers()
+        finally:
+            self._finished.set()
+            self.listener.close()
+            accept_thread.join()
+        if self._error:
+            raise DistributedEncodeError(self._error)
+        return self.encoded
+
+
+def _encode_args(quality, video_filter):
+    """Параметры видеокодера из QUALITY_SETTINGS compress_video"""
+    from compress_video import QUALITY_SETTINGS
+
+    if quality not in QUALITY_SETTINGS:
+        raise ValueError(f"неизвестное качество: {quality}")
+    settings = QUALITY_SETTINGS[quality]
+    args = ['-c:v', 'libx264', '-crf', settings['crf'], '-preset', settings['preset']]
+    if video_filter:
+        if not _SAFE_FILTER_RE.match(video_filter):
+            raise ValueError(f"недопустимый фильтр: {video_filter}")
+        args.extend(['-vf', video_filter])
+    return args
+
+
+def run_worker(address, name=None, threads=None, token=None):
+    """
+    Рабочий узел: получает сегменты, кодирует и отправляет обратно
+
+    Args:
+        address: (host, port) координатора
+        name: Имя узла в журнале координатора
+        threads: Число потоков ffmpeg
+        token: Общий ключ узлов (по умолчанию - из SZIMAT_DIST_TOKEN)
+    """
+    from toolchain import find_ffmpeg
+
+    ffmpeg_path = find_ffmpeg()
+    if not ffmpeg_path:
+        print("ОШИБКА: ffmpeg не найден!")
+        sys.exit(1)
+    name = name or f"{socket.gethostname()}-{os.getpid()}"
+    work_dir = tempfile.mkdtemp(prefix='szimat_worker_')
+    try:
+        with socket.create_connection(address, timeout=30) as sock:
+            sock.settimeout(None)
+            stream = sock.makefile('rb')
+            send_message(sock, {'type': 'hello', 'name': name,
+                                'token': token or os.environ.get(TOKEN_ENV, '')})
+            while True:
+                header = read_header(stream)
+                if header.get('type') == 'shutdown':
+                    return
+                if header.get('type') == 'rejected':
+                    print("ОШИБКА: координатор отклонил узел - неверный ключ (--token)")
+                    sys.exit(1)
+                segment_id = header['id']
+                src = os.path.join(work_dir, f"src_{segment_id:04d}.mkv")
+                dst = os.path.join(work_dir, f"enc_{segment_id:04d}.mkv")
+                read_payload(stream, header['size'], src)
+                print(f"Сегмент {segment_id}: кодирование...")
+
+                outcome = {}
+
+                def encode():
+                    try:
+                        args = _encode_args(header.get('quality', 'medium'), header.get('video_filter'))
+                        encode_segment(ffmpeg_path, src, dst, args, threads)
+                    except (ChunkedEncodeError, ValueError) as e:
+                        outcome['error'] = str(e)
+
+                encoder = threading.Thread(target=encode, daemon=True)
+                encoder.start()
+                while encoder.is_alive():
+                    encoder.join(HEARTBEAT_INTERVAL)
+                    if encoder.is_alive():
+                        send_message(sock, {'type': 'heartbeat', 'id': segment_id})
+
+                if 'error' in outcome:
+                    send_message(sock, {'type': 'error', 'id': segment_id,
+                                        'message': outcome['error'][-2000:]})
+                else:
+                    send_message(sock, {'type': 'result', 'id': segment_id}, dst)
+                for path in (src, dst):
+                    if os.path.exists(path):
+                        os.remove(path)
+    except ConnectionRefusedError:
+        print(f"ОШИБКА: координатор {address[0]}:{address[1]} недоступен")
+        sys.exit(1)
+    except ConnectionError:
+        # Координатор завершился, не дожидаясь узла: задача закончена или прервана
+        print("Координатор закрыл соединение, узел завершает работу")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def spawn_local_workers(count, port, threads=None, token=None):
+    """Запускает рабочие узлы на этой же машине (для проверки без кластера)"""
+    # Ключ передаётся через окружение, а не в командной строке, видимой всем
+    env = dict(os.environ, **{TOKEN_ENV: token}) if token else None
+    processes = []
+    for i in range(count):
+        cmd = [sys.executable, os.path.abspath(__file__), 'worker', f"127.0.0.1:{port}",
+               '--name', f"local-{i + 1}"]
+        if threads:
+            cmd.extend(['--threads', str(threads)])
+        processes.append(subprocess.Popen(cmd, stdin=subprocess.DEVNULL, env=env))
+    return processes
+
+
+def compress_distributed(input_path, output_path, quality='medium', host=DEFAULT_HOST,
+                         port=DEFAULT_PORT, segments=None, local_workers=0,
+                         worker_threads=None, token=None, worker_wait=WORKER_WAIT):
+    """
+    Сжимает видео, раздавая сегменты рабочим узлам
+
+    Args:
+        input_path: Исходное видео
+        output_path: Итоговый файл
+        quality: Качество сжатия ('low', 'medium', 'high')
+        host, port: Адрес, на котором координатор ждёт узлы (не локальный - только с token)
+        segments: Число сегментов (по умолчанию - по минуте на сегмент)
+        local_workers: Сколько рабочих узлов запустить локально
+        worker_threads: Число потоков ffmpeg у локальных узлов
+        token: Общий ключ узлов (по умолчанию - из SZIMAT_DIST_TOKEN)
+        worker_wait: Сколько секунд ждать, если не подключён ни один узел
+
+    Returns:
+        MediaInfo результата
+    """
+    from compress_video import build_encode_args, plan_compression
+    from media_probe import probe
+    from toolchain import find_ffmpeg, find_ffprobe
+
+    ffmpeg_path = find_ffmpeg()
+    ffprobe_path = find_ffprobe()
+    if not ffmpeg_path or not ffprobe_path:
+        raise DistributedEncodeError("ffmpeg или ffprobe не найдены")
+    info = probe(input_path, ffprobe_path)
+    if info is None or info.video is None:
+        raise DistributedEncodeError("не удалось получить сведения о видео")
+
+    plan = plan_compression(info, quality, force=True)
+    _, audio_args, extra_args = build_encode_args(plan, quality)
+    duration = info.video.duration or info.duration
+    segments = segments or max(2, int(duration // 60))
+    token = token or os.environ.get(TOKEN_ENV)
+    if not token and not _is_loopback(host):
+        raise DistributedEncodeError(
+            f"для адреса {host} нужен общий ключ узлов (--token или {TOKEN_ENV})"
+        )
+
+    work_dir = tempfile.mkdtemp(prefix='.dist_', dir=os.path.dirname(os.path.abspath(output_path)))
+    workers = []
+    try:
+        cut_points = plan_cut_points(keyframe_times(ffprobe_path, input_path), duration, segments)
+        sources = split_source(ffmpeg_path, input_path, cut_points, work_dir)
+        coordinator = Coordinator(sources, quality, plan.video_filter, work_dir, host, port,
+                                  token, worker_wait=worker_wait)
+        print(f"Координатор ждёт узлы на порту {coordinator.port}, сегментов: {len(sources)}")
+        if local_workers:
+            workers = spawn_local_workers(local_workers, coordinator.port, worker_threads, token)
+        encoded = coordinator.run()
+        join_segments(ffmpeg_path, encoded, input_path, output_path, audio_args,
+                      extra_args, work_dir)
+        return verify_output(info, output_path, ffprobe_path)
+    finally:
+        for process in workers:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _parse_address(text):
+    host, _, port = text.rpartition(':')
+    return host or '127.0.0.1', int(port or DEFAULT_PORT)
+
+
+def main():
+    """Главная функция"""
+    parser = argparse.ArgumentParser(description="Распределённое сжатие видео")
+    sub = parser.add_subparsers(dest='mode')
+
+    coord = sub.add_parser('coordinator', help="Разрезать видео и раздать узлам")
+    coord.add_argument('input')
+    coord.add_argument('--output')
+    coord.add_argument('--quality', choices=['low', 'medium', 'high'], default='medium')
+    coord.add_argument('--host', default=DEFAULT_HOST,
+                       help="Адрес для узлов (0.0.0.0 - все сети, нужен --token)")
+    coord.add_argument('--port', type=int, default=DEFAULT_PORT)
+    coord.add_argument('--token', help=f"Общий ключ узлов (по умолчанию - {TOKEN_ENV})")
+    coord.add_argument('--worker-wait', type=float, default=WORKER_WAIT,
+                       help="Сколько секунд ждать, если нет ни одного узла")
+    coord.add_argument('--segments', type=int)
+    coord.add_argument('--local-workers', type=int, default=0)
+    coord.add_argument('--worker-threads', type=int)
+
+    worker = sub.add_parser('worker', help="Кодировать сегменты координатора")
+    worker.add_argument('address', help="адрес:порт координатора")
+    worker.add_argument('--name')
+    worker.add_argument('--threads', type=int)
+    worker.add_argument('--token', help=f"Общий ключ узлов (по умолчанию - {TOKEN_ENV})")
+
+    args = parser.parse_args()
+    if args.mode == 'worker':
+        run_worker(_parse_address(args.address), args.name, args.threads, args.token)
+    elif args.mode == 'coordinator':
+        from compress_video import generate_output_filename
+
+        output_path = args.output or generate_output_filename(args.input)
+        start = time.time()
+        try:
+            compress_distributed(
+                args.input, output_path, args.quality, args.host, args.port,
+                args.segments, args.local_workers, args.worker_threads,
+                args.token, args.worker_wait
+            )
+        except (DistributedEncodeError, ChunkedEncodeError) as e:
+            print(f"ОШИБКА: {e}")
+            sys.exit(1)
+        input_size = os.path.getsize(args.input) / (1024 * 1024)
+        output_size = os.path.getsize(output_path) / (1024 * 1024)
+        print(f"\n✓ Видео успешно сжато за {time.time() - start:.1f} с")
+        print(f"  Исходный размер: {input_size:.2f} MB")
+        print(f"  Новый размер: {output_size:.2f} MB")
+        print(f"  Файл сохранен: {output_path}")
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Запуск ffmpeg с построчным разбором машинного вывода прогресса (-progress).
+Показывает процент, fps, скорость и оставшееся время, а из журнала ffmpeg
+хранит только последние строки для сообщения об ошибке
+"""
+
+import re
+import sys
+import time
+import threading
+import subprocess
+from collections import deque, namedtuple
+
+import telemetry
+
+
+# Результат запуска: код возврата и хвост журнала ffmpeg (stderr)
+FFmpegResult = namedtuple('FFmpegResult', ['returncode', 'log'])
+
+# Сколько последних строк stderr хранить для вывода ошибки
+LOG_TAIL_LINES = 40
+
+# Как часто печатать строку прогресса без перерисовки (пакетный режим), в секундах
+PLAIN_REPORT_INTERVAL = 10
+
+_DURATION_RE = re.compile(r'Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)')
+
+
+def parse_timestamp(value):
+    """Переводит 'ЧЧ:ММ:СС.мс' в секунды"""
+    match = re.match(r'(-?\d+):(\d+):(\d+(?:\.\d+)?)', value or '')
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def format_eta(seconds):
+    """Форматирует секунды как Ч:ММ:СС"""
+    seconds = max(0, int(seconds))
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class ProgressReporter:
+    """Печатает прогресс кодирования"""
+
+    def __init__(self, label, duration=None, live=True):
+        self.label = label
+        self.duration = duration
+        self.live = live
+        self.started = time.time()
+        self._last_plain = self.started
+        self._printed = False
+
+    def update(self, state):
+        out_time = state.get('out_time')
+        parts = []
+        if out_time is not None and self.duration:
+            percent = min(100.0, out_time / self.duration * 100)
+            parts.append(f"{percent:5.1f}%")
+        elif out_time is not None:
+            parts.append(format_eta(out_time))
+        if state.get('fps'):
+            parts.append(f"{state['fps']:.1f} fps")
+        if state.get('speed'):
+            parts.append(f"{state['speed']:.2f}x")
+        elapsed = time.time() - self.started
+        if out_time and self.duration and elapsed > 0:
+            # Оценка по фактической скорости с начала кодирования
+            remaining = (self.duration - out_time) * elapsed / out_time
+            parts.append(f"осталось {format_eta(remaining)}")
+        if not parts:
+            return
+
+        line = f"  {self.label}: " + ", ".join(parts)
+        if self.live:
+            sys.stdout.write('\r' + line.ljust(78))
+            sys.stdout.flush()
+            self._printed = True
+        elif time.time() - self._last_plain >= PLAIN_REPORT_INTERVAL:
+            self._last_plain = time.time()
+            print(line)
+
+    def finish(self):
+        if self._printed:
+            sys.stdout.write('\n')
+            sys.stdout.flush()
+
+
+def _read_log(stream, tail, info):
+    """Читает stderr ffmpeg, сохраняя только последние строки"""
+    for line in stream:
+        line = line.rstrip()
+        if 'duration' not in info:
+            match = _DURATION_RE.search(line)
+            if match:
+                hours, minutes, seconds = match.groups()
+                info['duration'] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+        tail.append(line)
+
+
+def _parse_progress(key, value, state):
+    if key in ('out_time_us', 'out_time_ms'):
+        # Оба ключа в ffmpeg содержат микросекунды
+        if value.lstrip('-').isdigit():
+            state['out_time'] = max(0, int(value)) / 1000000
+    elif key == 'out_time':
+        seconds = parse_timestamp(value)
+        if seconds is not None:
+            state['out_time'] = max(0.0, seconds)
+    elif key == 'fps':
+        try:
+            state['fps'] = float(value)
+        except ValueError:
+            pass
+    elif key == 'speed':
+        try:
+            state['speed'] = float(value.rstrip('x'))
+        except ValueError:
+            pass
+    elif key == 'frame' and value.isdigit():
+        state['frame'] = int(value)
+    elif key == 'total_size' and value.isdigit():
+        state['total_size'] = int(value)
+
+
+def run_ffmpeg(cmd, duration=None, label=None, live=True, report=True,
+               tail_lines=LOG_TAIL_LINES):
+    """
+    Запускает ffmpeg и выводит прогресс по ходу кодирования
+
+    Args:
+        cmd: Команда ffmpeg (первый элемент - путь к ffmpeg)
+        duration: Длительность исходника в секундах (None - взять из журнала ffmpeg)
+        label: Подпись в строке прогресса
+        live: Перерисовывать одну строку (иначе - печатать строку раз в несколько секунд)
+        report: Выводить прогресс (для изображений не нужен)
+        tail_lines: Сколько последних строк журнала сохранить
+
+    Returns:
+        FFmpegResult(returncode, log)
+    """
+    cmd = [cmd[0], '-hide_banner', '-progress', 'pipe:1', '-nostats'] + list(cmd[1:])
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        stdin=subprocess.DEVNULL,
+        universal_newlines=True,
+        encoding='utf-8',
+        errors='replace'
+    )
+
+    tail = deque(maxlen=tail_lines)
+    info = {}
+    log_thread = threading.Thread(target=_read_log, args=(process.stderr, tail, info), daemon=True)
+    log_thread.start()
+
+    reporter = ProgressReporter(label or 'ffmpeg', duration, live)
+    state = {}
+    try:
+        for line in process.stdout:
+            key, sep, value = line.strip().partition('=')
+            if not sep:
+                continue
+            _parse_progress(key, value.strip(), state)
+            if key == 'progress' and report:
+                if reporter.duration is None:
+                    reporter.duration = info.get('duration')
+                reporter.update(state)
+        # Процессорное время и пиковая память ffmpeg - в метрики задачи (см. telemetry)
+        user, system, max_rss = telemetry.wait_with_usage(process)
+        telemetry.record_process(telemetry.ProcessUsage(
+            time.perf_counter() - started, user, system, max_rss,
+            state.get('frame'), state.get('out_time')
+        ))
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        log_thread.join()
+        reporter.finish()
+
+    return FFmpegResult(process.returncode, '\n'.join(tail))
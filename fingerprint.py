@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Быстрые отпечатки медиафайлов.
+Вместо чтения файла целиком хэшируются блоки фиксированного размера из начала,
+конца и равномерно расположенных мест, плюс размер и время изменения. Время
+не зависит от размера файла. Строгий режим хэширует содержимое полностью
+"""
+
+import os
+import sys
+import hashlib
+import argparse
+from functools import lru_cache
+
+
+# Размер и число читаемых блоков
+BLOCK_SIZE = 64 * 1024
+SAMPLE_BLOCKS = 16
+
+# Размер чтения в строгом режиме
+FULL_READ_SIZE = 4 * 1024 * 1024
+
+# Меняется при изменении алгоритма - отпечатки разных версий не совпадают
+FINGERPRINT_VERSION = 1
+
+# Строгий режим по умолчанию (SZIMAT_STRICT_FINGERPRINT=1)
+STRICT = os.environ.get('SZIMAT_STRICT_FINGERPRINT', '') not in ('', '0')
+
+
+def sample_offsets(size, blocks=SAMPLE_BLOCKS, block_size=BLOCK_SIZE):
+    """Смещения блоков: первый, последний и равномерно между ними"""
+    if size <= blocks * block_size:
+        return []
+    step = (size - block_size) / (blocks - 1)
+    return [int(i * step) for i in range(blocks)]
+
+
+def _read_all(f, digest):
+    while True:
+        data = f.read(FULL_READ_SIZE)
+        if not data:
+            break
+        digest.update(data)
+
+
+@lru_cache(maxsize=1024)
+def _content_digest(path, size, mtime_ns, strict):
+    # size и mtime_ns входят в ключ кэша: изменённый файл хэшируется заново
+    if strict:
+        digest = hashlib.sha256()
+    else:
+        digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        offsets = [] if strict else sample_offsets(size)
+        if not offsets:
+            # Маленький файл или строгий режим - читается целиком
+            _read_all(f, digest)
+        for offset in offsets:
+            f.seek(offset)
+            digest.update(f.read(BLOCK_SIZE))
+    return digest.hexdigest()
+
+
+def fingerprint(path, strict=None, with_mtime=True):
+    """
+    Отпечаток файла
+
+    Args:
+        path: Путь к файлу
+        strict: Хэшировать содержимое целиком (по умолчанию - STRICT)
+        with_mtime: Учитывать время изменения. Без него отпечаток зависит только
+                    от содержимого и совпадает у копий файла
+
+    Returns:
+        Строка вида 's1:<размер>:<хэш>[:<mtime_ns>]' ('f1:...' в строгом режиме)
+    """
+    strict = STRICT if strict is None else strict
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    digest = _content_digest(path, stat.st_size, stat.st_mtime_ns, strict)
+    parts = [f"{'f' if strict else 's'}{FINGERPRINT_VERSION}", str(stat.st_size), digest]
+    if with_mtime:
+        parts.append(str(stat.st_mtime_ns))
+    return ':'.join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Отпечатки медиафайлов")
+    parser.add_argument('paths', nargs='+', help="Файлы")
+    parser.add_argument('--strict', action='store_true', help="Хэшировать файлы целиком")
+    parser.add_argument('--content', action='store_true',
+                        help="Без времени изменения (одинаковый отпечаток у копий)")
+    args = parser.parse_args()
+
+    failed = False
+    for path in args.paths:
+        try:
+            print(f"{fingerprint(path, args.strict, not args.content)}  {path}")
+        except OSError as e:
+            print(f"ОШИБКА: {path}: {e}")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""
+Папка наблюдения: файлы, положенные в неё, сжимаются или конвертируются сами.
+Новые файлы замечает inotify (Linux), в остальных системах - опрос папки.
+Файл берётся в работу, только когда его размер и время изменения не меняются
+SETTLE_SECONDS секунд (копирование завершено). Взятый файл переносится во внутреннюю
+папку задачи, поэтому результаты не появляются в папке наблюдения, а после сбоя
+незавершённые файлы возвращаются в очередь. Задачи выполняет тот же пул, что и
+пакетный режим: в работе одновременно не больше задач, чем слотов пула, остальные
+ждут очереди - сотни новых файлов не запускают сотни ffmpeg.
+Результаты переносятся в папку done, исходники - в originals, файлы с ошибкой -
+в failed (рядом - описание ошибки)
+"""
+
+import os
+import sys
+import time
+import shutil
+import select
+import struct
+from collections import deque
+
+
+# Сколько секунд размер и время изменения файла должны не меняться
+SETTLE_SECONDS = 5
+
+# Период опроса папки, если inotify недоступен
+POLL_INTERVAL = 2
+
+# Период проверки файлов, которые ещё копируются, и завершения задач
+TICK = 0.5
+
+# Внутренняя папка задач (скрытая: пакетный режим и опрос её не видят)
+WORK_DIR_NAME = '.szimat_processing'
+
+# Файл в папке задачи с именем исходника
+SOURCE_MARKER = '.szimat_source'
+
+# Недописанные файлы браузеров и программ копирования
+PARTIAL_SUFFIXES = ('.part', '.partial', '.crdownload', '.download', '.tmp', '.filepart', '~')
+
+
+class InotifyWatcher:
+    """События папки через inotify (ctypes, без зависимостей)"""
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+
+    _EVENT = struct.Struct('iIII')
+
+    def __init__(self, directory):
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        mask = (self.IN_MODIFY | self.IN_ATTRIB | self.IN_CLOSE_WRITE | self.IN_MOVED_TO
+                | self.IN_CREATE)
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch")
+
+    def wait(self, timeout):
+        """
+        Ждёт событий не дольше timeout секунд
+
+        Returns:
+            Множество имён изменившихся файлов или None - нужно пересканировать папку
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        names = set()
+        if not readable:
+            return names
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return names
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = self._EVENT.unpack_from(data, offset)
+                offset += self._EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & self.IN_Q_OVERFLOW:
+                    # События потеряны - их заменит полное сканирование
+                    return None
+                if name:
+                    names.add(os.fsdecode(name))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Опрос папки: каждые interval секунд - полное сканирование"""
+
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval) if timeout is not None else self.interval)
+        return None
+
+    def close(self):
+        pass
+
+
+def open_watcher(directory, poll_interval=POLL_INTERVAL):
+    """inotify, если он есть, иначе опрос"""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError) as e:
+            print(f"inotify недоступен ({e}), папка опрашивается каждые {poll_interval} с")
+    return PollingWatcher(poll_interval)
+
+
+def is_candidate(name):
+    """Файлы, которые ещё копируются или скрыты, не рассматриваются"""
+    return not name.startswith('.') and not name.lower().endswith(PARTIAL_SUFFIXES)
+
+
+def unique_path(directory, name):
+    """Путь в папке без перезаписи: имя, имя_1, имя_2..."""
+    stem, ext = os.path.splitext(name)
+    path = os.path.join(directory, name)
+    counter = 1
+    while os.path.exists(path):
+        path = os.path.join(directory, f"{stem}_{counter}{ext}")
+        counter += 1
+    return path
+
+
+def move_to(path, directory):
+    """Переносит файл или папку в directory, возвращает новый путь"""
+    os.makedirs(directory, exist_ok=True)
+    target = unique_path(directory, os.path.basename(path))
+    shutil.move(path, target)
+    return target
+
+
+class StabilityTracker:
+    """Файлы, которые дописываются: готов тот, что не менялся settle секунд"""
+
+    def __init__(self, settle=SETTLE_SECONDS):
+        self.settle = settle
+        self._files = {}
+
+    def __len__(self):
+        return len(self._files)
+
+    def touch(self, path):
+        """Файл изменился (или впервые замечен)"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._files.pop(path, None)
+            return
+        self._files[path] = (stat.st_size, stat.st_mtime_ns, time.monotonic())
+
+    def known(self, path):
+        return path in self._files
+
+    def ready(self):
+        """Список файлов, которые перестали меняться (они больше не отслеживаются)"""
+        now = time.monotonic()
+        done = []
+        for path, (size, mtime, since) in list(self._files.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self._files[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+                self._files[path] = (stat.st_size, stat.st_mtime_ns, now)
+            elif stat.st_size and now - since >= self.settle:
+                del self._files[path]
+                done.append(path)
+        return sorted(done)
+
+
+class HotFolder:
+    """
+    Наблюдение за папкой
+
+    Args:
+        directory: Папка наблюдения
+        make_job: Функция (путь, тип файла) -> задача для job_server.run_job
+                  или None, если файл этим режимом не обрабатывается
+        jobs: Ёмкость пула задач (по умолчанию - число ядер)
+        done_dir, originals_dir, failed_dir: Папки результатов, исходников
+                  и ошибок (по умолчанию - done, originals и failed внутри directory)
+    """
+
+    def __init__(self, directory, make_job, jobs=None, done_dir=None, originals_dir=None,
+                 failed_dir=None, settle=SETTLE_SECONDS, poll_interval=POLL_INTERVAL):
+        self.directory = os.path.abspath(directory)
+        self.make_job = make_job
+        self.jobs = jobs
+        self.done_dir = done_dir or os.path.join(self.directory, 'done')
+        self.originals_dir = originals_dir or os.path.join(self.directory, 'originals')
+        self.failed_dir = failed_dir or os.path.join(self.directory, 'failed')
+        self.work_dir = os.path.join(self.directory, WORK_DIR_NAME)
+        self.poll_interval = poll_interval
+        self.tracker = StabilityTracker(settle)
+        self.results = []
+        self._ready = deque()
+        self._running = {}
+        self._ignored = set()
+        self._counter = 0
+
+    def _scan(self):
+        """Все файлы верхнего уровня папки (вложенные папки - это done, failed...)"""
+        try:
+            with os.scandir(self.directory) as entries:
+                return [entry.name for entry in entries if entry.is_file()]
+        except OSError:
+            return []
+
+    def _notice(self, names):
+        from media_probe import detect_file_type
+
+        for name in names:
+            path = os.path.join(self.directory, name)
+            # Изменения уже отслеживаемых файлов замечает tracker.ready
+            if not is_candidate(name) or path in self._ignored or self.tracker.known(path):
+                continue
+            if not os.path.isfile(path):
+                continue
+            if not detect_file_type(path):
+                self._ignored.add(path)
+                print(f"Пропуск (неподдерживаемый тип): {name}")
+                continue
+            self.tracker.touch(path)
+
+    def _claim(self, path):
+        """Переносит готовый файл в папку задачи; None - файл ещё занят или исчез"""
+        self._counter += 1
+        job_dir = os.path.join(self.work_dir, f"{int(time.time() * 1000)}_{self._counter}")
+        os.makedirs(job_dir)
+        staged = os.path.join(job_dir, os.path.basename(path))
+        try:
+            # В пределах одной папки перенос атомарен; в Windows открытый файл не переносится
+            os.replace(path, staged)
+        except OSError:
+            os.rmdir(job_dir)
+            return None
+        with open(os.path.join(job_dir, SOURCE_MARKER), 'w', encoding='utf-8') as f:
+            f.write(os.path.basename(path))
+        return staged
+
+    def recover(self):
+        """Возвращает в папку файлы незавершённых задач прошлого запуска"""
+        if not os.path.isdir(self.work_dir):
+            return
+        for job_name in sorted(os.listdir(self.work_dir)):
+            job_dir = os.path.join(self.work_dir, job_name)
+            try:
+                with open(os.path.join(job_dir, SOURCE_MARKER), encoding='utf-8') as f:
+                    source = f.read().strip()
+            except OSError:
+                source = None
+            if source and os.path.exists(os.path.join(job_dir, source)):
+                target = move_to(os.path.join(job_dir, source), self.directory)
+                print(f"Возвращён в очередь: {os.path.basename(target)}")
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+    def _submit(self, pool, staged):
+        from media_probe import detect_file_type
+        from job_server import run_job
+
+        file_type = detect_file_type(staged)
+        job = self.make_job(staged, file_type)
+        if job is None:
+            self._finish(staged, {
+                'input': staged, 'output': None, 'input_size': os.path.getsize(staged),
+                'output_size': 0, 'skipped': False,
+                'error': 'для этого типа файла не задан формат',
+            })
+            return
+        print(f"В работе: {os.path.basename(staged)}")
+        future = pool.submit(file_type, run_job, job, pool.threads_for(file_type))
+        self._running[future] = staged
+
+    def _finish(self, staged, result):
+        """Разносит результат задачи, исходник и ошибки по папкам"""
+        job_dir = os.path.dirname(staged)
+        name = os.path.basename(staged)
+        if result['error']:
+            target = move_to(staged, self.failed_dir)
+            with open(target + '.error.txt', 'w', encoding='utf-8') as f:
+                f.write(result['error'] + '\n')
+            print(f"✗ {name}: {result['error']} -> {self.failed_dir}")
+        elif result.get('skipped'):
+            # Сжатие бесполезно - исходник и есть результат
+            move_to(staged, self.done_dir)
+            print(f"✓ {name}: без изменений -> {self.done_dir}")
+        else:
+            outputs = [entry for entry in os.listdir(job_dir)
+                       if entry not in (name, SOURCE_MARKER)]
+            for entry in outputs:
+                move_to(os.path.join(job_dir, entry), self.done_dir)
+            move_to(staged, self.originals_dir)
+            print(f"✓ {name}: {', '.join(outputs)} -> {self.done_dir}")
+        shutil.rmtree(job_dir, ignore_errors=True)
+        result['input'] = os.path.join(self.directory, name)
+        self.results.append(result)
+
+    def _collect(self):
+        for future in [future for future in self._running if future.done()]:
+            staged = self._running.pop(future)
+            self._finish(staged, future.result())
+
+    def run(self):
+        """Наблюдает за папкой до Ctrl+C; возвращает результаты всех задач"""
+        from worker_pool import WorkerPool
+        from image_engine import process_pool
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.recover()
+        watcher = open_watcher(self.directory, self.poll_interval)
+        mode = 'inotify' if isinstance(watcher, InotifyWatcher) else 'опрос'
+        with WorkerPool(self.jobs) as pool, process_pool(pool.capacity):
+            print(f"Наблюдение за папкой: {self.directory} ({mode}, задач одновременно: "
+                  f"до {pool.capacity})")
+            print("Результаты: " + self.done_dir)
+            print("Остановка: Ctrl+C")
+            names = None
+            try:
+                while True:
+                    self._notice(self._scan() if names is None else names)
+                    for path in self.tracker.ready():
+                        staged = self._claim(path)
+                        if staged:
+                            self._ready.append(staged)
+                        else:
+                            self.tracker.touch(path)
+                    # Пока все слоты заняты, готовые файлы ждут здесь, а не в пуле
+                    while self._ready and len(self._running) < pool.capacity:
+                        self._submit(pool, self._ready.popleft())
+                    self._collect()
+                    busy = len(self.tracker) or self._ready or self._running
+                    names = watcher.wait(TICK if busy else self.poll_interval)
+            except KeyboardInterrupt:
+                print("\nОстановка: дожидаемся задач в работе...")
+                # Взятые, но не начатые файлы возвращаются в папку
+                while self._ready:
+                    move_to(self._ready.popleft(), self.directory)
+                for future, staged in list(self._running.items()):
+                    result = future.result()
+                    if not result['error']:
+                        self._finish(staged, result)
+                # Ctrl+C в консоли прерывает и ffmpeg: такие задачи не ошибочны,
+                # их исходники вернутся в папку
+                self.recover()
+            finally:
+                watcher.close()
+        return self.results
+
+
+def watch(directory, make_job, args):
+    """Запуск наблюдения с параметрами командной строки (--jobs, --done, --originals...)"""
+    settle = args.settle if args.settle is not None else SETTLE_SECONDS
+    folder = HotFolder(directory, make_job, args.jobs, args.done, args.originals, args.failed,
+                       settle)
+    return folder.run()
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Сжатие и конвертация изображений без запуска ffmpeg - через Pillow, если он установлен.
+Для папок с тысячами фотографий запуск процесса ffmpeg на каждый файл занимает
+больше времени, чем само кодирование. Pillow работает в том же процессе, а в пакетном
+режиме - в пуле процессов (кодирование в потоках упирается в GIL).
+Файлы, с которыми Pillow не справляется (анимация, редкие форматы), по-прежнему
+обрабатывает ffmpeg
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+
+
+# 'auto' - Pillow, если он установлен; 'ffmpeg' - всегда ffmpeg
+BACKEND = os.environ.get('SZIMAT_IMAGE_BACKEND', 'auto').lower()
+
+# Качество JPEG, близкое по размеру к -q:v 5/3/2 у ffmpeg
+JPEG_QUALITY = {'low': 80, 'medium': 88, 'high': 93}
+
+# Параметры сохранения по расширению результата: (формат Pillow, параметры)
+SAVE_SETTINGS = {
+    '.jpg': ('JPEG', {'optimize': True}),
+    '.jpeg': ('JPEG', {'optimize': True}),
+    '.png': ('PNG', {'compress_level': 6}),
+    '.webp': ('WEBP', {'quality': 80, 'method': 4}),
+    '.bmp': ('BMP', {}),
+    '.tiff': ('TIFF', {'compression': 'packbits'}),
+    '.tif': ('TIFF', {'compression': 'packbits'}),
+    '.gif': ('GIF', {'optimize': True}),
+}
+
+# Режимы изображения, которые формат сохраняет как есть (остальные переводятся в RGB)
+KEEP_MODES = {
+    'JPEG': {'RGB', 'L', 'CMYK'},
+    'PNG': {'RGB', 'RGBA', 'L', 'LA', 'P', 'I;16'},
+    'WEBP': {'RGB', 'RGBA'},
+    'BMP': {'RGB', 'L', 'P'},
+    'TIFF': {'RGB', 'RGBA', 'L', 'LA', 'P', 'CMYK', 'I;16'},
+    'GIF': {'P', 'L'},
+}
+
+
+@lru_cache(maxsize=1)
+def _pillow():
+    """Модуль PIL.Image или None (импортируется при первом обращении)"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+
+@lru_cache(maxsize=1)
+def _webp_supported():
+    from PIL import features
+    return features.check('webp')
+
+
+def can_write(output_format):
+    """Может ли Pillow записать файл в формате 'jpg', '.png'..."""
+    if BACKEND == 'ffmpeg':
+        return False
+    ext = '.' + output_format.lower().lstrip('.')
+    if ext not in SAVE_SETTINGS:
+        return False
+    if _pillow() is None:
+        return False
+    return ext != '.webp' or _webp_supported()
+
+
+def _prepare(image, pil_format):
+    """Переводит изображение в режим, который формат может сохранить"""
+    if image.mode in KEEP_MODES[pil_format]:
+        return image
+    if pil_format == 'GIF':
+        return image.convert('RGB').quantize(256)
+    if pil_format in ('WEBP', 'PNG', 'TIFF') and 'A' in image.getbands():
+        return image.convert('RGBA')
+    if image.mode == 'P' and 'transparency' in image.info and pil_format != 'JPEG':
+        return image.convert('RGBA')
+    # Прозрачность при сохранении в JPEG/BMP отбрасывается, как и у ffmpeg
+    return image.convert('RGB')
+
+
+def _jpeg_sampling(image):
+    """Прореживание цвета исходного JPEG (0 - 4:4:4, 1 - 4:2:2, 2 - 4:2:0) или -1"""
+    if image.format != 'JPEG':
+        return -1
+    from PIL import JpegImagePlugin
+    return JpegImagePlugin.get_sampling(image)
+
+
+def encode(input_path, output_path, quality=None):
+    """
+    Сохраняет изображение в формате по расширению output_path
+
+    Args:
+        input_path: Исходное изображение
+        output_path: Результат
+        quality: 'low', 'medium', 'high' для сжатия или None для конвертации
+                 с параметрами формата по умолчанию
+
+    Returns:
+        True, если файл записан; False, если Pillow не может прочитать исходник -
+        тогда его нужно обработать ffmpeg
+    """
+    Image = _pillow()
+    pil_format, options = SAVE_SETTINGS[os.path.splitext(output_path)[1].lower()]
+    options = dict(options)
+    try:
+        with Image.open(input_path) as source:
+            # Анимацию Pillow сохранил бы одним кадром
+            if getattr(source, 'n_frames', 1) > 1:
+                return False
+            source.load()
+            image = source.copy()
+            sampling = _jpeg_sampling(source)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return False
+
+    if pil_format == 'JPEG':
+        options['quality'] = JPEG_QUALITY.get(quality, 75)
+        # Как у ffmpeg: JPEG сохраняет прореживание цвета, остальные - 4:4:4
+        options['subsampling'] = sampling if sampling >= 0 else 0
+    for key in ('exif', 'icc_profile'):
+        if image.info.get(key) and pil_format in ('JPEG', 'PNG', 'WEBP', 'TIFF'):
+            options[key] = image.info[key]
+
+    prepared = _prepare(image, pil_format)
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        prepared.save(tmp_path, pil_format, **options)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return True
+
+
+def _pool_worker_init():
+    # Ctrl+C обрабатывает основной процесс (режим наблюдения дожидается задач в работе)
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Pillow загружается в каждом процессе пула один раз, а не в первой задаче
+    _pillow()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+@contextmanager
+def process_pool(workers=None):
+    """
+    Пакетный режим: пока контекст открыт, run и encode_image выполняют работу в пуле
+    процессов. Процессы запускаются при первом изображении
+    """
+    global _pool
+    from concurrent.futures import ProcessPoolExecutor
+    from worker_pool import cpu_count
+
+    executor = ProcessPoolExecutor(
+        max_workers=workers or cpu_count(), initializer=_pool_worker_init
+    )
+    with _pool_lock:
+        previous, _pool = _pool, executor
+    try:
+        yield executor
+    finally:
+        with _pool_lock:
+            _pool = previous
+        executor.shutdown()
+
+
+def run(fn, *args):
+    """
+    Выполняет fn(*args) в пуле процессов, если он открыт, иначе в текущем процессе.
+    fn должна быть функцией верхнего уровня модуля (передаётся в другой процесс)
+    """
+    with _pool_lock:
+        executor = _pool
+    if executor is None:
+        return fn(*args)
+    return executor.submit(fn, *args).result()
+
+
+def encode_image(input_path, output_path, quality=None):
+    """
+    Кодирует изображение через Pillow (см. run)
+
+    Returns:
+        True, если файл записан; False, если нужен ffmpeg
+    """
+    if not can_write(os.path.splitext(output_path)[1]):
+        return False
+    return run(encode, input_path, output_path, quality)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Подбор качества JPEG/WebP для каждого изображения по SSIM или PSNR.
+Качество кодера ищется двоичным поиском: каждый вариант кодируется в памяти,
+декодируется и сравнивается с исходником прямо в процессе (Pillow и numpy, без
+запуска ffmpeg). Сохраняется самый маленький вариант, который держит заданный
+уровень; если он не меньше исходного файла, сохраняется копия исходника
+"""
+
+import io
+import os
+import shutil
+from collections import namedtuple
+
+
+# Диапазон поиска качества кодера
+QUALITY_MIN = 30
+QUALITY_MAX = 95
+
+# SSIM считается по блокам WINDOW x WINDOW пикселей (без перекрытия - так
+# быстрее скользящего окна при почти тех же значениях); константы - из определения метрики
+WINDOW = 8
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+# Форматы, для которых подбирается качество: расширение -> формат Pillow
+SEARCH_FORMATS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.webp': 'WEBP'}
+
+
+# quality - None, если сохранён исходник
+ImageChoice = namedtuple('ImageChoice', ['quality', 'score', 'size', 'evaluations'])
+
+
+class ImageQualityError(Exception):
+    """Подбор качества изображения невозможен"""
+
+
+def available():
+    """Установлены ли Pillow и numpy"""
+    try:
+        import numpy  # noqa: F401
+        from PIL import Image  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def supports(output_path):
+    return os.path.splitext(output_path)[1].lower() in SEARCH_FORMATS
+
+
+def _blocks(plane):
+    """Плоскость как массив блоков WINDOW x WINDOW (неполные блоки у края отбрасываются)"""
+    height = plane.shape[0] // WINDOW * WINDOW
+    width = plane.shape[1] // WINDOW * WINDOW
+    if not height or not width:
+        # Изображение меньше окна - один блок на всё изображение
+        return plane.reshape(1, plane.shape[0], 1, plane.shape[1])
+    return plane[:height, :width].reshape(height // WINDOW, WINDOW, width // WINDOW, WINDOW)
+
+
+def _block_stats(blocks):
+    mean = blocks.mean(axis=(1, 3))
+    return mean, (blocks * blocks).mean(axis=(1, 3)) - mean * mean
+
+
+class Reference:
+    """Исходное изображение и его статистики, которые не меняются между вариантами"""
+
+    def __init__(self, image, metric):
+        self.metric = metric
+        self.alpha = 'A' in image.getbands()
+        self.planes = self._planes_of(image)
+        if metric == 'ssim':
+            self.blocks = [_blocks(plane) for plane in self.planes]
+            self.stats = [_block_stats(blocks) for blocks in self.blocks]
+
+    def _planes_of(self, image):
+        """Яркость и, если у исходника есть прозрачность, альфа-канал"""
+        import numpy as np
+
+        planes = [np.asarray(image.convert('L'), dtype=np.float32)]
+        if self.alpha:
+            if 'A' in image.getbands():
+                planes.append(np.asarray(image.getchannel('A'), dtype=np.float32))
+            else:
+                planes.append(np.full(planes[0].shape, 255.0, dtype=np.float32))
+        return planes
+
+    def score(self, image):
+        """Качество варианта: по худшей плоскости (яркость и прозрачность)"""
+        import numpy as np
+
+        scores = []
+        for index, plane in enumerate(self._planes_of(image)):
+            reference = self.planes[index]
+            if reference.shape != plane.shape:
+                raise ImageQualityError("размер изображения изменился при кодировании")
+            if self.metric == 'psnr':
+                mse = float(np.mean((reference - plane) ** 2))
+                scores.append(float('inf') if mse == 0 else 10 * float(np.log10(255 ** 2 / mse)))
+                continue
+            ref_mean, ref_var = self.stats[index]
+            blocks = _blocks(plane)
+            mean, var = _block_stats(blocks)
+            covar = (self.blocks[index] * blocks).mean(axis=(1, 3)) - ref_mean * mean
+            ssim_map = ((2 * ref_mean * mean + SSIM_C1) * (2 * covar + SSIM_C2)) / (
+                (ref_mean ** 2 + mean ** 2 + SSIM_C1) * (ref_var + var + SSIM_C2)
+            )
+            scores.append(float(ssim_map.mean()))
+        return min(scores)
+
+
+def _encoder_options(source, pil_format):
+    """Параметры кодера, не зависящие от качества"""
+    from PIL import JpegImagePlugin
+
+    options = {}
+    for key in ('exif', 'icc_profile'):
+        if source.info.get(key):
+            options[key] = source.info[key]
+    if pil_format == 'JPEG':
+        options['optimize'] = True
+        sampling = JpegImagePlugin.get_sampling(source) if source.format == 'JPEG' else -1
+        options['subsampling'] = sampling if sampling >= 0 else 2
+    else:
+        options['method'] = 4
+    return options
+
+
+def search_quality(input_path, output_path, metric='ssim', target=0.98):
+    """
+    Подбирает качество JPEG/WebP и записывает результат в output_path
+
+    Args:
+        input_path: Исходное изображение
+        output_path: Результат (.jpg, .jpeg или .webp)
+        metric: 'ssim' или 'psnr'
+        target: Требуемое значение метрики
+
+    Returns:
+        ImageChoice
+    """
+    from PIL import Image
+
+    pil_format = SEARCH_FORMATS[os.path.splitext(output_path)[1].lower()]
+    try:
+        with Image.open(input_path) as source:
+            if getattr(source, 'n_frames', 1) > 1:
+                raise ImageQualityError("анимированные изображения не поддерживаются")
+            source.load()
+            options = _encoder_options(source, pil_format)
+            image = source.copy()
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise ImageQualityError(f"не удалось прочитать изображение: {e}")
+
+    if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    elif pil_format == 'WEBP' and image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    reference = Reference(image, metric)
+
+    def evaluate(quality):
+        buffer = io.BytesIO()
+        image.save(buffer, pil_format, quality=quality, **options)
+        data = buffer.getvalue()
+        with Image.open(io.BytesIO(data)) as decoded:
+            return reference.score(decoded), data
+
+    # Качество растёт с параметром почти монотонно - ищется наименьший проходящий
+    passing = []
+    evaluations = 0
+    low, high = QUALITY_MIN, QUALITY_MAX
+    while low <= high:
+        quality = (low + high) // 2
+        score, data = evaluate(quality)
+        evaluations += 1
+        if score >= target:
+            passing.append((len(data), quality, score, data))
+            high = quality - 1
+        else:
+            low = quality + 1
+
+    input_size = os.path.getsize(input_path)
+    smallest = min(passing) if passing else None
+    if smallest is None or smallest[0] >= input_size:
+        # Результат не должен быть больше исходника и хуже заданного уровня
+        shutil.copyfile(input_path, output_path)
+        return ImageChoice(None, None, input_size, evaluations)
+
+    size, quality, score, data = smallest
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return ImageChoice(quality, score, size, evaluations)
@@ -11,7 +11,7 @@ import winreg
 from pathlib import Path
 
 
-def get_script_path(script_name='compress_video.py'):
+def get_script_path(script_name='compress_video.py', action=None):
     """Получает абсолютный путь к скрипту"""
     # Путь к текущему скрипту
     current_dir = Path(__file__).parent.absolute()
@@ -21,6 +21,8 @@ def get_script_path(script_name='compress_video.py'):
     python_exe = sys.executable
     
     # Формируем команду для запуска
+    if action:
+        return f'"{python_exe}" "{script_path}" {action} "%1"'
     return f'"{python_exe}" "{script_path}" "%1"'
 
 
@@ -41,8 +43,9 @@ def add_to_registry():
     ]
     
     # Команды для запуска
-    compress_command = get_script_path('compress_video.py')
-    convert_command = get_script_path('convert_video.py')
+    # Запуск через launcher.py: модули сжатия загружаются только при необходимости
+    compress_command = get_script_path('launcher.py', 'compress')
+    convert_command = get_script_path('launcher.py', 'convert')
     
     try:
         # Добавляем "Сжать" для всех файлов (фото, видео, аудио)
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Единая очередь задач для запусков из контекстного меню.
+Первый запуск становится сервером, а последующие передают ему путь
+через локальный сокет и сразу завершаются. Сокет доступен всем локальным
+пользователям, поэтому задача принимается только со случайным ключом сервера,
+который записан в файл, доступный лишь владельцу
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import threading
+
+
+# Сколько секунд сервер ждёт новых задач после опустошения очереди
+IDLE_TIMEOUT = 10
+
+# Порт для систем без абстрактных Unix-сокетов (Windows, macOS)
+DEFAULT_PORT = 47631
+
+# Файл ключа сервера в cache_dir()
+TOKEN_NAME = 'server.token'
+
+
+def server_address():
+    """Возвращает (семейство сокета, адрес) сервера очереди"""
+    if sys.platform.startswith('linux'):
+        # Абстрактный сокет не оставляет файлов и не "зависает" после сбоя
+        try:
+            user = os.getuid()
+        except AttributeError:
+            user = os.environ.get('USER', 'user')
+        return socket.AF_UNIX, f"\0szimat-jobs-{user}"
+    port = int(os.environ.get('SZIMAT_SERVER_PORT', DEFAULT_PORT))
+    return socket.AF_INET, ('127.0.0.1', port)
+
+
+def _token_path():
+    from media_probe import cache_dir
+    return os.path.join(cache_dir(), TOKEN_NAME)
+
+
+def read_token():
+    """Ключ работающего сервера или None"""
+    try:
+        with open(_token_path(), encoding='ascii') as f:
+            return f.read().strip()
+    except (OSError, ValueError):
+        return None
+
+
+def _write_token():
+    """Новый ключ сервера: файл создаётся с правами только для владельца"""
+    token = os.urandom(16).hex()
+    path = _token_path()
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='ascii') as f:
+        f.write(token)
+    os.replace(tmp_path, path)
+    return token
+
+
+def submit_job(job, timeout=2.0):
+    """
+    Передаёт задачу работающему серверу
+
+    Args:
+        job: Словарь задачи ('action', 'path' и параметры)
+        timeout: Таймаут соединения в секундах
+
+    Returns:
+        True, если сервер принял задачу
+    """
+    family, address = server_address()
+    token = read_token()
+    if not token:
+        return False
+    request = {'token': token, 'job': job}
+    try:
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(address)
+            sock.sendall((json.dumps(request, ensure_ascii=False) + '\n').encode('utf-8'))
+            reply = sock.makefile('rb').readline()
+            return reply.strip() == b'ok'
+    except OSError:
+        return False
+
+
+def _bind_server():
+    """
+    Пытается занять адрес сервера, возвращает сокет или None.
+    Атрибут token сокета - ключ, с которым принимаются задачи
+    """
+    family, address = server_address()
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        if family == socket.AF_INET and hasattr(socket, 'SO_EXCLUSIVEADDRUSE'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_EXCLUSIVEADDRUSE, 1)
+        sock.bind(address)
+        # Ключ пишется после захвата адреса (не затирает ключ чужого сервера),
+        # но до listen - раньше подключиться никто не может
+        token = _write_token()
+        sock.listen(64)
+    except OSError:
+        sock.close()
+        return None
+    return sock, token
+
+
+def run_job(job, threads=None):
+    """Выполняет одну задачу, возвращает результат в формате пакетного режима"""
+    input_path = job['path']
+    result = {
+        'input': input_path,
+        'output': None,
+        'input_size': 0,
+        'output_size': 0,
+        'skipped': False,
+        'error': None,
+    }
+    try:
+        result['input_size'] = os.path.getsize(input_path)
+        if job['action'] == 'convert':
+            import convert_video
+            convert_video.INTERACTIVE = False
+            if job.get('formats'):
+                # Несколько форматов из одного декодирования: в итог идёт их общий размер
+                output_paths = convert_video.convert_formats(
+                    input_path, job['file_type'], job['formats'], job.get('thumbnail', False)
+                )
+                result['output'] = output_paths[0]
+                result['output_size'] = sum(os.path.getsize(path) for path in output_paths)
+                return result
+            output_path = convert_video.convert_file(
+                input_path, None, job['file_type'], job['format']
+            )
+        else:
+            import compress_video
+            compress_video.INTERACTIVE = False
+            output_path = compress_video.compress_file(
+                input_path, quality=job.get('quality', 'medium'), threads=threads,
+                force=job.get('force', False), chunked=job.get('chunked'),
+                target_size=job.get('target_size'), quality_target=job.get('quality_target'),
+                optimize_png=job.get('optimize_png', False), abr=job.get('abr'),
+                previews=job.get('previews', False)
+            )
+            if output_path is None:
+                result['skipped'] = True
+                return result
+        if output_path and os.path.exists(output_path):
+            from compress_video import output_size_of
+            result['output'] = output_path
+            result['output_size'] = output_size_of(output_path)
+        else:
+            result['error'] = 'нет выходного файла'
+    except SystemExit:
+        result['error'] = 'ffmpeg завершился с ошибкой'
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+def _job_file_type(job):
+    if job.get('file_type'):
+        return job['file_type']
+    import compress_video
+    return compress_video.detect_file_type(job['path'])
+
+
+class JobServer:
+    """Сервер очереди: принимает задачи и выполняет их через WorkerPool"""
+
+    def __init__(self, sock, token, jobs=None, idle_timeout=IDLE_TIMEOUT):
+        from worker_pool import WorkerPool
+
+        self.sock = sock
+        self.token = token.encode('ascii')
+        self.pool = WorkerPool(jobs)
+        self.idle_timeout = idle_timeout
+        self.results = []
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._idle_since = time.time()
+
+    def add_job(self, job):
+        """Ставит задачу в очередь пула"""
+        file_type = _job_file_type(job)
+        with self._lock:
+            self._pending += 1
+        print(f"В очереди: {os.path.basename(job['path'])} (ожидает задач: {self._pending})")
+        future = self.pool.submit(file_type, run_job, job, self.pool.threads_for(file_type))
+        future.add_done_callback(self._job_done)
+
+    def _job_done(self, future):
+        with self._lock:
+            self.results.append(future.result())
+            self._pending -= 1
+            if self._pending == 0:
+                self._idle_since = time.time()
+
+    def _handle_client(self, conn):
+        import hmac
+
+        with conn:
+            conn.settimeout(5)
+            try:
+                line = conn.makefile('rb').readline()
+                request = json.loads(line.decode('utf-8'))
+                token = str(request.get('token', '')).encode('utf-8')
+                if not hmac.compare_digest(token, self.token):
+                    print("ОШИБКА: задача без ключа сервера очереди отклонена")
+                    conn.sendall(b'denied\n')
+                    return
+                self.add_job(request['job'])
+                conn.sendall(b'ok\n')
+            except (OSError, ValueError, KeyError, AttributeError) as e:
+                print(f"ОШИБКА: некорректный запрос к очереди: {e}")
+
+    def serve_forever(self):
+        """Принимает задачи, пока очередь не простаивает дольше idle_timeout"""
+        from image_engine import process_pool
+
+        self.sock.settimeout(0.5)
+        # Изображения из очереди кодируются Pillow в пуле процессов
+        with process_pool(self.pool.capacity):
+            try:
+                while True:
+                    try:
+                        conn, _ = self.sock.accept()
+                    except socket.timeout:
+                        with self._lock:
+                            idle = self._pending == 0 and time.time() - self._idle_since > self.idle_timeout
+                        if idle:
+                            break
+                        continue
+                    self._handle_client(conn)
+            finally:
+                # Сначала закрываем сокет, чтобы новые запуски стали сервером сами
+                self.sock.close()
+                self.pool.shutdown()
+        return self.results
+
+
+def run_or_submit(job, jobs=None):
+    """
+    Отдаёт задачу работающему серверу или сам становится сервером
+
+    Returns:
+        None, если задачу принял другой процесс,
+        иначе список результатов всех выполненных задач
+    """
+    for attempt in range(40):
+        if submit_job(job):
+            return None
+        bound = _bind_server()
+        if bound is not None:
+            break
+        # Адрес занят, но сервер ещё не отвечает - пробуем снова
+        time.sleep(0.05)
+    else:
+        # Адрес занят чужой программой - выполняем задачу без очереди
+        return [run_job(job)]
+
+    sock, token = bound
+    server = JobServer(sock, token, jobs)
+    server.add_job(job)
+    return server.serve_forever()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Быстрая точка входа для контекстного меню:
+    launcher.py compress <путь> [параметры compress_video.py]
+    launcher.py convert <путь>
+Модули сжатия и конвертации загружаются только когда они нужны: если очередь
+задач уже работает, путь передаётся ей сразу, без их импорта
+"""
+
+import os
+import sys
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ('compress', 'convert'):
+        print("Использование: launcher.py compress|convert <путь_к_файлу> [параметры]")
+        sys.exit(1)
+    action, args = sys.argv[1], sys.argv[2:]
+
+    if action == 'compress':
+        # Частый случай: очередной файл из выделения в проводнике, без параметров.
+        # Тип файла не проверяется - пункт меню есть только у поддерживаемых расширений
+        if len(args) == 1 and os.path.isfile(args[0]):
+            import job_server
+            if job_server.submit_job({'action': 'compress', 'path': os.path.abspath(args[0])}):
+                print(f"Файл добавлен в очередь сжатия: {os.path.basename(args[0])}")
+                return
+        import compress_video as module
+    else:
+        import convert_video as module
+
+    sys.argv = [module.__file__] + args
+    module.main()
+
+
+if __name__ == '__main__':
+    main()
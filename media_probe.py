@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+Сведения о медиафайлах через ffprobe.
+Результаты кэшируются в SQLite по (путь, размер, время изменения),
+поэтому повторные проходы по той же библиотеке не запускают ffprobe заново
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import subprocess
+import threading
+from collections import namedtuple
+from pathlib import Path
+
+
+VIDEO_EXTENSIONS = ['.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm', '.m4v', '.3gp', '.mpg', '.mpeg', '.ts', '.m2ts']
+AUDIO_EXTENSIONS = ['.mp3', '.wav', '.flac', '.aac', '.ogg', '.wma', '.m4a', '.opus', '.ac3']
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.tif', '.webp', '.heic', '.heif']
+
+# Меняется при изменении формата записей - старый кэш игнорируется
+CACHE_VERSION = 2
+
+
+# width и height - размер кадра при показе: ffmpeg поворачивает кадр по rotation
+# до фильтров, поэтому у повёрнутых на 90° видео они переставлены относительно
+# закодированных
+StreamInfo = namedtuple('StreamInfo', [
+    'index', 'codec_type', 'codec_name', 'profile', 'width', 'height',
+    'pix_fmt', 'fps', 'bit_rate', 'sample_rate', 'channels', 'duration', 'rotation',
+])
+
+
+class MediaInfo(namedtuple('MediaInfo', [
+        'path', 'size', 'mtime_ns', 'format_name', 'duration', 'bit_rate', 'streams'])):
+    """Компактное описание файла: контейнер, длительность и потоки"""
+
+    __slots__ = ()
+
+    def streams_of(self, codec_type):
+        return [s for s in self.streams if s.codec_type == codec_type]
+
+    @property
+    def video(self):
+        """Первый видеопоток (обложки mp3/m4a не считаются) или None"""
+        streams = [s for s in self.streams_of('video') if s.fps]
+        return streams[0] if streams else None
+
+    @property
+    def audio(self):
+        streams = self.streams_of('audio')
+        return streams[0] if streams else None
+
+    @property
+    def file_type(self):
+        # Демультиплексоры изображений: image2, png_pipe, jpeg_pipe, webp_pipe...
+        fmt = self.format_name or ''
+        if fmt == 'image2' or fmt.endswith('_pipe'):
+            return 'image'
+        if self.video and (self.duration or 0) > 0:
+            return 'video'
+        if self.audio:
+            return 'audio'
+        if self.streams_of('video'):
+            return 'image'
+        return None
+
+
+def detect_file_type(file_path):
+    """Определяет тип файла по расширению: video, audio, image"""
+    ext = Path(file_path).suffix.lower()
+
+    if ext in VIDEO_EXTENSIONS:
+        return 'video'
+    elif ext in AUDIO_EXTENSIONS:
+        return 'audio'
+    elif ext in IMAGE_EXTENSIONS:
+        return 'image'
+    return None
+
+
+def cache_dir():
+    """Папка для кэшей программы"""
+    path = os.environ.get('SZIMAT_CACHE_DIR')
+    if not path:
+        if sys.platform == 'win32':
+            import tempfile
+            base = os.environ.get('LOCALAPPDATA') or tempfile.gettempdir()
+        else:
+            base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        path = os.path.join(base, 'szimat')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_rate(value):
+    """'30000/1001' -> 29.97"""
+    if not value or value == '0/0':
+        return None
+    num, _, den = value.partition('/')
+    try:
+        rate = float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+    # Неподвижные изображения и обложки ffprobe отмечает частотой 90000
+    return rate if 0 < rate < 1000 else None
+
+
+def _parse_rotation(stream):
+    """Поворот при показе в градусах (0, 90, 180, 270): матрица отображения или тег rotate"""
+    value = None
+    for side_data in stream.get('side_data_list') or []:
+        if 'rotation' in side_data:
+            value = side_data['rotation']
+    if value is None:
+        value = stream.get('tags', {}).get('rotate')
+    value = _to_float(value)
+    return int(round(value / 90)) * 90 % 360 if value else 0
+
+
+def _parse_ffprobe(path, stat, data):
+    fmt = data.get('format', {})
+    streams = []
+    for s in data.get('streams', []):
+        disposition = s.get('disposition', {})
+        fps = _parse_rate(s.get('avg_frame_rate')) or _parse_rate(s.get('r_frame_rate'))
+        if disposition.get('attached_pic'):
+            fps = None
+        rotation = _parse_rotation(s)
+        width, height = _to_int(s.get('width')), _to_int(s.get('height'))
+        if rotation in (90, 270):
+            width, height = height, width
+        streams.append(StreamInfo(
+            index=s.get('index'),
+            codec_type=s.get('codec_type'),
+            codec_name=s.get('codec_name'),
+            profile=s.get('profile'),
+            width=width,
+            height=height,
+            pix_fmt=s.get('pix_fmt'),
+            fps=fps if s.get('codec_type') == 'video' else None,
+            bit_rate=_to_int(s.get('bit_rate')),
+            sample_rate=_to_int(s.get('sample_rate')),
+            channels=_to_int(s.get('channels')),
+            duration=_to_float(s.get('duration')),
+            rotation=rotation,
+        ))
+    return MediaInfo(
+        path=path,
+        size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+        format_name=fmt.get('format_name'),
+        duration=_to_float(fmt.get('duration')),
+        bit_rate=_to_int(fmt.get('bit_rate')),
+        streams=tuple(streams),
+    )
+
+
+def _to_record(info):
+    return json.dumps({
+        'v': CACHE_VERSION,
+        'format_name': info.format_name,
+        'duration': info.duration,
+        'bit_rate': info.bit_rate,
+        'streams': [list(s) for s in info.streams],
+    })
+
+
+def _from_record(path, size, mtime_ns, record):
+    data = json.loads(record)
+    if data.get('v') != CACHE_VERSION:
+        return None
+    return MediaInfo(
+        path=path,
+        size=size,
+        mtime_ns=mtime_ns,
+        format_name=data['format_name'],
+        duration=data['duration'],
+        bit_rate=data['bit_rate'],
+        streams=tuple(StreamInfo(*s) for s in data['streams']),
+    )
+
+
+class ProbeCache:
+    """Хранилище результатов ffprobe в SQLite"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.path.join(cache_dir(), 'probe.sqlite')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS probe ('
+                ' path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, record TEXT)'
+            )
+
+    def get(self, path, stat):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT record FROM probe WHERE path = ? AND size = ? AND mtime_ns = ?',
+                (path, stat.st_size, stat.st_mtime_ns)
+            ).fetchone()
+        if row is None:
+            return None
+        return _from_record(path, stat.st_size, stat.st_mtime_ns, row[0])
+
+    def put(self, info):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO probe (path, size, mtime_ns, record) VALUES (?, ?, ?, ?)',
+                (info.path, info.size, info.mtime_ns, _to_record(info))
+            )
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Общий на процесс кэш (None, если SQLite недоступен)"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = ProbeCache()
+            except (sqlite3.Error, OSError):
+                _cache = False
+        return _cache or None
+
+
+def probe(file_path, ffprobe_path=None, use_cache=True):
+    """
+    Получает сведения о файле через ffprobe
+
+    Args:
+        file_path: Путь к файлу
+        ffprobe_path: Путь к ffprobe (по умолчанию ищется автоматически)
+        use_cache: Использовать кэш результатов
+
+    Returns:
+        MediaInfo или None, если ffprobe недоступен или файл не читается
+    """
+    path = os.path.abspath(file_path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    cache = get_cache() if use_cache else None
+    if cache:
+        try:
+            info = cache.get(path, stat)
+        except sqlite3.Error:
+            info = None
+        if info:
+            return info
+
+    if not ffprobe_path:
+        # Поиск программ один на процесс - в toolchain (он сам импортирует этот модуль)
+        from toolchain import find_ffprobe
+        ffprobe_path = find_ffprobe()
+    if not ffprobe_path:
+        return None
+    cmd = [
+        ffprobe_path, '-v', 'error',
+        '-show_format', '-show_streams',
+        '-of', 'json', path
+    ]
+    try:
+        completed = subprocess.run(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            stdin=subprocess.DEVNULL, timeout=120
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if completed.returncode != 0:
+        return None
+    try:
+        data = json.loads(completed.stdout.decode('utf-8', errors='replace'))
+    except ValueError:
+        return None
+
+    info = _parse_ffprobe(path, stat, data)
+    if cache:
+        try:
+            cache.put(info)
+        except sqlite3.Error:
+            pass
+    return info
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Кэш результатов сжатия.
+Ключ - отпечаток содержимого исходника и точные настройки задачи, поэтому
+повторное сжатие того же файла или его копии не запускает ffmpeg: результат
+выдаётся жёсткой ссылкой на сохранённый. Объём кэша ограничен, старые записи
+вытесняются по времени последнего использования
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import sqlite3
+import threading
+import time
+
+from fingerprint import fingerprint
+from media_probe import cache_dir
+
+
+# Меняется при изменении кодирования - старые результаты не используются
+CACHE_VERSION = 1
+
+# Ограничение объёма кэша по умолчанию; SZIMAT_OUTPUT_CACHE_MB=0 отключает кэш
+DEFAULT_MAX_BYTES = 5 * 1024 ** 3
+
+
+def content_fingerprint(path):
+    """Отпечаток содержимого: совпадает у копий файла"""
+    return fingerprint(path, with_mtime=False)
+
+
+def job_key(source_fp, settings):
+    """Ключ задачи: отпечаток исходника и настройки"""
+    data = json.dumps([CACHE_VERSION, source_fp, settings], sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def max_cache_bytes():
+    value = os.environ.get('SZIMAT_OUTPUT_CACHE_MB')
+    if value is None:
+        return DEFAULT_MAX_BYTES
+    try:
+        return int(float(value) * 1024 * 1024)
+    except ValueError:
+        return DEFAULT_MAX_BYTES
+
+
+def _link_or_copy(source, destination):
+    """Жёсткая ссылка, а если она невозможна (другой диск, FAT) - копия"""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+class OutputCache:
+    """Сохранённые результаты и их индекс в SQLite"""
+
+    def __init__(self, root=None, max_bytes=None):
+        self.root = root or os.path.join(cache_dir(), 'outputs')
+        self.max_bytes = max_cache_bytes() if max_bytes is None else max_bytes
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(self.root, 'index.sqlite'), check_same_thread=False, timeout=10
+        )
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                ' key TEXT PRIMARY KEY, blob TEXT, size INTEGER, output_fp TEXT, last_used REAL)'
+            )
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS entries_output_fp ON entries (output_fp)'
+            )
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)'
+            )
+
+    def _blob_path(self, blob):
+        return os.path.join(self.root, blob[:2], blob)
+
+    def is_output(self, fingerprint):
+        """Является ли файл с таким отпечатком результатом одной из задач"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT 1 FROM entries WHERE output_fp = ? LIMIT 1', (fingerprint,)
+            ).fetchone()
+        return row is not None
+
+    def _forget(self, key, blob):
+        with self._conn:
+            self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+        try:
+            os.remove(self._blob_path(blob))
+        except OSError:
+            pass
+
+    def fetch(self, key, output_path=None, make_output_path=None, candidates=()):
+        """
+        Выдаёт сохранённый результат задачи
+
+        Args:
+            key: Ключ задачи
+            output_path: Куда положить результат
+            make_output_path: Функция, создающая имя результата, если output_path не задан
+            candidates: Пути, где мог остаться прежний результат - он возвращается
+                        вместо создания нового файла
+
+        Returns:
+            Путь к результату или None, если в кэше его нет
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT blob, size, output_fp FROM entries WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            blob, size, output_fp = row
+            blob_path = self._blob_path(blob)
+            # Результат могли изменить на месте через жёсткую ссылку
+            try:
+                valid = (os.path.getsize(blob_path) == size
+                         and content_fingerprint(blob_path) == output_fp)
+            except OSError:
+                valid = False
+            if not valid:
+                self._forget(key, blob)
+                return None
+
+            # Прежний результат на месте - новый файл не нужен
+            path = None if output_path else next(
+                (p for p in candidates if os.path.isfile(p) and os.path.samefile(p, blob_path)),
+                None
+            )
+            if path is None:
+                path = output_path or make_output_path()
+                if os.path.exists(path):
+                    os.remove(path)
+                _link_or_copy(blob_path, path)
+            with self._conn:
+                self._conn.execute(
+                    'UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key)
+                )
+            return path
+
+    def store(self, key, output_path):
+        """
+        Сохраняет результат задачи жёсткой ссылкой и вытесняет старые записи сверх лимита.
+        Если ссылку создать нельзя, результат не сохраняется
+        """
+        size = os.path.getsize(output_path)
+        if size > self.max_bytes:
+            return
+        blob = key + os.path.splitext(output_path)[1].lower()
+        blob_path = self._blob_path(blob)
+        with self._lock:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            if os.path.exists(blob_path):
+                os.remove(blob_path)
+            try:
+                os.link(output_path, blob_path)
+            except OSError:
+                # Кэш на другом диске или ФС без жёстких ссылок: копия удвоила бы
+                # занятое место и время записи, поэтому результат не сохраняется
+                return
+            with self._conn:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO entries'
+                    ' (key, blob, size, output_fp, last_used) VALUES (?, ?, ?, ?, ?)',
+                    (key, blob, size, content_fingerprint(output_path), time.time())
+                )
+            self._evict()
+
+    def _evict(self):
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            'SELECT key, blob, size FROM entries ORDER BY last_used'
+        ).fetchall()
+        for key, blob, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._forget(key, blob)
+            total -= size
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_output_cache():
+    """Общий на процесс кэш (None, если он отключён или недоступен)"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = OutputCache() if max_cache_bytes() > 0 else False
+            except (sqlite3.Error, OSError):
+                _cache = False
+        return _cache or None
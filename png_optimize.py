@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+"""
+Оптимизация PNG без потерь.
+Изображение кодируется несколькими способами: фильтры строк ffmpeg (-pred),
+уменьшенная разрядность и число каналов, палитра (если цветов не больше 256),
+а при установленном Pillow - разные стратегии zlib. Каждый результат проверяется:
+пиксели, декодированные ffmpeg, должны совпасть с исходными. Чанки управления
+цветом (профиль ICC, гамма, цветность) переносятся из исходника без изменений.
+Сохраняется самый маленький. Пробы идут параллельно, и проба прерывается,
+как только её результат перерастает лучший из найденных
+"""
+
+import io
+import sys
+import hashlib
+import subprocess
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Фильтры строк ffmpeg: сначала те, что обычно выигрывают
+PREDICTORS = ['mixed', 'paeth', 'up', 'avg', 'sub', 'none']
+
+# Для палитры и 1-битных изображений фильтры почти не помогают
+INDEXED_PREDICTORS = ['none', 'mixed']
+
+# Стратегии zlib для Pillow: по умолчанию, Z_FILTERED, Z_RLE
+ZLIB_STRATEGIES = [0, 1, 3]
+
+# Максимум цветов для палитры
+PALETTE_COLORS = 256
+
+# Уровни zlib: быстрый для отбора способов и максимальный для финалистов
+FAST_LEVEL = 3
+MAX_LEVEL = 9
+
+# Сколько лучших по отбору способов сжимается на максимальном уровне
+FINAL_TRIALS = 3
+
+# Размер блока при чтении результата ffmpeg
+READ_CHUNK = 1 << 16
+
+# Форматы пикселей ffmpeg -> режимы Pillow (16-битные Pillow не пишет)
+PILLOW_MODES = {'gray': 'L', 'ya8': 'LA', 'rgb24': 'RGB', 'rgba': 'RGBA'}
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Чанки управления цветом: без них те же пиксели показываются другими цветами.
+# Кодеры их не переносят (или пишут свои), поэтому в результат попадают чанки исходника
+COLOR_CHUNKS = (b'iCCP', b'sRGB', b'gAMA', b'cHRM', b'cICP')
+
+
+ImageTraits = namedtuple('ImageTraits', ['width', 'height', 'wide', 'alpha', 'gray', 'colors'])
+PngResult = namedtuple('PngResult', ['data', 'strategy', 'trials', 'aborted'])
+
+
+class PngOptimizeError(Exception):
+    """Ошибка оптимизации PNG"""
+
+
+class _Aborted(Exception):
+    """Проба уже больше лучшего результата"""
+
+
+def _run(cmd, data=None):
+    try:
+        completed = subprocess.run(
+            cmd, input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            stdin=None if data is not None else subprocess.DEVNULL
+        )
+    except OSError as e:
+        raise PngOptimizeError(str(e))
+    if completed.returncode != 0:
+        raise PngOptimizeError(completed.stderr.decode('utf-8', errors='replace').strip())
+    return completed.stdout
+
+
+def pixel_digest(ffmpeg_path, path=None, data=None, wide=False):
+    """
+    MD5 пикселей в RGBA (16 бит на канал для wide): одинаков для любых способов
+    записи PNG. Разрядность берётся по изображению - преобразование 8 бит в 16
+    у ffmpeg не всегда точное
+    """
+    source = ['-f', 'png_pipe', '-i', '-'] if data is not None else ['-i', path]
+    output = _run(
+        [ffmpeg_path, '-v', 'error'] + source +
+        ['-map', '0:v:0', '-c:v', 'rawvideo', '-pix_fmt', 'rgba64le' if wide else 'rgba',
+         '-f', 'md5', '-'],
+        data
+    )
+    return output.decode('ascii', errors='replace').strip()
+
+
+def raw_digest(rgba):
+    """MD5 пикселей RGBA в том же виде, что и у pixel_digest"""
+    return f"MD5={hashlib.md5(rgba).hexdigest()}"
+
+
+def read_chunks(data):
+    """Чанки PNG: список (тип, чанк целиком - с длиной и CRC)"""
+    if not data.startswith(PNG_SIGNATURE):
+        raise PngOptimizeError("файл не является PNG")
+    chunks = []
+    pos = len(PNG_SIGNATURE)
+    while pos + 8 <= len(data):
+        length = int.from_bytes(data[pos:pos + 4], 'big')
+        kind = data[pos + 4:pos + 8]
+        end = pos + 12 + length
+        chunks.append((kind, data[pos:end]))
+        pos = end
+        if kind == b'IEND':
+            break
+    return chunks
+
+
+def color_chunks(path):
+    """Чанки управления цветом исходника"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        raise PngOptimizeError(str(e))
+    return [chunk for kind, chunk in read_chunks(data) if kind in COLOR_CHUNKS]
+
+
+def with_color_chunks(data, chunks):
+    """PNG, в котором чанки цвета кодера заменены чанками исходника (сразу после IHDR)"""
+    parts = [PNG_SIGNATURE]
+    for kind, chunk in read_chunks(data):
+        if kind in COLOR_CHUNKS:
+            continue
+        parts.append(chunk)
+        if kind == b'IHDR':
+            parts.extend(chunks)
+    return b''.join(parts)
+
+
+def _decode(ffmpeg_path, path, pix_fmt):
+    return _run([ffmpeg_path, '-v', 'error', '-i', path, '-map', '0:v:0',
+                 '-f', 'rawvideo', '-pix_fmt', pix_fmt, '-'])
+
+
+def _count_colors(rgba, limit):
+    """Число цветов RGBA или None, если их больше limit"""
+    pixels = memoryview(rgba).cast('I')
+    colors = set()
+    for start in range(0, len(pixels), READ_CHUNK):
+        colors.update(pixels[start:start + READ_CHUNK])
+        if len(colors) > limit:
+            return None
+    return len(colors)
+
+
+def analyze(ffmpeg_path, path, width, height, source_pix_fmt):
+    """
+    Какие упрощения не меняют пикселей
+
+    Returns:
+        (ImageTraits, пиксели RGBA 8 бит или None для 16-битного изображения)
+    """
+    wide = bool(source_pix_fmt) and ('48' in source_pix_fmt or '64' in source_pix_fmt
+                                     or '16' in source_pix_fmt)
+    if wide:
+        raw = _decode(ffmpeg_path, path, 'rgba64le')
+        # 16 бит сводятся к 8, если каждое значение - v * 257 (младший байт равен старшему)
+        if raw[0::2] == raw[1::2]:
+            rgba, wide = raw[1::2], False
+        else:
+            words = memoryview(raw).cast('H')
+            channels = [words[i::4].tobytes() for i in range(4)]
+            traits = ImageTraits(
+                width, height, True,
+                alpha=channels[3] != b'\xff' * len(channels[3]),
+                gray=channels[0] == channels[1] == channels[2],
+                colors=None,
+            )
+            return traits, None
+    else:
+        rgba = _decode(ffmpeg_path, path, 'rgba')
+    if len(rgba) != width * height * 4:
+        raise PngOptimizeError("неожиданный размер декодированного изображения")
+
+    alpha = rgba[3::4]
+    traits = ImageTraits(
+        width, height, False,
+        alpha=alpha != b'\xff' * len(alpha),
+        gray=rgba[0::4] == rgba[1::4] == rgba[2::4],
+        colors=_count_colors(rgba, PALETTE_COLORS),
+    )
+    return traits, rgba
+
+
+def base_pix_fmt(traits):
+    """Формат пикселей без лишних каналов и разрядности"""
+    if traits.wide:
+        return {(True, True): 'ya16be', (True, False): 'gray16be',
+                (False, True): 'rgba64be', (False, False): 'rgb48be'}[(traits.gray, traits.alpha)]
+    return {(True, True): 'ya8', (True, False): 'gray',
+            (False, True): 'rgba', (False, False): 'rgb24'}[(traits.gray, traits.alpha)]
+
+
+class _Best:
+    """Лучший проверенный результат, общий для всех проб"""
+
+    def __init__(self, ffmpeg_path, reference, wide, limit):
+        self.ffmpeg_path = ffmpeg_path
+        self.reference = reference
+        self.wide = wide
+        self.size = limit
+        self.data = None
+        self.strategy = None
+        self.trials = 0
+        self.aborted = 0
+        self._lock = threading.Lock()
+
+    def offer(self, strategy, data):
+        """Принимает результат пробы, если он меньше лучшего и пиксели совпадают"""
+        with self._lock:
+            self.trials += 1
+            if len(data) >= self.size:
+                return
+        # Проверка вне блокировки: проверки разных проб идут параллельно
+        try:
+            same = pixel_digest(self.ffmpeg_path, data=data, wide=self.wide) == self.reference
+        except PngOptimizeError:
+            same = False
+        if not same:
+            return
+        with self._lock:
+            if len(data) < self.size:
+                self.size, self.data, self.strategy = len(data), data, strategy
+
+    def count_aborted(self):
+        with self._lock:
+            self.trials += 1
+            self.aborted += 1
+
+
+class _LimitedBuffer(io.BytesIO):
+    """Буфер для Pillow: прерывает запись, когда она перерастает лучший результат"""
+
+    def __init__(self, best):
+        super().__init__()
+        self.best = best
+
+    def write(self, data):
+        if self.tell() + len(data) >= self.best.size:
+            raise _Aborted()
+        return super().write(data)
+
+
+class FfmpegStrategy:
+    """Запись PNG кодером ffmpeg с заданным форматом пикселей и фильтром строк"""
+
+    def __init__(self, ffmpeg_path, input_path, pix_fmt, predictor, palette_filter=None):
+        self.ffmpeg_path = ffmpeg_path
+        self.input_path = input_path
+        self.pix_fmt = pix_fmt
+        self.predictor = predictor
+        self.palette_filter = palette_filter
+        self.name = f"ffmpeg {pix_fmt}, pred={predictor}"
+
+    def encode(self, level, best=None):
+        """PNG в памяти или None, если результат перерос best (или ошибка ffmpeg)"""
+        cmd = [self.ffmpeg_path, '-v', 'error', '-i', self.input_path, '-frames:v', '1']
+        if self.palette_filter:
+            cmd.extend(['-filter_complex', self.palette_filter])
+        else:
+            cmd.extend(['-map', '0:v:0'])
+        cmd.extend(['-pix_fmt', self.pix_fmt, '-c:v', 'png', '-pred', self.predictor,
+                    '-compression_level', str(level), '-f', 'image2pipe', '-'])
+        process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL)
+        chunks = []
+        size = 0
+        try:
+            while True:
+                chunk = process.stdout.read(READ_CHUNK)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if best and size >= best.size:
+                    process.kill()
+                    return None
+                chunks.append(chunk)
+        finally:
+            process.stdout.close()
+            process.wait()
+        if process.returncode != 0 or not chunks:
+            return None
+        return b''.join(chunks)
+
+
+class PillowStrategy:
+    """Запись PNG через Pillow с заданной стратегией zlib"""
+
+    def __init__(self, label, image, zlib_strategy):
+        self.image = image
+        self.zlib_strategy = zlib_strategy
+        self.name = f"Pillow {label}, zlib={zlib_strategy}"
+
+    def encode(self, level, best=None):
+        buffer = _LimitedBuffer(best) if best else io.BytesIO()
+        options = {'compress_level': level, 'compress_type': self.zlib_strategy}
+        if level == MAX_LEVEL:
+            # optimize уменьшает разрядность палитры и подбирает параметры zlib
+            options['optimize'] = True
+        try:
+            self.image.save(buffer, 'PNG', **options)
+        except _Aborted:
+            return None
+        return buffer.getvalue()
+
+
+def _pillow_images(traits, rgba, pix_fmt):
+    """Варианты изображения для Pillow: (название, изображение)"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return []
+    source = Image.frombytes('RGBA', (traits.width, traits.height), rgba)
+    images = [(PILLOW_MODES[pix_fmt], source.convert(PILLOW_MODES[pix_fmt]))]
+    if traits.colors is not None:
+        images.append(('P', _palette_image(Image, traits, rgba)))
+    return images
+
+
+def _palette_image(Image, traits, rgba):
+    """
+    Изображение с палитрой ровно из его цветов. quantize у Pillow подбирает
+    ближайший цвет приближённо, поэтому индексы вычисляются здесь
+    """
+    pixels = memoryview(rgba).cast('I')
+    # Полупрозрачные цвета - в начало палитры, тогда tRNS короче
+    entries = sorted(
+        (color.to_bytes(4, sys.byteorder) for color in set(pixels)),
+        key=lambda entry: (entry[3] == 255, entry)
+    )
+    lookup = {int.from_bytes(entry, sys.byteorder): index for index, entry in enumerate(entries)}
+    image = Image.frombytes('P', (traits.width, traits.height),
+                            bytes(map(lookup.__getitem__, pixels)))
+    image.putpalette(b''.join(entry[:3] for entry in entries))
+    if traits.alpha:
+        image.info['transparency'] = bytes(entry[3] for entry in entries)
+    return image
+
+
+def strategies_for(ffmpeg_path, input_path, traits, rgba):
+    """Все способы записи, которые имеет смысл пробовать для изображения"""
+    pix_fmt = base_pix_fmt(traits)
+    strategies = [FfmpegStrategy(ffmpeg_path, input_path, pix_fmt, p) for p in PREDICTORS]
+    if traits.colors is not None:
+        palette_filter = (
+            f"split[a][b];[a]palettegen=max_colors={PALETTE_COLORS}:stats_mode=full:"
+            f"reserve_transparent={int(traits.alpha)}[p];[b][p]paletteuse=dither=none"
+        )
+        strategies += [FfmpegStrategy(ffmpeg_path, input_path, 'pal8', p, palette_filter)
+                       for p in INDEXED_PREDICTORS]
+        if traits.gray and not traits.alpha and traits.colors <= 2:
+            strategies += [FfmpegStrategy(ffmpeg_path, input_path, 'monob', p)
+                           for p in INDEXED_PREDICTORS]
+    if not traits.wide:
+        for label, image in _pillow_images(traits, rgba, pix_fmt):
+            strategies += [PillowStrategy(label, image, z) for z in ZLIB_STRATEGIES]
+    return strategies
+
+
+def optimize_png(ffmpeg_path, input_path, info, workers=1):
+    """
+    Подбирает самую компактную запись PNG с теми же пикселями.
+    Сначала все способы пробуются с быстрым сжатием zlib - это дёшево и почти
+    не меняет их порядка по размеру. Затем FINAL_TRIALS лучших сжимаются
+    на максимальном уровне, и проба прерывается, как только перерастает лучший результат
+
+    Args:
+        ffmpeg_path: Путь к ffmpeg
+        input_path: Исходный PNG
+        info: MediaInfo исходника
+        workers: Число одновременных проб
+
+    Returns:
+        PngResult; data - None, если исходник уже не уменьшить
+    """
+    stream = info.streams_of('video')[0] if info and info.streams_of('video') else None
+    # APNG (анимация) не оптимизируется: сравнивается только первый кадр
+    if not stream or stream.codec_name != 'png' or not stream.width:
+        raise PngOptimizeError("файл не является статичным PNG")
+
+    traits, rgba = analyze(ffmpeg_path, input_path, stream.width, stream.height, stream.pix_fmt)
+    if traits.wide:
+        reference = pixel_digest(ffmpeg_path, input_path, wide=True)
+    else:
+        reference = raw_digest(rgba)
+    chunks = color_chunks(input_path)
+    best = _Best(ffmpeg_path, reference, traits.wide, info.size)
+    strategies = strategies_for(ffmpeg_path, input_path, traits, rgba)
+
+    def screen(strategy):
+        data = strategy.encode(FAST_LEVEL)
+        if data is None:
+            return None
+        data = with_color_chunks(data, chunks)
+        best.offer(strategy.name, data)
+        return len(data)
+
+    def finish(strategy):
+        data = strategy.encode(MAX_LEVEL, best)
+        if data is None:
+            best.count_aborted()
+        else:
+            best.offer(strategy.name, with_color_chunks(data, chunks))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        sizes = list(executor.map(screen, strategies))
+        ranked = sorted(
+            (size, index) for index, size in enumerate(sizes) if size is not None
+        )
+        finalists = [strategies[index] for _, index in ranked[:FINAL_TRIALS]]
+        list(executor.map(finish, finalists))
+
+    return PngResult(best.data, best.strategy, best.trials, best.aborted)
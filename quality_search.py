@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Подбор CRF и пресета x264 по целевому качеству.
+Из исходника вырезается несколько коротких фрагментов, они кодируются с разными
+CRF/пресетами и сравниваются с оригиналом фильтрами ssim/psnr. Выбирается самый
+быстрый и компактный вариант, который держит заданный уровень. Результат
+запоминается для исходника, поэтому поиск выполняется один раз
+"""
+
+import os
+import re
+import json
+import shutil
+import sqlite3
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from ffmpeg_progress import run_ffmpeg
+from fingerprint import fingerprint
+from media_probe import cache_dir
+from worker_pool import cpu_count
+import telemetry
+
+
+# Число и длина фрагментов для оценки
+SAMPLE_COUNT = 3
+SAMPLE_SECONDS = 4
+
+# Диапазон поиска CRF
+CRF_MIN = 16
+CRF_MAX = 36
+
+# Пресеты от быстрого к медленному
+PRESETS = ['veryfast', 'fast', 'medium', 'slow']
+
+# Более медленный пресет берётся, только если он экономит больше этой доли
+PRESET_GAIN = 0.03
+
+# Уровни по умолчанию, если в --quality-target указано только название метрики
+DEFAULT_TARGETS = {'ssim': 0.98, 'psnr': 42.0}
+
+# Меняется при изменении алгоритма поиска - старые результаты игнорируются
+SEARCH_VERSION = 1
+
+
+QualityChoice = namedtuple('QualityChoice', ['crf', 'preset', 'score', 'bitrate', 'metric', 'target'])
+
+
+class QualitySearchError(Exception):
+    """Ошибка подбора настроек"""
+
+
+def parse_target(text):
+    """
+    Разбирает целевое качество: 'ssim:0.98', 'psnr:42', '0.97', 'ssim'
+
+    Returns:
+        (метрика, значение)
+    """
+    metric, _, value = str(text).strip().lower().partition(':')
+    if metric in DEFAULT_TARGETS:
+        if not value:
+            return metric, DEFAULT_TARGETS[metric]
+    else:
+        # Одно число: до 1 - SSIM, больше - PSNR в децибелах
+        value = metric
+        metric = None
+    try:
+        number = float(value.replace(',', '.'))
+    except ValueError:
+        raise ValueError(f"неверное целевое качество: {text}")
+    if metric is None:
+        metric = 'ssim' if number <= 1 else 'psnr'
+    return metric, number
+
+
+def sample_positions(duration, count=SAMPLE_COUNT, length=SAMPLE_SECONDS):
+    """Начала фрагментов, равномерно по длительности"""
+    if not duration or duration <= length * count:
+        return [0.0]
+    return [duration * (i + 1) / (count + 1) - length / 2 for i in range(count)]
+
+
+def extract_reference(ffmpeg_path, input_path, start, length, video_filter, output_path):
+    """Фрагмент исходника без потерь, с тем же масштабированием, что и у результата"""
+    cmd = [ffmpeg_path, '-ss', f"{start:.3f}", '-t', str(length), '-i', input_path, '-an']
+    if video_filter:
+        cmd.extend(['-vf', video_filter])
+    cmd.extend(['-c:v', 'libx264', '-qp', '0', '-preset', 'ultrafast', '-threads', '1',
+                '-y', output_path])
+    returncode, log = run_ffmpeg(cmd, report=False)
+    if returncode != 0:
+        raise QualitySearchError(f"не удалось вырезать фрагмент:\n{log}")
+    return output_path
+
+
+_SSIM_RE = re.compile(r'SSIM .*All:([\d.]+)')
+_PSNR_RE = re.compile(r'PSNR .*average:([\d.]+|inf)')
+
+
+def score_sample(ffmpeg_path, reference_path, encoded_path, metric):
+    """Оценка фрагмента относительно оригинала фильтром ssim или psnr"""
+    cmd = [
+        ffmpeg_path, '-threads', '1', '-i', encoded_path, '-threads', '1', '-i', reference_path,
+        '-filter_threads', '1', '-lavfi', f"[0:v][1:v]{metric}", '-f', 'null', '-'
+    ]
+    returncode, log = run_ffmpeg(cmd, report=False)
+    match = (_SSIM_RE if metric == 'ssim' else _PSNR_RE).search(log)
+    if returncode != 0 or not match:
+        raise QualitySearchError(f"не удалось оценить фрагмент:\n{log}")
+    return float('inf') if match.group(1) == 'inf' else float(match.group(1))
+
+
+def _encode_and_score(ffmpeg_path, reference_path, work_dir, crf, preset, metric):
+    encoded_path = os.path.join(
+        work_dir, f"{os.path.splitext(os.path.basename(reference_path))[0]}_{preset}_{crf}.mp4"
+    )
+    cmd = [
+        ffmpeg_path, '-i', reference_path,
+        '-c:v', 'libx264', '-crf', str(crf), '-preset', preset,
+        '-threads', '1', '-y', encoded_path
+    ]
+    returncode, log = run_ffmpeg(cmd, report=False)
+    if returncode != 0:
+        raise QualitySearchError(f"ошибка кодирования фрагмента:\n{log}")
+    score = score_sample(ffmpeg_path, reference_path, encoded_path, metric)
+    size = os.path.getsize(encoded_path)
+    os.remove(encoded_path)
+    return score, size
+
+
+class SearchCache:
+    """Найденные настройки по исходнику в SQLite"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.path.join(cache_dir(), 'quality.sqlite')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS choice (key TEXT PRIMARY KEY, record TEXT)'
+            )
+
+    @staticmethod
+    def key(info, video_filter, metric, target):
+        return json.dumps([SEARCH_VERSION, fingerprint(info.path, with_mtime=False),
+                           video_filter, metric, target])
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT record FROM choice WHERE key = ?', (key,)).fetchone()
+        return QualityChoice(*json.loads(row[0])) if row else None
+
+    def put(self, key, choice):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO choice (key, record) VALUES (?, ?)',
+                (key, json.dumps(list(choice)))
+            )
+
+
+def _open_cache():
+    try:
+        return SearchCache()
+    except (sqlite3.Error, OSError):
+        return None
+
+
+def search_settings(ffmpeg_path, input_path, info, video_filter=None, metric='ssim',
+                    target=None, presets=None, workers=None, use_cache=True):
+    """
+    Подбирает CRF и пресет, при которых качество фрагментов не ниже target
+
+    Args:
+        ffmpeg_path: Путь к ffmpeg
+        input_path: Исходное видео
+        info: MediaInfo исходника
+        video_filter: Фильтр масштабирования из плана сжатия
+        metric: 'ssim' или 'psnr'
+        target: Требуемое значение метрики для худшего фрагмента
+        presets: Проверяемые пресеты (по умолчанию PRESETS)
+        workers: Число одновременных процессов ffmpeg, каждый - в один поток
+                 (по умолчанию - по ядру на процесс; в пакетном режиме - бюджет задачи)
+        use_cache: Использовать сохранённые результаты
+
+    Returns:
+        QualityChoice
+    """
+    target = DEFAULT_TARGETS[metric] if target is None else target
+    presets = presets or PRESETS
+    cache = _open_cache() if use_cache else None
+    key = SearchCache.key(info, video_filter, metric, target)
+    if cache:
+        try:
+            choice = cache.get(key)
+        except sqlite3.Error:
+            choice = None
+        if choice:
+            return choice
+
+    duration = info.video.duration or info.duration
+    starts = sample_positions(duration)
+    length = min(SAMPLE_SECONDS, duration) if duration else SAMPLE_SECONDS
+    work_dir = tempfile.mkdtemp(prefix='szimat_qsearch_')
+    try:
+        with ThreadPoolExecutor(max_workers=workers or cpu_count()) as executor:
+            references = list(executor.map(
+                telemetry.bind(lambda item: extract_reference(
+                    ffmpeg_path, input_path, item[1], length, video_filter,
+                    os.path.join(work_dir, f"ref_{item[0]}.mkv")
+                )),
+                enumerate(starts)
+            ))
+
+            def evaluate(crf, preset):
+                # Качество - по худшему фрагменту, размер - суммарный
+                results = list(executor.map(
+                    telemetry.bind(lambda ref: _encode_and_score(
+                        ffmpeg_path, ref, work_dir, crf, preset, metric
+                    )),
+                    references
+                ))
+                return min(score for score, _ in results), sum(size for _, size in results)
+
+            candidates = []
+            low, high = CRF_MIN, CRF_MAX
+            for preset in presets:
+                best = None
+                while low <= high:
+                    crf = (low + high) // 2
+                    score, size = evaluate(crf, preset)
+                    if score >= target:
+                        best = (crf, score, size)
+                        low = crf + 1
+                    else:
+                        high = crf - 1
+                if best:
+                    candidates.append((preset,) + best)
+                    print(f"  {preset}: CRF {best[0]}, {metric.upper()} {best[1]:.4g}, "
+                          f"{best[2] * 8 / (length * len(references)) / 1000:.0f} кбит/с")
+                # Медленные пресеты при том же CRF дают близкое качество -
+                # следующий ищется в окрестности найденного
+                anchor = best[0] if best else CRF_MIN
+                low, high = max(CRF_MIN, anchor - 3), min(CRF_MAX, anchor + 3)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if not candidates:
+        raise QualitySearchError(
+            f"{metric.upper()} {target} недостижим даже при CRF {CRF_MIN}"
+        )
+
+    smallest = min(size for _, _, _, size in candidates)
+    # Самый быстрый пресет, который почти не уступает лучшему по размеру
+    preset, crf, score, size = next(
+        c for c in candidates if c[3] <= smallest * (1 + PRESET_GAIN)
+    )
+    choice = QualityChoice(
+        crf=crf, preset=preset, score=score,
+        bitrate=int(size * 8 / (length * len(references))),
+        metric=metric, target=target,
+    )
+    if cache:
+        try:
+            cache.put(key, choice)
+        except sqlite3.Error:
+            pass
+    return choice
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Сжатие видео до заданного размера файла.
+Битрейт видео рассчитывается по длительности и бюджету звука,
+кодирование выполняется в два прохода x264. Повтор (только второго прохода)
+делается лишь при промахе больше допуска; сохраняется лучшая попытка в пределах размера
+"""
+
+import os
+import re
+import shutil
+import tempfile
+
+from ffmpeg_progress import run_ffmpeg
+
+
+# Доля размера на служебные данные контейнера
+CONTAINER_OVERHEAD = 0.02
+
+# Допустимый недобор размера: при большем недоборе кодирование повторяется.
+# Превышение целевого размера не допускается
+UNDERSHOOT_TOLERANCE = 0.10
+
+MAX_ATTEMPTS = 3
+
+# Ниже этого битрейта видео становится неразборчивым
+MIN_VIDEO_BITRATE = 50000
+
+# Звук, которым жертвуем при очень маленьком целевом размере
+REDUCED_AUDIO_BITRATE = 64000
+
+
+class TargetSizeError(Exception):
+    """Целевой размер недостижим"""
+
+
+def parse_size(text):
+    """
+    Разбирает размер: '25M', '700K', '1.5G', '26214400'
+
+    Returns:
+        Размер в байтах
+    """
+    match = re.match(r'^\s*(\d+(?:[.,]\d+)?)\s*([KMG]?)B?\s*$', str(text), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"неверный размер: {text}")
+    number = float(match.group(1).replace(',', '.'))
+    unit = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}[match.group(2).upper()]
+    return int(number * unit)
+
+
+def plan_bitrates(target_bytes, duration, audio_bitrate):
+    """
+    Делит бюджет размера между видео и звуком
+
+    Args:
+        target_bytes: Целевой размер файла
+        duration: Длительность в секундах
+        audio_bitrate: Битрейт звука в бит/с (0 - звука нет)
+
+    Returns:
+        (битрейт видео, битрейт звука) в бит/с
+    """
+    if not duration or duration <= 0:
+        raise TargetSizeError("неизвестна длительность видео")
+    total = target_bytes * 8 * (1 - CONTAINER_OVERHEAD) / duration
+    video = total - audio_bitrate
+    if audio_bitrate > REDUCED_AUDIO_BITRATE and video < total * 0.7:
+        # Маленький бюджет: звук урезаем, чтобы картинке осталось больше
+        audio_bitrate = REDUCED_AUDIO_BITRATE
+        video = total - audio_bitrate
+    if video < MIN_VIDEO_BITRATE:
+        raise TargetSizeError(
+            f"размер {target_bytes / (1024 * 1024):.1f} MB слишком мал для "
+            f"{duration:.0f} с видео"
+        )
+    return int(video), int(audio_bitrate)
+
+
+def encode_to_size(ffmpeg_path, input_path, output_path, target_bytes, duration,
+                   video_args, audio_args, extra_args, audio_bitrate, threads=None, live=True):
+    """
+    Кодирует видео в два прохода так, чтобы файл не превысил target_bytes
+
+    Args:
+        ffmpeg_path: Путь к ffmpeg
+        input_path, output_path: Исходник и результат
+        target_bytes: Целевой размер
+        duration: Длительность исходника
+        video_args: Параметры видео без управления качеством
+                    (например ['-c:v', 'libx264', '-preset', 'medium', '-vf', ...])
+        audio_args: Параметры звука (['-c:a', 'copy'] или кодер без битрейта)
+        extra_args: Параметры контейнера
+        audio_bitrate: Битрейт звука в бит/с (0 - звука нет)
+        threads: Число потоков ffmpeg
+        live: Перерисовывать строку прогресса
+
+    Returns:
+        Размер результата в байтах
+    """
+    copy_audio = '-c:a' in audio_args and audio_args[audio_args.index('-c:a') + 1] == 'copy'
+    source_audio_bitrate = audio_bitrate
+    video_bitrate, audio_bitrate = plan_bitrates(target_bytes, duration, audio_bitrate)
+    if copy_audio and audio_bitrate < source_audio_bitrate:
+        # Копию звука пришлось урезать - перекодируем его
+        copy_audio = False
+        audio_args = ['-c:a', 'aac']
+    if not copy_audio and audio_bitrate:
+        audio_args = list(audio_args) + ['-b:a', str(audio_bitrate)]
+    thread_args = ['-threads', str(threads)] if threads else []
+    label = os.path.basename(input_path)
+
+    # Звук кодируется с постоянным битрейтом: поправка делается только по видео
+    audio_bytes = audio_bitrate * duration / 8
+    # Попытки пишутся во временные файлы; сохраняется самая крупная из уложившихся
+    root, ext = os.path.splitext(output_path)
+    best_path = best_size = None
+
+    log_dir = tempfile.mkdtemp(prefix='szimat_2pass_')
+    passlog = os.path.join(log_dir, 'x264')
+    try:
+        print(f"  Битрейт видео: {video_bitrate // 1000}k, звук: "
+              f"{'копия' if copy_audio else str(audio_bitrate // 1000) + 'k'}")
+        # Первый проход: только статистика, звук не нужен
+        cmd = ([ffmpeg_path, '-i', input_path] + list(video_args)
+               + ['-b:v', str(video_bitrate), '-pass', '1', '-passlogfile', passlog, '-an']
+               + thread_args + ['-f', 'null', '-y', os.devnull])
+        returncode, log = run_ffmpeg(cmd, duration=duration, label=f"{label} (проход 1)", live=live)
+        if returncode != 0:
+            raise TargetSizeError(f"ошибка первого прохода:\n{log}")
+
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            attempt_path = f"{root}.part{attempt}{ext}"
+            cmd = ([ffmpeg_path, '-i', input_path] + list(video_args)
+                   + ['-b:v', str(video_bitrate), '-pass', '2', '-passlogfile', passlog]
+                   + list(audio_args) + list(extra_args) + thread_args + ['-y', attempt_path])
+            returncode, log = run_ffmpeg(cmd, duration=duration, label=f"{label} (проход 2)", live=live)
+            if returncode != 0:
+                raise TargetSizeError(f"ошибка второго прохода:\n{log}")
+
+            size = os.path.getsize(attempt_path)
+            if size <= target_bytes and (best_size is None or size > best_size):
+                if best_path:
+                    os.remove(best_path)
+                best_path, best_size = attempt_path, size
+            else:
+                os.remove(attempt_path)
+            if target_bytes * (1 - UNDERSHOOT_TOLERANCE) <= size <= target_bytes:
+                break
+            if attempt == MAX_ATTEMPTS:
+                break
+            # Поправка пропорционально промаху видео; при превышении - с запасом
+            video_size = size - audio_bytes
+            if video_size > 0 and target_bytes > audio_bytes:
+                factor = (target_bytes - audio_bytes) / video_size
+            else:
+                factor = target_bytes / size
+            factor *= 0.97 if size > target_bytes else 1.0
+            print(f"  Размер {size / (1024 * 1024):.2f} MB вместо "
+                  f"{target_bytes / (1024 * 1024):.2f} MB, поправка x{factor:.3f}")
+            video_bitrate = int(video_bitrate * factor)
+            if video_bitrate < MIN_VIDEO_BITRATE:
+                break
+
+        if best_path is None:
+            raise TargetSizeError(
+                f"не удалось уложиться в {target_bytes / (1024 * 1024):.2f} MB"
+            )
+        os.replace(best_path, output_path)
+        return best_size
+    finally:
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            attempt_path = f"{root}.part{attempt}{ext}"
+            if os.path.exists(attempt_path):
+                os.remove(attempt_path)
+        shutil.rmtree(log_dir, ignore_errors=True)
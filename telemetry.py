@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+"""
+Метрики каждой задачи: время, процессорное время и пиковая память дочерних ffmpeg,
+средние fps и скорость, объём до и после и выбранный план.
+Каждая задача дописывается строкой в журнал JSONL, а накопленные итоги - в текстовый
+файл Prometheus (для textfile collector у node_exporter): так видна пропускная
+способность по пресетам, хостам и версиям.
+
+    SZIMAT_TELEMETRY=0           - не записывать метрики
+    SZIMAT_TELEMETRY_DIR         - папка журнала (по умолчанию <кэш>/telemetry)
+    SZIMAT_PROMETHEUS_FILE       - файл Prometheus (по умолчанию <папка>/szimat.prom)
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+
+
+ENABLED = os.environ.get('SZIMAT_TELEMETRY', '1') != '0'
+
+JOURNAL_NAME = 'jobs.jsonl'
+TOTALS_NAME = 'totals.json'
+PROMETHEUS_NAME = 'szimat.prom'
+
+
+# Один запуск ffmpeg: wall - секунды от запуска до завершения, user/system -
+# процессорное время, max_rss - пиковая память в байтах, frames и media_seconds -
+# сколько кадров и секунд результата записано (по выводу -progress)
+ProcessUsage = namedtuple('ProcessUsage', [
+    'wall', 'user', 'system', 'max_rss', 'frames', 'media_seconds'
+])
+
+
+_local = threading.local()
+_write_lock = threading.Lock()
+
+
+def telemetry_dir():
+    path = os.environ.get('SZIMAT_TELEMETRY_DIR')
+    if not path:
+        from media_probe import cache_dir
+        path = os.path.join(cache_dir(), 'telemetry')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _path_size(path):
+    """Размер файла; у папки (лесенка битрейтов) - суммарный"""
+    if not path or not os.path.exists(path):
+        return 0
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(entry.stat().st_size for entry in Path(path).rglob('*') if entry.is_file())
+
+
+class JobMetrics:
+    """Метрики одной задачи; запуски ffmpeg добавляются из любых потоков"""
+
+    def __init__(self, action, inputs, file_type=None, settings=None):
+        self.action = action
+        self.inputs = [inputs] if isinstance(inputs, str) else list(inputs)
+        self.file_type = file_type
+        self.settings = dict(settings or {})
+        self.plan = {}
+        self.outputs = []
+        self.started = time.time()
+        self._clock = time.perf_counter()
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.ffmpeg_seconds = 0.0
+        self.user = 0.0
+        self.system = 0.0
+        self.max_rss = 0
+        self.frames = 0
+        self.media_seconds = 0.0
+
+    def add_process(self, usage):
+        with self._lock:
+            self.runs += 1
+            self.ffmpeg_seconds += usage.wall
+            self.user += usage.user or 0.0
+            self.system += usage.system or 0.0
+            self.max_rss = max(self.max_rss, usage.max_rss or 0)
+            self.frames += usage.frames or 0
+            self.media_seconds += usage.media_seconds or 0.0
+
+    def annotate(self, **fields):
+        with self._lock:
+            self.plan.update((key, value) for key, value in fields.items() if value is not None)
+
+    def finish(self, outputs):
+        """Результат задачи: путь, список путей или None (пропущена)"""
+        if outputs is None:
+            outputs = []
+        elif isinstance(outputs, str):
+            outputs = [outputs]
+        self.outputs = [path for path in outputs if path]
+
+    def record(self, status, error=None):
+        """Строка журнала"""
+        import socket
+        from datetime import datetime, timezone
+        input_bytes = sum(_path_size(path) for path in self.inputs)
+        output_bytes = sum(_path_size(path) for path in self.outputs)
+        with self._lock:
+            busy = self.ffmpeg_seconds
+            return {
+                'time': datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+                'host': socket.gethostname(),
+                'pid': os.getpid(),
+                'action': self.action,
+                'type': self.file_type,
+                'status': status,
+                'error': error,
+                'inputs': self.inputs,
+                'outputs': self.outputs,
+                'settings': self.settings,
+                'plan': dict(self.plan),
+                'wall_seconds': round(time.perf_counter() - self._clock, 3),
+                'ffmpeg_runs': self.runs,
+                'ffmpeg_seconds': round(busy, 3),
+                'cpu_user_seconds': round(self.user, 3),
+                'cpu_system_seconds': round(self.system, 3),
+                'peak_rss_bytes': self.max_rss,
+                'frames': self.frames,
+                'media_seconds': round(self.media_seconds, 3),
+                # Средние по запускам ffmpeg: кадров и секунд результата за секунду работы
+                'fps': round(self.frames / busy, 2) if busy and self.frames else None,
+                'speed': round(self.media_seconds / busy, 3) if busy and self.media_seconds else None,
+                'input_bytes': input_bytes,
+                'output_bytes': output_bytes,
+                'ratio': round(output_bytes / input_bytes, 4) if input_bytes and output_bytes else None,
+            }
+
+
+def current():
+    """Метрики задачи текущего потока или None"""
+    return getattr(_local, 'job', None)
+
+
+@contextmanager
+def job(action, inputs, file_type=None, **settings):
+    """
+    Собирает метрики задачи, пока открыт контекст, и записывает их при выходе.
+    Вложенная задача (convert_formats -> convert_file) входит в наружную
+
+        with telemetry.job('compress', path, 'video', quality=quality) as metrics:
+            metrics.finish(compress(...))
+    """
+    outer = current()
+    if outer is not None:
+        yield outer
+        return
+    metrics = JobMetrics(action, inputs, file_type, settings)
+    _local.job = metrics
+    status, error = 'ok', None
+    try:
+        yield metrics
+        if not metrics.outputs:
+            status = 'skipped'
+    except BaseException as e:
+        status = 'error'
+        error = str(e) if not isinstance(e, SystemExit) else 'ffmpeg завершился с ошибкой'
+        raise
+    finally:
+        _local.job = None
+        if ENABLED:
+            write(metrics.record(status, error))
+
+
+def annotate(**fields):
+    """Добавляет к плану текущей задачи поля (None пропускаются)"""
+    metrics = current()
+    if metrics is not None:
+        metrics.annotate(**fields)
+
+
+def record_process(usage):
+    """Учитывает завершённый запуск ffmpeg в задаче текущего потока"""
+    metrics = current()
+    if metrics is not None:
+        metrics.add_process(usage)
+
+
+def bind(fn):
+    """
+    Обёртка fn для пула потоков: запуски ffmpeg в рабочих потоках
+    (сегменты, фрагменты подбора качества) учитываются в задаче вызывающего
+    """
+    metrics = current()
+    if metrics is None:
+        return fn
+
+    def bound(*args, **kwargs):
+        previous = current()
+        _local.job = metrics
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.job = previous
+
+    return bound
+
+
+# Использование ресурсов дочерним процессом
+
+def wait_with_usage(process):
+    """
+    Ждёт завершения процесса Popen и возвращает (user, system, max_rss) -
+    процессорное время в секундах и пиковую память в байтах (None, если узнать нельзя)
+    """
+    if sys.platform == 'win32':
+        process.wait()
+        try:
+            return _windows_usage(process)
+        except (OSError, AttributeError, ValueError):
+            return None, None, None
+    if not hasattr(os, 'wait4'):
+        process.wait()
+        return None, None, None
+    try:
+        _, status, usage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        # Процесс уже собран
+        process.wait()
+        return None, None, None
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    # ru_maxrss: в Linux - килобайты, в macOS - байты
+    max_rss = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+    return usage.ru_utime, usage.ru_stime, max_rss
+
+
+def _windows_usage(process):
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ('cb', wintypes.DWORD),
+            ('PageFaultCount', wintypes.DWORD),
+            ('PeakWorkingSetSize', ctypes.c_size_t),
+            ('WorkingSetSize', ctypes.c_size_t),
+            ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+            ('PagefileUsage', ctypes.c_size_t),
+            ('PeakPagefileUsage', ctypes.c_size_t),
+        ]
+
+    handle = wintypes.HANDLE(int(process._handle))
+    creation, exit_time, kernel, user = (wintypes.FILETIME() for _ in range(4))
+    if not ctypes.windll.kernel32.GetProcessTimes(
+            handle, ctypes.byref(creation), ctypes.byref(exit_time),
+            ctypes.byref(kernel), ctypes.byref(user)):
+        return None, None, None
+
+    def seconds(filetime):
+        # FILETIME - интервалы по 100 нс
+        return ((filetime.dwHighDateTime << 32) + filetime.dwLowDateTime) / 1e7
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    max_rss = None
+    if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+        max_rss = counters.PeakWorkingSetSize
+    return seconds(user), seconds(kernel), max_rss
+
+
+# Журнал и файл Prometheus
+
+@contextmanager
+def _file_lock(path):
+    """Блокировка между процессами (несколько окон и сервер очереди пишут в одну папку)"""
+    with open(path, 'a+b') as f:
+        if sys.platform == 'win32':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _atomic_write(path, text):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def write(record):
+    """Дописывает задачу в журнал и обновляет итоги; ошибки записи не прерывают работу"""
+    try:
+        directory = telemetry_dir()
+        with _write_lock, _file_lock(os.path.join(directory, '.lock')):
+            with open(os.path.join(directory, JOURNAL_NAME), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False, sort_keys=True) + '\n')
+            totals_path = os.path.join(directory, TOTALS_NAME)
+            try:
+                with open(totals_path, encoding='utf-8') as f:
+                    totals = json.load(f)
+            except (OSError, ValueError):
+                totals = {}
+            add_to_totals(totals, record)
+            _atomic_write(totals_path, json.dumps(totals, sort_keys=True))
+            prometheus_path = (os.environ.get('SZIMAT_PROMETHEUS_FILE')
+                               or os.path.join(directory, PROMETHEUS_NAME))
+            _atomic_write(prometheus_path, prometheus_text(totals))
+    except (OSError, ValueError, TypeError):
+        pass
+
+
+# Счётчики Prometheus: имя -> (тип, описание, поле записи или None - сама задача)
+COUNTERS = {
+    'szimat_jobs_total': ('counter', "Задачи по результату", None),
+    'szimat_job_wall_seconds_total': ('counter', "Время задач", 'wall_seconds'),
+    'szimat_ffmpeg_seconds_total': ('counter', "Время работы ffmpeg", 'ffmpeg_seconds'),
+    'szimat_ffmpeg_cpu_user_seconds_total': ('counter', "Процессорное время ffmpeg (user)",
+                                             'cpu_user_seconds'),
+    'szimat_ffmpeg_cpu_system_seconds_total': ('counter', "Процессорное время ffmpeg (system)",
+                                               'cpu_system_seconds'),
+    'szimat_frames_total': ('counter', "Записанные кадры", 'frames'),
+    'szimat_media_seconds_total': ('counter', "Записанные секунды результата", 'media_seconds'),
+    'szimat_input_bytes_total': ('counter', "Объём исходников", 'input_bytes'),
+    'szimat_output_bytes_total': ('counter', "Объём результатов", 'output_bytes'),
+    'szimat_ffmpeg_peak_rss_bytes': ('gauge', "Наибольшая пиковая память ffmpeg", 'peak_rss_bytes'),
+    'szimat_last_job_timestamp_seconds': ('gauge', "Время завершения последней задачи", None),
+}
+
+
+def _labels(record):
+    """Метки итогов: fps на пресете - szimat_frames_total / szimat_ffmpeg_seconds_total"""
+    plan = record.get('plan') or {}
+    return {
+        'action': record.get('action') or '',
+        'type': record.get('type') or '',
+        'status': record.get('status') or '',
+        'preset': str(plan.get('preset') or ''),
+    }
+
+
+def add_to_totals(totals, record):
+    """Добавляет задачу к итогам {метрика: {метки в JSON: значение}}"""
+    key = json.dumps(_labels(record), sort_keys=True)
+    for name, (kind, _, field) in COUNTERS.items():
+        series = totals.setdefault(name, {})
+        if name == 'szimat_jobs_total':
+            series[key] = series.get(key, 0) + 1
+        elif name == 'szimat_last_job_timestamp_seconds':
+            series[key] = time.time()
+        elif kind == 'gauge':
+            series[key] = max(series.get(key, 0), record.get(field) or 0)
+        else:
+            series[key] = series.get(key, 0) + (record.get(field) or 0)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(totals):
+    """Итоги в текстовом формате Prometheus"""
+    import socket
+    host = socket.gethostname()
+    lines = []
+    for name, (kind, description, _) in COUNTERS.items():
+        series = totals.get(name)
+        if not series:
+            continue
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for key in sorted(series):
+            labels = dict(json.loads(key), host=host)
+            text = ','.join(f'{label}="{_escape(value)}"' for label, value in sorted(labels.items()))
+            value = series[key]
+            lines.append(f"{name}{{{text}}} {round(value, 3) if isinstance(value, float) else value}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Оптимизация PNG сохраняет чанки управления цветом исходника.
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import zlib
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import png_optimize
+from media_probe import probe
+from toolchain import find_ffmpeg, find_ffprobe
+
+
+def make_chunk(kind, data):
+    return (len(data).to_bytes(4, 'big') + kind + data
+            + zlib.crc32(kind + data).to_bytes(4, 'big'))
+
+
+# Содержимое профиля не проверяется ни кодерами, ни оптимизацией - важно лишь,
+# что чанк доходит до результата байт в байт
+ICCP = make_chunk(b'iCCP', b'test profile\0\0' + zlib.compress(b'icc profile data' * 32))
+GAMA = make_chunk(b'gAMA', (45455).to_bytes(4, 'big'))
+
+
+@unittest.skipUnless(find_ffmpeg() and find_ffprobe(), "нужны ffmpeg и ffprobe")
+class ColorChunksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='szimat_test_')
+        self.path = os.path.join(self.work_dir, 'tagged.png')
+        # Без сжатия zlib: оптимизации точно есть что уменьшить
+        subprocess.run([
+            find_ffmpeg(), '-v', 'error', '-f', 'lavfi', '-i', 'testsrc2=size=96x64',
+            '-frames:v', '1', '-compression_level', '0', '-y', self.path
+        ], check=True, stdin=subprocess.DEVNULL)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        with open(self.path, 'wb') as f:
+            f.write(png_optimize.with_color_chunks(data, [ICCP, GAMA]))
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_iccp_tagged_input_keeps_color_chunks(self):
+        info = probe(self.path, find_ffprobe(), use_cache=False)
+        result = png_optimize.optimize_png(find_ffmpeg(), self.path, info)
+        self.assertIsNotNone(result.data)
+        self.assertLess(len(result.data), os.path.getsize(self.path))
+        chunks = png_optimize.read_chunks(result.data)
+        kinds = [kind for kind, _ in chunks]
+        self.assertEqual(kinds[0], b'IHDR')
+        self.assertEqual([chunk for kind, chunk in chunks if kind in png_optimize.COLOR_CHUNKS],
+                         [ICCP, GAMA])
+        # Чанки цвета должны идти до палитры и данных изображения
+        first_data = min(kinds.index(kind) for kind in (b'PLTE', b'IDAT') if kind in kinds)
+        self.assertLess(kinds.index(b'gAMA'), first_data)
+
+    def test_encoder_color_chunks_are_replaced(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        replaced = png_optimize.with_color_chunks(data, [])
+        kinds = [kind for kind, _ in png_optimize.read_chunks(replaced)]
+        self.assertNotIn(b'iCCP', kinds)
+        self.assertNotIn(b'gAMA', kinds)
+
+
+if __name__ == '__main__':
+    unittest.main()
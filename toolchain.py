@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Поиск ffmpeg/ffprobe и сведения об их возможностях.
+Программы ищутся один раз за процесс. Версия и списки кодеров и фильтров
+запоминаются на диске по пути и времени изменения ffmpeg, поэтому `-encoders`
+и `-filters` запускаются только после обновления ffmpeg
+"""
+
+import os
+import re
+import json
+import shutil
+import subprocess
+import threading
+from collections import namedtuple
+from functools import lru_cache
+from pathlib import Path
+
+from media_probe import cache_dir
+
+
+# Меняется при изменении формата записей - старый кэш игнорируется
+CACHE_VERSION = 1
+
+# Кодеры ffmpeg, которые без '-strict -2' не запускаются
+EXPERIMENTAL_ENCODERS = {'opus', 'vorbis'}
+
+
+# encoders и filters - множества имён или None, если ffmpeg не удалось опросить
+Toolchain = namedtuple('Toolchain', ['ffmpeg', 'ffprobe', 'version', 'encoders', 'filters'])
+
+
+@lru_cache(maxsize=1)
+def find_ffmpeg():
+    """Поиск ffmpeg в системе (выполняется один раз за процесс)"""
+    # Проверяем, установлен ли ffmpeg в PATH
+    ffmpeg_in_path = shutil.which('ffmpeg')
+    if ffmpeg_in_path:
+        return ffmpeg_in_path
+
+    # Получаем папку, где находится скрипт
+    try:
+        script_dir = Path(__file__).parent.absolute().resolve()
+    except OSError:
+        script_dir = Path.cwd()
+
+    # Проверяем папку проекта (где находится скрипт)
+    project_paths = [
+        script_dir / 'ffmpeg.exe',
+        script_dir / 'ffmpeg' / 'ffmpeg.exe',
+        script_dir / 'ffmpeg' / 'bin' / 'ffmpeg.exe',
+        script_dir / 'ffmpeg',
+    ]
+
+    for path in project_paths:
+        if path.is_file():
+            return str(path)
+
+    # Проверяем возможные стандартные пути установки
+    possible_paths = [
+        r'C:\ffmpeg\bin\ffmpeg.exe',
+        r'C:\ffmpeg\ffmpeg.exe',
+        r'C:\Program Files\ffmpeg\bin\ffmpeg.exe',
+        r'C:\Program Files (x86)\ffmpeg\bin\ffmpeg.exe',
+        r'C:\Program Files\ffmpeg\ffmpeg.exe',
+        r'C:\Program Files (x86)\ffmpeg\ffmpeg.exe',
+    ]
+
+    for path in possible_paths:
+        if os.path.exists(path):
+            return path
+
+    return None
+
+
+@lru_cache(maxsize=1)
+def find_ffprobe():
+    """Поиск ffprobe: в PATH или рядом с ffmpeg (выполняется один раз за процесс)"""
+    ffprobe_in_path = shutil.which('ffprobe')
+    if ffprobe_in_path:
+        return ffprobe_in_path
+    ffmpeg_path = find_ffmpeg()
+    if ffmpeg_path:
+        ffmpeg = Path(ffmpeg_path)
+        candidate = ffmpeg.with_name(ffmpeg.name.lower().replace('ffmpeg', 'ffprobe'))
+        if candidate.exists():
+            return str(candidate)
+    return None
+
+
+def _run(cmd):
+    try:
+        completed = subprocess.run(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            stdin=subprocess.DEVNULL, timeout=30
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if completed.returncode != 0:
+        return None
+    return completed.stdout.decode('utf-8', errors='replace')
+
+
+_ENCODER_RE = re.compile(r'^\s*[VASFXBD.]{6}\s+(\S+)')
+_FILTER_RE = re.compile(r'^\s*[TSC.]{2,3}\s+(\S+)\s+\S*->\S*')
+
+
+def parse_encoders(text):
+    """Имена кодеров из вывода `ffmpeg -encoders`"""
+    # Список начинается после строки-разделителя ' ------'
+    _, _, listing = text.partition('------')
+    names = set()
+    for line in listing.splitlines():
+        match = _ENCODER_RE.match(line)
+        if match and match.group(1) != '=':
+            names.add(match.group(1))
+    return names
+
+
+def parse_filters(text):
+    """Имена фильтров из вывода `ffmpeg -filters`"""
+    names = set()
+    for line in text.splitlines():
+        match = _FILTER_RE.match(line)
+        if match:
+            names.add(match.group(1))
+    return names
+
+
+def query_capabilities(ffmpeg_path):
+    """Опрашивает ffmpeg: (версия, кодеры, фильтры)"""
+    version_text = _run([ffmpeg_path, '-hide_banner', '-version'])
+    encoders_text = _run([ffmpeg_path, '-hide_banner', '-encoders'])
+    filters_text = _run([ffmpeg_path, '-hide_banner', '-filters'])
+    version = None
+    if version_text:
+        match = re.match(r'ffmpeg version (\S+)', version_text)
+        version = match.group(1) if match else None
+    return (
+        version,
+        parse_encoders(encoders_text) if encoders_text else None,
+        parse_filters(filters_text) if filters_text else None,
+    )
+
+
+_cache_lock = threading.Lock()
+
+
+def _cache_path():
+    return os.path.join(cache_dir(), 'toolchain.json')
+
+
+def _load_capabilities(ffmpeg_path):
+    stat = os.stat(ffmpeg_path)
+    key = f"{os.path.abspath(ffmpeg_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    with _cache_lock:
+        try:
+            with open(_cache_path(), encoding='utf-8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = {}
+        record = cached.get(key)
+        if record and record.get('v') == CACHE_VERSION:
+            return (
+                record['version'],
+                set(record['encoders']) if record['encoders'] is not None else None,
+                set(record['filters']) if record['filters'] is not None else None,
+            )
+
+        version, encoders, filters = query_capabilities(ffmpeg_path)
+        if encoders is not None and filters is not None:
+            # Записи других путей сохраняются, прежние версии того же пути - нет
+            cached = {k: v for k, v in cached.items()
+                      if not k.startswith(os.path.abspath(ffmpeg_path) + '|')}
+            cached[key] = {
+                'v': CACHE_VERSION,
+                'version': version,
+                'encoders': sorted(encoders),
+                'filters': sorted(filters),
+            }
+            try:
+                tmp_path = _cache_path() + f".{os.getpid()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(cached, f)
+                os.replace(tmp_path, _cache_path())
+            except OSError:
+                pass
+        return version, encoders, filters
+
+
+@lru_cache(maxsize=1)
+def get_toolchain():
+    """
+    Найденные программы и их возможности
+
+    Returns:
+        Toolchain (ffmpeg None, если ffmpeg не найден)
+    """
+    ffmpeg_path = find_ffmpeg()
+    if not ffmpeg_path:
+        return Toolchain(None, find_ffprobe(), None, None, None)
+    try:
+        version, encoders, filters = _load_capabilities(ffmpeg_path)
+    except OSError:
+        version, encoders, filters = None, None, None
+    return Toolchain(ffmpeg_path, find_ffprobe(), version, encoders, filters)
+
+
+def has_encoder(name):
+    """Есть ли кодер в ffmpeg (если опросить не удалось - считаем, что есть)"""
+    encoders = get_toolchain().encoders
+    return encoders is None or name in encoders
+
+
+def has_filter(name):
+    """Есть ли фильтр в ffmpeg (если опросить не удалось - считаем, что есть)"""
+    filters = get_toolchain().filters
+    return filters is None or name in filters
+
+
+def pick_encoder(candidates):
+    """Первый доступный кодер из списка предпочтений или None"""
+    for name in candidates:
+        if has_encoder(name):
+            return name
+    return None
+
+
+def encoder_args(name):
+    """Дополнительные параметры, без которых кодер не запустится"""
+    return ['-strict', '-2'] if name in EXPERIMENTAL_ENCODERS else []
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Превью видео: постер, контактный лист N x M и (по желанию) короткая анимация.
+Декодируются только ключевые кадры: для каждой точки ffmpeg переходит к ближайшему
+ключевому кадру (-ss без точного поиска) и декодирует лишь его (-skip_frame nokey),
+поэтому превью двухчасового фильма не требует его полного декодирования.
+Все точки обрабатываются одним запуском ffmpeg, постер выбирается фильтром
+thumbnail среди тех же кадров. Результаты хранятся в кэше результатов по отпечатку
+исходника: повторная генерация для всей медиатеки занимает секунды
+
+    python video_preview.py "видео.mp4" "D:\\Видео" --grid 5x4 --animated
+"""
+
+import os
+import sys
+import sqlite3
+import argparse
+from collections import namedtuple
+from pathlib import Path
+
+from ffmpeg_progress import run_ffmpeg
+from media_probe import probe
+from toolchain import find_ffmpeg, find_ffprobe, has_encoder
+from output_cache import get_output_cache, job_key, content_fingerprint
+
+
+# Контактный лист: столбцы x строки и ширина одной ячейки
+DEFAULT_GRID = (5, 4)
+TILE_WIDTH = 320
+
+# Постер не шире POSTER_WIDTH (меньшие кадры не увеличиваются)
+POSTER_WIDTH = 1280
+
+# Анимация: кадров в секунду (каждый - отдельная точка видео) и ширина
+ANIMATION_FPS = 2
+ANIMATION_WIDTH = 480
+
+
+PreviewResult = namedtuple('PreviewResult', ['poster', 'sheet', 'animation'])
+
+# Метки в именах превью (см. preview_paths)
+PREVIEW_MARKERS = ('.poster', '.sheet', '.preview')
+
+
+class PreviewError(Exception):
+    """Превью не удалось построить"""
+
+
+def parse_grid(text):
+    """'5x4' -> (5, 4)"""
+    try:
+        columns, rows = (int(part) for part in text.lower().replace('х', 'x').split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"неверная сетка: {text} (нужно, например, 5x4)")
+    if columns < 1 or rows < 1:
+        raise argparse.ArgumentTypeError(f"неверная сетка: {text}")
+    return columns, rows
+
+
+def sample_times(duration, count):
+    """Точки на равных долях длительности; крайние отстоят от начала и конца на полшага"""
+    return [duration * (i + 0.5) / count for i in range(count)]
+
+
+def animation_format():
+    """WebP, если в ffmpeg есть кодер анимации, иначе GIF"""
+    return 'webp' if has_encoder('libwebp_anim') else 'gif'
+
+
+def preview_paths(input_path, animated=False):
+    """Имена превью рядом с исходником: <имя>.poster.jpg, <имя>.sheet.jpg, <имя>.preview.webp"""
+    path = Path(input_path)
+    base = str(path.parent / path.stem)
+    return PreviewResult(
+        f"{base}.poster.jpg",
+        f"{base}.sheet.jpg",
+        f"{base}.preview.{animation_format()}" if animated else None,
+    )
+
+
+def is_preview(path):
+    """Создан ли файл как превью (<имя>.poster.jpg, <имя>.sheet.jpg, <имя>.preview.webp)"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return stem.lower().endswith(PREVIEW_MARKERS)
+
+
+def build_command(ffmpeg_path, input_path, info, outputs, grid=DEFAULT_GRID):
+    """
+    Команда ffmpeg: вход на каждую точку с переходом к ключевому кадру, кадры
+    склеиваются в одну последовательность и расходятся на постер, лист и анимацию
+
+    Args:
+        outputs: PreviewResult с путями (None - не создавать)
+    """
+    columns, rows = grid
+    count = columns * rows
+    video_index = info.video.index
+
+    cmd = [ffmpeg_path]
+    for time_point in sample_times(info.duration, count):
+        cmd.extend(['-skip_frame', 'nokey', '-noaccurate_seek',
+                    '-ss', f"{time_point:.3f}", '-i', input_path])
+
+    # Все кадры одного видео одного размера - concat их принимает
+    graph = [
+        f"[{i}:{video_index}]trim=end_frame=1,setpts=PTS-STARTPTS,"
+        f"scale='min({POSTER_WIDTH},iw)':-2,setsar=1[f{i}]"
+        for i in range(count)
+    ]
+    wanted = [name for name in PreviewResult._fields if getattr(outputs, name)]
+    graph.append(''.join(f"[f{i}]" for i in range(count))
+                 + f"concat=n={count}:v=1:a=0,split={len(wanted)}"
+                 + ''.join(f"[{name}_in]" for name in wanted))
+    if outputs.poster:
+        graph.append(f"[poster_in]thumbnail=n={count}[poster]")
+    if outputs.sheet:
+        graph.append(
+            f"[sheet_in]scale={TILE_WIDTH}:-2,"
+            f"tile={columns}x{rows}:padding=4:margin=4[sheet]"
+        )
+    if outputs.animation:
+        animation = (f"[animation_in]scale='min({ANIMATION_WIDTH},iw)':-2,"
+                     f"setpts=N/{ANIMATION_FPS}/TB")
+        if outputs.animation.endswith('.gif'):
+            animation += ",split[anim_a][anim_b];[anim_a]palettegen[palette];" \
+                         "[anim_b][palette]paletteuse"
+        graph.append(animation + "[animation]")
+    cmd.extend(['-filter_complex', ';'.join(graph)])
+
+    if outputs.poster:
+        cmd.extend(['-map', '[poster]', '-frames:v', '1', '-q:v', '2', '-y', outputs.poster])
+    if outputs.sheet:
+        cmd.extend(['-map', '[sheet]', '-frames:v', '1', '-q:v', '3', '-y', outputs.sheet])
+    if outputs.animation:
+        cmd.extend(['-map', '[animation]', '-r', str(ANIMATION_FPS), '-loop', '0'])
+        if outputs.animation.endswith('.webp'):
+            cmd.extend(['-c:v', 'libwebp_anim', '-quality', '70'])
+        cmd.extend(['-y', outputs.animation])
+    return cmd
+
+
+def make_previews(input_path, grid=DEFAULT_GRID, animated=False, ffmpeg_path=None):
+    """
+    Создаёт превью видео рядом с ним (готовые берутся из кэша результатов)
+
+    Returns:
+        PreviewResult с путями (animation - None, если анимация не нужна)
+    """
+    ffmpeg_path = ffmpeg_path or find_ffmpeg()
+    if not ffmpeg_path:
+        raise PreviewError("ffmpeg не найден")
+    targets = preview_paths(input_path, animated)
+
+    cache = get_output_cache()
+    keys = {}
+    pending = {}
+    if cache:
+        try:
+            fingerprint = content_fingerprint(input_path)
+            for name, path in targets._asdict().items():
+                if not path:
+                    continue
+                keys[name] = job_key(fingerprint, {
+                    'action': 'preview', 'kind': name, 'grid': list(grid),
+                    'format': os.path.splitext(path)[1],
+                })
+                if not cache.fetch(keys[name], path):
+                    pending[name] = path
+        except (sqlite3.Error, OSError):
+            cache = None
+    if not cache:
+        pending = {name: path for name, path in targets._asdict().items() if path}
+    if not pending:
+        return targets
+
+    info = probe(input_path, find_ffprobe())
+    if not info or not info.video or not info.duration:
+        raise PreviewError("не удалось определить видеопоток и длительность")
+    outputs = PreviewResult(*(pending.get(name) for name in PreviewResult._fields))
+    cmd = build_command(ffmpeg_path, input_path, info, outputs, grid)
+    returncode, log = run_ffmpeg(cmd, report=False)
+    if returncode != 0:
+        for path in pending.values():
+            if os.path.exists(path):
+                os.remove(path)
+        raise PreviewError(log)
+
+    if cache:
+        for name, path in pending.items():
+            try:
+                cache.store(keys[name], path)
+            except (sqlite3.Error, OSError):
+                pass
+    return targets
+
+
+def main():
+    """Превью для файлов и папок из командной строки"""
+    from compress_video import collect_input_files
+    from media_probe import detect_file_type
+
+    parser = argparse.ArgumentParser(description="Постер, контактный лист и анимация видео")
+    parser.add_argument('paths', nargs='+', help="Видео, папки или шаблоны")
+    parser.add_argument('--grid', type=parse_grid, default=DEFAULT_GRID,
+                        help="Сетка контактного листа, например 5x4")
+    parser.add_argument('--animated', action='store_true',
+                        help="Создать также короткую анимацию из тех же кадров")
+    args = parser.parse_args()
+
+    files = [path for path in collect_input_files(args.paths)
+             if detect_file_type(path) == 'video']
+    if not files:
+        print("ОШИБКА: Не найдено ни одного видео")
+        sys.exit(1)
+    ffmpeg_path = find_ffmpeg()
+    failed = 0
+    for path in files:
+        try:
+            result = make_previews(path, args.grid, args.animated, ffmpeg_path)
+        except PreviewError as e:
+            failed += 1
+            print(f"ОШИБКА: {os.path.basename(path)}: {e}")
+            continue
+        print(f"✓ {os.path.basename(path)}")
+        for created in result:
+            if created:
+                print(f"  {created}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
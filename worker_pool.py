@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Пул рабочих потоков для пакетной обработки файлов.
+Размер пула подбирается по числу ядер, а каждая задача занимает
+столько "слотов", сколько потоков ей нужно в зависимости от типа файла
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def cpu_count():
+    """Возвращает число доступных процессору ядер"""
+    try:
+        return len(os.sched_getaffinity(0)) or 1
+    except (AttributeError, OSError):
+        return os.cpu_count() or 1
+
+
+def job_weight(file_type, capacity):
+    """
+    Сколько слотов пула занимает задача данного типа.
+    Видео кодируется x264 в несколько потоков, поэтому одновременно
+    идут не больше двух видео; аудио и изображения почти однопоточны.
+    """
+    if file_type == 'video':
+        return min(capacity, max(2, capacity // 2))
+    return 1
+
+
+class WorkerPool:
+    """
+    Ограниченный пул задач с весами.
+    Задачи запускаются в порядке поступления, пока суммарный вес
+    выполняющихся задач не превышает число ядер.
+    """
+
+    def __init__(self, capacity=None):
+        self.capacity = max(1, capacity or cpu_count())
+        self._executor = ThreadPoolExecutor(max_workers=self.capacity)
+        self._cond = threading.Condition()
+        self._used = 0
+        self._next_ticket = 0
+        self._serving = 0
+
+    def threads_for(self, file_type):
+        """Число потоков ffmpeg для задачи данного типа"""
+        return job_weight(file_type, self.capacity)
+
+    def _acquire(self, weight):
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            # Строгая очередь: тяжёлая задача не голодает за лёгкими
+            while ticket != self._serving or self._used + weight > self.capacity:
+                self._cond.wait()
+            self._used += weight
+            self._serving += 1
+            self._cond.notify_all()
+
+    def _release(self, weight):
+        with self._cond:
+            self._used -= weight
+            self._cond.notify_all()
+
+    def submit(self, file_type, fn, *args, **kwargs):
+        """Ставит задачу в очередь, возвращает Future"""
+        weight = self.threads_for(file_type)
+
+        def run():
+            self._acquire(weight)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._release(weight)
+
+        return self._executor.submit(run)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        return False